@@ -0,0 +1,75 @@
+"""
+Benchmark of the numpy and tensorflow backends of the cusum_deforest function.
+
+For each backend a fresh interpreter imports the helpers package, loads the 
+backend and runs cusum_deforest over synthetic points, reporting import time, 
+peak memory (max. RSS) and throughput.
+
+    python benchmarks/cusum_backends.py --points 200 --length 150 --bootstraps 1000
+"""
+import json
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+
+WORKER = '''
+import json, resource, sys, time
+sys.path.insert(0, {repo!r})
+
+start = time.perf_counter()
+import helpers
+from helpers.ts_analysis.cusum import cusum_deforest, get_backend
+get_backend({backend!r})
+import_time = time.perf_counter() - start
+
+import numpy as np
+rng = np.random.default_rng(42)
+args_list = []
+for point_id in range({points}):
+    ts = rng.normal(0.7, 0.05, {length})
+    ts[{length} // 2:] -= 0.2
+    dates = list(2014 + np.arange({length}) / 23)
+    args_list.append([ts.tolist(), dates, point_id, {bootstraps}, {backend!r}])
+
+start = time.perf_counter()
+for args in args_list:
+    cusum_deforest(args)
+run_time = time.perf_counter() - start
+
+print(json.dumps(dict(
+    import_time=import_time, 
+    points_per_sec={points} / run_time, 
+    peak_memory_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+)))
+'''
+
+
+def run_backend(backend, points, length, bootstraps):
+    
+    code = WORKER.format(repo=str(REPO), backend=backend, points=points, length=length, bootstraps=bootstraps)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return dict(error=result.stderr.strip().splitlines()[-1])
+    
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=200)
+    parser.add_argument('--length', type=int, default=150)
+    parser.add_argument('--bootstraps', type=int, default=1000)
+    parser.add_argument('--backends', nargs='+', default=['numpy', 'tensorflow'])
+    args = parser.parse_args()
+    
+    print(f'{"backend":<12}{"import [s]":>12}{"peak RSS [MB]":>16}{"points/sec":>12}')
+    for backend in args.backends:
+        r = run_backend(backend, args.points, args.length, args.bootstraps)
+        if 'error' in r:
+            print(f'{backend:<12} failed: {r["error"]}')
+        else:
+            print(f'{backend:<12}{r["import_time"]:>12.2f}{r["peak_memory_mb"]:>16.0f}{r["points_per_sec"]:>12.1f}')
@@ -0,0 +1,103 @@
+"""
+Benchmark of structure_ts_data on a synthetic feature collection download.
+
+Compares the grouped implementation against the former per-point loop 
+(kept below as reference) and checks that both return the same series.
+
+    python benchmarks/structure_ts_data.py --rows 100000 --points 2000
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from helpers.ee.get_time_series import structure_ts_data
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+
+def structure_ts_data_loop(df, point_id_name):
+    """
+    Former implementation, filtering the whole table once per point
+    """
+    
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.imageID.apply(lambda x: x.split('_')[-1]), format='%Y%m%d'))
+    
+    d, ts_list, dates_list = {}, [], []
+    for i, point in enumerate(df[point_id_name].unique()):
+        
+        sub = df[df[point_id_name] == point].sort_index()
+        sub['pathrow'] = sub.imageID.apply(lambda x: x.split('_')[-2])
+        
+        if len(sub.pathrow.unique()) > 1:
+            length = -1
+            for pathrow in sub.pathrow.unique():
+                l = len(sub[sub.pathrow == pathrow])
+                if l > length:
+                    pr = pathrow
+                    length = l
+            sub = sub[sub.pathrow == pr]
+        
+        d[i] = dict(point_idx=i, point_id=point, images=len(sub), geometry=sub.geometry.head(1).values[0])
+        ts_list.append(sub.pixel_value.to_numpy())
+        dates_list.append(sub.index)
+    
+    gdf = gpd.GeoDataFrame(pd.DataFrame.from_dict(d, orient='index')).set_geometry('geometry')
+    return gdf, TimeSeriesStore.from_lists(ts_list, dates_list)
+
+
+def synthetic_collection(rows, points, seed=42):
+    """
+    Feature collection as downloaded by get_time_series, with points 
+    covered by one or two path/rows
+    """
+    
+    rng = np.random.default_rng(seed)
+    point_ids = rng.integers(0, points, rows)
+    pathrows = np.where(rng.random(rows) < 0.6, '168060', '167060')
+    dates = (np.datetime64('2010-01-01') + rng.integers(0, 9 * 365, rows)).astype('datetime64[D]')
+    image_ids = [f'LC08_{pr}_{d.strftime("%Y%m%d")}' for pr, d in zip(pathrows, dates.astype('O'))]
+    
+    x, y = 36 + point_ids % 100 / 400, -1 + point_ids // 100 / 400
+    gdf = gpd.GeoDataFrame(
+        dict(Point_ID=point_ids, imageID=image_ids, pixel_value=rng.integers(2000, 9000, rows)), 
+        geometry=gpd.points_from_xy(x, y), 
+        crs='EPSG:4326'
+    )
+    
+    # a point is sampled only once per image
+    return gdf.drop_duplicates(['Point_ID', 'imageID'], ignore_index=True)
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--points', type=int, default=2000)
+    args = parser.parse_args()
+    
+    gdf = synthetic_collection(args.rows, args.points)
+    
+    timings, results = {}, {}
+    for name, func in [('loop', structure_ts_data_loop), ('grouped', structure_ts_data)]:
+        start = time.perf_counter()
+        results[name] = func(gdf.copy(), 'Point_ID')
+        timings[name] = time.perf_counter() - start
+    
+    (df_loop, store_loop), (df_grouped, store_grouped) = results['loop'], results['grouped']
+    identical = (
+        df_loop.point_id.tolist() == df_grouped.point_id.tolist()
+        and np.array_equal(store_loop.values, store_grouped.values)
+        and np.array_equal(store_loop.dates, store_grouped.dates)
+        and np.array_equal(store_loop.lengths, store_grouped.lengths)
+    )
+    
+    print(f'{len(gdf)} rows, {args.points} points')
+    for name, seconds in timings.items():
+        print(f'{name:<10}{seconds:>10.2f} s')
+    print(f'speedup   {timings["loop"] / timings["grouped"]:>10.1f} x')
+    print(f'identical {identical}')
@@ -7,6 +7,12 @@ from helpers.ts_analysis.cusum import run_cusum_deforest, cusum_deforest
 from helpers.ts_analysis.bfast_wrapper import run_bfast_monitor
 from helpers.ts_analysis.bootstrap_slope import run_bs_slope
 from helpers.ts_analysis.timescan import run_timescan_metrics
+from helpers.ts_analysis.ccdc import run_ccdc
 from helpers.ts_analysis.helpers import subset_ts
+from helpers.ts_analysis.ts_store import TimeSeriesStore
 
-from helpers.get_change_data import get_change_data
\ No newline at end of file
+from helpers.get_change_data import get_change_data
+from helpers.results import finalise_results, read_results
+from helpers.checkpoint import CheckpointStore
+from helpers.ts_cache import TimeSeriesCache
+from helpers.analysis import run_analysis
\ No newline at end of file
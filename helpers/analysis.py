@@ -0,0 +1,325 @@
+import json
+import time
+import hashlib
+from pathlib import Path
+from datetime import timedelta
+
+import numpy as np
+from godale import Executor
+
+from helpers.ts_analysis.cusum import run_cusum_deforest
+from helpers.ts_analysis.bfast_wrapper import run_bfast_monitor
+from helpers.ts_analysis.bootstrap_slope import run_bs_slope
+from helpers.ts_analysis.timescan import run_timescan_metrics, timescan_columns
+from helpers.ts_analysis.ccdc import run_ccdc, runs_locally
+from helpers.ts_analysis.helpers import subset_ts
+from helpers.checkpoint import CheckpointStore
+from helpers.ts_cache import TimeSeriesCache
+from helpers.results import finalise_results
+from helpers.stage_cache import StageCache, data_fingerprint
+
+# analysis stages in order of execution: parameter dict of the config, stage function,
+# output columns (or a function of the stage parameters returning them) and if the
+# stage runs on the monitoring period only. A stage function takes the TimeSeriesStore,
+# its parameters and the executor parameters and returns a dict of result columns
+# aligned with the points of the store, optionally with a boolean 'failed' entry.
+# Multiband stages run once on all extracted bands instead of per analysis band,
+# 'enabled' optionally decides on the stage parameters if a selected stage runs here.
+# Stages flagged 'start_monitor' run on the full series but only report changes after
+# it, taken from their parameters or by default from ts_params (see stage_params)
+STAGES = {
+    'ccdc': {
+        'params': 'ccdc_params',
+        'run': run_ccdc,
+        'columns': ['ccdc_change_date', 'ccdc_magnitude'],
+        'monitoring': False,
+        'multiband': True,
+        'start_monitor': True,
+        'enabled': runs_locally
+    },
+    'bfast': {
+        'params': 'bfast_params',
+        'run': run_bfast_monitor,
+        'columns': ['bfast_change_date', 'bfast_magnitude', 'bfast_means'],
+        'monitoring': False
+    },
+    'cusum': {
+        'params': 'cusum_params',
+        'run': run_cusum_deforest,
+        'columns': ['cusum_change_date', 'cusum_confidence', 'cusum_magnitude'],
+        'monitoring': True
+    },
+    'ts_metrics': {
+        'params': 'ts_metrics_params',
+        'run': run_timescan_metrics,
+        'columns': timescan_columns,
+        'monitoring': True
+    },
+    'bs_slope': {
+        'params': 'bs_slope_params',
+        'run': run_bs_slope,
+        'columns': ['bs_slope_mean', 'bs_slope_sd', 'bs_slope_min', 'bs_slope_max'],
+        'monitoring': True
+    },
+}
+
+
+def stage_columns(name, config_dict):
+    """ Returns the output columns of an analysis stage
+    """
+    stage = STAGES[name]
+    columns = stage['columns']
+    return columns(config_dict[stage['params']]) if callable(columns) else columns
+
+
+def stage_params(name, config_dict):
+    """ Returns the parameters of an analysis stage, completed with the start of the monitoring period if flagged
+    """
+    stage = STAGES[name]
+    params = config_dict[stage['params']]
+    if stage.get('start_monitor') and params.get('start_monitor') is None:
+        params = dict(params, start_monitor=config_dict['ts_params']['start_monitor'])
+    return params
+
+
+def stage_keys(config_dict):
+    """
+    Returns a hash of the parameters of each selected analysis stage
+
+    Stages on the monitoring period, or reporting changes after its start,
+    also depend on its start.
+    """
+    keys = {}
+    for name, stage in STAGES.items():
+        params = config_dict.get(stage['params']) or {'run': False}
+        if not params['run'] or not stage.get('enabled', bool)(params):
+            continue
+
+        params = {k: v for k, v in stage_params(name, config_dict).items() if k != 'run'}
+        params['columns'] = [*stage_columns(name, config_dict), f'{name}_status']
+        if stage['monitoring']:
+            params['start_monitor'] = config_dict['ts_params']['start_monitor']
+        keys[name] = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    return keys
+
+
+def run_stage(name, df, store, config_dict):
+    """
+    Runs an analysis stage and assigns its result columns to df by position
+
+    Points the stage failed on get NaN results and 'failed' in the
+    {name}_status column instead of being dropped, a stage failing as a
+    whole marks all points as failed.
+    """
+    stage = STAGES[name]
+    try:
+        results = stage['run'](store, stage_params(name, config_dict), config_dict.get('executor_params'))
+        failed = results.pop('failed', np.zeros(len(store), dtype=bool))
+    except ValueError:
+        print(f"{name} stage failed")
+        results, failed = {}, np.ones(len(store), dtype=bool)
+
+    columns = {
+        column: np.where(failed, np.nan, results.get(column, np.nan)).astype('float64')
+        for column in stage_columns(name, config_dict)
+    }
+    columns[f'{name}_status'] = np.where(failed, 'failed', 'ok')
+    return df.assign(**columns)
+
+
+def cached_stage(name, df, store, config_dict, keys, stage_cache=None, fingerprint=None):
+    """
+    Runs an analysis stage, or takes its result columns from the stage cache
+
+    Returns df and the fingerprint of the input data, to be reused
+    by the next stages on the same data.
+    """
+    if stage_cache is None:
+        return run_stage(name, df, store, config_dict), fingerprint
+
+    fingerprint = fingerprint or data_fingerprint(df, store)
+    key = stage_cache.key(name, keys[name], fingerprint)
+    cached = stage_cache.get(name, key)
+    if cached is None:
+        df = run_stage(name, df, store, config_dict)
+        stage_cache.put(name, key, df[['point_id', *stage_columns(name, config_dict), f'{name}_status']])
+    else:
+        # the fingerprint covers the point order, so cached rows align with df
+        df = df.assign(**{column: cached[column].to_numpy() for column in cached.columns if column != 'point_id'})
+
+    return df, fingerprint
+
+
+def analysis_bands(config_dict):
+    """ Bands the per-band stages run on: ts_params['analysis_bands'], by default the extracted ts_params['band']
+    """
+    bands = config_dict['ts_params'].get('analysis_bands') or config_dict['ts_params']['band']
+    return [bands] if isinstance(bands, str) else list(bands)
+
+
+def analyse_band(df, store, config_dict, stage_cache=None):
+    """
+    Runs the selected time-series analysis stages on a single band store
+
+    Returns
+    -------
+    df, store
+        results and the time-series of the monitoring period
+    """
+
+    keys = stage_keys(config_dict)
+
+    monitoring, fingerprint = False, None
+    for name, stage in STAGES.items():
+
+        if stage.get('multiband'):
+            continue
+
+        ### THINGS WE RUN WITHOUT HISTORIC PERIOD #####
+        if stage['monitoring'] and not monitoring:
+            # we cut ts data to monitoring period only (a view on the same buffers)
+            store = subset_ts(store, config_dict['ts_params']['start_monitor'])
+            df['mon_images'] = store.lengths
+            monitoring, fingerprint = True, None
+
+        if name not in keys:
+            continue
+
+        # the input data only changes with the monitoring period cut
+        df, fingerprint = cached_stage(name, df, store, config_dict, keys, stage_cache, fingerprint)
+
+    return df, store
+
+
+def analyse_cell(df, store, config_dict, stage_cache=None):
+    """
+    CPU part of a grid cell: runs the selected time-series analysis stages
+
+    Multiband stages (the local CCDC) run first on all extracted bands. The
+    other stages run on each band of ts_params['analysis_bands'] (default:
+    ts_params['band']), for several analysis bands their output columns get
+    the band name as suffix, e.g. bfast_magnitude_ndvi. Only the analysis
+    bands are kept with the results.
+
+    Parameters
+    ----------
+    df : GeoDataFrame
+        point table of the grid cell
+    store : TimeSeriesStore
+        time-series of the points, in the order of df
+    config_dict : dict
+        configuration of the run
+    stage_cache : StageCache, optional
+        cache of the stage outputs, stages whose parameters and input data
+        did not change are taken from it instead of being recomputed
+
+    Returns
+    -------
+    df, store
+        results and the time-series of the monitoring period
+    """
+
+    keys, fingerprint = stage_keys(config_dict), None
+    for name, stage in STAGES.items():
+        if stage.get('multiband') and name in keys:
+            df, fingerprint = cached_stage(name, df, store, config_dict, keys, stage_cache, fingerprint)
+
+    if store.nr_of_bands > 1:
+        store = store.select(analysis_bands(config_dict))
+    if store.nr_of_bands == 1:
+        df, store = analyse_band(df, store, config_dict, stage_cache)
+        # only the monitoring period series are kept with the results
+        return df, store.compact()
+
+    for band in store.bands:
+        results, _ = analyse_band(df[['point_id']].copy(), store.band(band), config_dict, stage_cache)
+        df = df.assign(**{
+            f'{column}_{band}': results[column].to_numpy() 
+            for column in results.columns if column not in ('point_id', 'mon_images')
+        })
+
+    # all bands share the dates and thus the monitoring period
+    store = subset_ts(store, config_dict['ts_params']['start_monitor'])
+    df['mon_images'] = store.lengths
+    return df, store.compact()
+
+
+def analyse_cached_cell(idx, cache_dir, config_dict):
+    """
+    Analyses a grid cell of the time-series cache, reusing cached stage outputs
+    """
+
+    start_time = time.time()
+    df, store = TimeSeriesCache(cache_dir).read_result(idx)
+    df, store = analyse_cell(df, store, config_dict, StageCache.from_config(config_dict))
+    return idx, df, store, time.time() - start_time
+
+
+def run_analysis(work_dir, config_dict=None):
+    """
+    Runs the analysis stages on the time-series cache of a work_dir
+
+    No Earth Engine access is needed, the series extracted by get_change_data
+    are read from the memory-mapped cache and the grid cells are analysed in
+    parallel on executor_params['workers'] processes. Stages whose parameters
+    and input data did not change are taken from the stage cache instead of
+    being recomputed. The results replace the ones of the work_dir and are
+    merged as by get_change_data.
+
+    Parameters
+    ----------
+    work_dir : str or Path
+        work_dir of a previous get_change_data run
+    config_dict : dict, optional
+        configuration with the (new) analysis parameters, by default
+        the configuration stored in the work_dir
+    """
+
+    work_dir = Path(work_dir)
+    config_file = work_dir.joinpath("config.json")
+    if config_dict is None:
+        with open(config_file, "r") as f:
+            config_dict = json.load(f)
+    else:
+        with open(config_file, "w") as f:
+            json.dump(config_dict, f)
+
+    cache = TimeSeriesCache.for_work_dir(work_dir)
+    checkpoints = CheckpointStore(work_dir)
+    stage_cache = StageCache.from_config(config_dict)
+    if stage_cache is not None:
+        stage_cache.reset_stats()
+
+    # cells without points are taken over as they are
+    cells = []
+    for idx, status in cache.statuses().items():
+        if status == 'done':
+            cells.append(idx)
+        else:
+            checkpoints.record(idx, status)
+
+    # the cells are distributed over the processes, so the stages run serially inside
+    executor_params = config_dict.get('executor_params') or {}
+    analysis_config = dict(config_dict, executor_params=dict(executor_params, executor='serial'))
+    print(f' Analysing {len(cells)} cached grid cells on {executor_params.get("workers")} processes.')
+
+    executor = Executor(executor="concurrent_processes", max_workers=executor_params.get('workers'))
+    for task in executor.as_completed(
+        func=analyse_cached_cell,
+        iterable=cells,
+        fargs=[str(cache.work_dir), analysis_config]
+    ):
+        try:
+            idx, df, store, elapsed = task.result()
+        except ValueError:
+            print("gridcell task failed")
+            continue
+        checkpoints.write_result(idx, df, store, elapsed)
+        print(f' Grid cell {idx} with {len(df)} points analysed in: {timedelta(seconds=elapsed)}')
+
+    if stage_cache is not None:
+        stage_cache.report()
+
+    # stream the grid cell results into the final parquet dataset and geopackage
+    finalise_results(work_dir)
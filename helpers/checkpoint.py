@@ -0,0 +1,231 @@
+import os
+import time
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+import numpy as np
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+# columns holding one array per point, stored as arrow list columns
+# (several bands are stored as one ts_<band> column per band)
+LIST_COLUMNS = {'ts': pa.float32(), 'dates': pa.date32()}
+
+# cell states that do not need to be processed again on resume
+FINAL_STATES = ('done', 'empty', 'no_data')
+
+
+def _remove(path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a temporary path (file or directory) next to path, which replaces path once the block succeeds
+
+    Outputs are written to the temporary path first, so an interrupted write never
+    looks finished and an existing output is only replaced by a complete one. If
+    nothing was written to the temporary path, an existing output is removed. The
+    temporary name holds the process id, so processes writing the same output do
+    not interfere.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.stem}.{os.getpid()}.tmp{path.suffix}')
+    _remove(tmp_path)
+    try:
+        yield tmp_path
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+    if not tmp_path.exists():
+        # nothing was written (e.g. no points), so there is no output
+        _remove(path)
+    else:
+        # a directory can not be replaced in one step
+        if path.is_dir():
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+
+def _list_array(column, value_type):
+    # builds an arrow list array from one flat buffer and offsets, instead of converting element by element
+    lengths = np.array([len(item) for item in column], dtype='int32')
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype('int32')
+    if value_type == pa.date32():
+        flat = np.concatenate([np.asarray(item, dtype='datetime64[D]') for item in column] or [np.array([], 'datetime64[D]')])
+    else:
+        flat = np.concatenate([np.asarray(item, dtype='float32') for item in column] or [np.array([], 'float32')])
+    return pa.ListArray.from_arrays(pa.array(offsets), pa.array(flat, type=value_type))
+
+
+def to_arrow(df, store=None):
+    """
+    Converts the results of a grid cell into an arrow table with the
+    geometry as WKB and ts/dates as list columns
+
+    The list columns are built without copies from the flat buffers of
+    the store if given, otherwise from ts/dates columns of df.
+    """
+
+    columns = {}
+    for column in df.columns:
+        if column in LIST_COLUMNS and store is not None:
+            continue
+        elif column in LIST_COLUMNS:
+            columns[column] = _list_array(df[column], LIST_COLUMNS[column])
+        elif column == 'geometry':
+            columns[column] = pa.array(gpd.GeoSeries(df[column]).to_wkb(), type=pa.binary())
+        else:
+            columns[column] = pa.array(df[column], from_pandas=True)
+
+    if store is not None:
+        # day numbers are days since 1970-01-01, which is what date32 stores
+        store = store.compact()
+        offsets = pa.array(np.concatenate([[0], store.stops]).astype('int32'))
+        if store.values.ndim == 1:
+            columns['ts'] = pa.ListArray.from_arrays(offsets, pa.array(store.values))
+        else:
+            for i, band in enumerate(store.bands):
+                columns[f'ts_{band}'] = pa.ListArray.from_arrays(offsets, pa.array(np.ascontiguousarray(store.values[:, i])))
+        columns['dates'] = pa.ListArray.from_arrays(offsets, pa.array(store.dates).view(pa.date32()))
+
+    return pa.table(columns)
+
+
+def from_arrow(table):
+    """
+    Converts a table written by to_arrow back into a GeoDataFrame and a TimeSeriesStore
+    """
+
+    # one ts column of a single band, or a ts_<band> column per band
+    ts_columns = [
+        field.name for field in table.schema if field.name.startswith('ts') and pa.types.is_list(field.type)
+    ]
+    
+    store = None
+    if ts_columns:
+        bands = [name[3:] for name in ts_columns] if ts_columns != ['ts'] else None
+        ts = [table.column(name).combine_chunks() for name in ts_columns]
+        dates = table.column('dates').combine_chunks()
+        # flatten() only holds the values of the (possibly sliced) lists, as the rebased offsets
+        values = [column.flatten().to_numpy(zero_copy_only=False) for column in ts]
+        store = TimeSeriesStore.from_offsets(
+            values[0] if bands is None else np.stack(values, axis=1),
+            dates.flatten().view(pa.int32()).to_numpy(zero_copy_only=False),
+            ts[0].offsets.to_numpy() - ts[0].offsets[0].as_py(),
+            bands
+        )
+        table = table.drop_columns(ts_columns + ['dates'])
+
+    df = table.to_pandas()
+    if 'geometry' in df:
+        df = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkb(df['geometry']), crs="EPSG:4326")
+    return df, store
+
+
+class CheckpointStore:
+    """
+    Checkpoints of the grid cells of a work_dir
+
+    A SQLite manifest (manifest.sqlite) holds status, number of points, runtime
+    and error of every grid cell, the results of finished cells are written as
+    one Parquet file per cell into work_dir/cells. Resume, progress reporting
+    and the final merge read the manifest, so the directory is never scanned.
+
+    Status is one of 'done', 'empty' (no points in the cell), 'no_data' (no
+    point data could be extracted) or 'failed' (retried on resume).
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = Path(work_dir)
+        self.cells_dir = self.work_dir.joinpath('cells')
+        self.cells_dir.mkdir(parents=True, exist_ok=True)
+
+        # one connection shared by the worker threads, serialised by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.work_dir.joinpath('manifest.sqlite'), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS cells ('
+            'idx INTEGER PRIMARY KEY, status TEXT NOT NULL, nr_of_points INTEGER, '
+            'runtime REAL, error TEXT, updated REAL)'
+        )
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def record(self, idx, status, nr_of_points=0, runtime=None, error=None):
+        """ Sets the manifest entry of a grid cell
+        """
+        self._query(
+            'INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?)',
+            (int(idx), status, int(nr_of_points), runtime, error, time.time())
+        )
+
+    def status(self, idx):
+        """ Returns the status of a grid cell, None if it has not been processed
+        """
+        rows = self._query('SELECT status FROM cells WHERE idx = ?', (int(idx),))
+        return rows[0][0] if rows else None
+
+    def is_done(self, idx):
+        return self.status(idx) in FINAL_STATES
+
+    def pending(self, indices):
+        """ Returns the grid cell indices that still need to be processed
+        """
+        done = {idx for idx, in self._query(
+            f'SELECT idx FROM cells WHERE status IN ({",".join("?" * len(FINAL_STATES))})', FINAL_STATES
+        )}
+        return [idx for idx in indices if idx not in done]
+
+    def progress(self):
+        """ Returns the number of cells and points per status
+        """
+        return {
+            status: {'cells': cells, 'points': points or 0}
+            for status, cells, points in self._query(
+                'SELECT status, COUNT(*), SUM(nr_of_points) FROM cells GROUP BY status'
+            )
+        }
+
+    def result_path(self, idx):
+        return self.cells_dir.joinpath(f'cell_{idx}.parquet')
+
+    def statuses(self):
+        """ Returns the status of all recorded grid cells by index
+        """
+        return dict(self._query('SELECT idx, status FROM cells ORDER BY idx'))
+
+    def write_result(self, idx, df, store=None, runtime=None):
+        """ Writes the results of a grid cell and marks it as done
+        """
+        with atomic_path(self.result_path(idx)) as tmp_path:
+            pq.write_table(to_arrow(df, store), tmp_path)
+        self.record(idx, 'done', len(df), runtime)
+
+    def read_result(self, idx):
+        """ Reads the results of a grid cell into a GeoDataFrame and a TimeSeriesStore
+        """
+        return from_arrow(pq.read_table(self.result_path(idx)))
+
+    def results(self):
+        """ Returns (idx, path) tuples of all finished grid cells with results, ordered by cell
+        """
+        return [
+            (idx, self.result_path(idx))
+            for idx, in self._query("SELECT idx FROM cells WHERE status = 'done' ORDER BY idx")
+        ]
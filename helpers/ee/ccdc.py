@@ -1,12 +1,12 @@
 from datetime import datetime as dt
 
 import ee
-import requests
 import numpy as np
 import pandas as pd
-import geopandas as gpd
 from retry import retry
 
+from helpers.ee.download import download_fc
+
 def get_segments(ccdcAst, mask_1d):
     """
     
@@ -38,81 +38,152 @@ def transform_date(date):
     dates_float = date.year + np.round(date.dayofyear/365, 3)
     dates_float = 0 if dates_float == '1970.003' else dates_float
     return dates_float
+
+
+# breakpoint bands of the CCDC on EE, unless set in ccdc_params
+BREAKPOINT_BANDS = ['green', 'red', 'nir', 'swir1', 'swir2']
+
+
+def monitoring_segment(ccdc, band, start_monitor, end):
+    """
+    Selects the CCDC segment of highest absolute magnitude that ends in the monitoring period
     
-@retry(tries=10, delay=1, backoff=2)
-def extract_ccdc(lsat, points_fc, cell, config_dict):
+    Returns an image of the band's magnitude, tBreak and tEnd of that segment.
+    """
     
-    # extract configuration values
+    # create array of start of monitoring in shape of tEnd
+    tEnd = ccdc.select('tEnd')
+    mon_date_array_start = tEnd.multiply(0).add(ee.Date(start_monitor).millis())
+    mon_date_array_end = tEnd.multiply(0).add(ee.Date(end).advance(2, 'year').millis())
+    # create the date mask
+    date_mask = tEnd.gte(mon_date_array_start).And(tEnd.lte(mon_date_array_end))
+    # use date mask to mask all of ccdc 
+    monitoring_ccdc = get_segments(ccdc, date_mask)
+
+    # mask for highest magnitude in monitoring period
+    magnitude = monitoring_ccdc.select(band + '_magnitude')
+    max_abs_magnitude = (magnitude
+      .abs()
+      .arrayReduce(ee.Reducer.max(), [0])
+      .arrayGet([0])
+      .rename('max_abs_magnitude')
+    )
+
+    mask = magnitude.abs().eq(max_abs_magnitude)
+    segment = get_segment(monitoring_ccdc, mask)
+    return ee.Image(segment.select([band + '_magnitude', 'tBreak', 'tEnd']))
+
+
+def ccdc_request(lsat, points, cell, config_dict, mode='points'):
+    """
+    Builds the feature collection of the CCDC results of the points of a grid cell
+    
+    No request is made, so the graph can be inspected offline, e.g. by its 
+    serialize() output. In 'points' mode a CCDC runs per point on the 
+    collection clipped to the point. In 'image' mode one CCDC runs on the 
+    collection clipped to the cell and its segment image is sampled at all 
+    points with a single reduceRegions. Both keep the same segment selection 
+    (see monitoring_segment) and result properties.
+    
+    Parameters
+    ----------
+    lsat : ee.ImageCollection
+        landsat collection holding the breakpoint bands
+    points : ee.FeatureCollection
+        points of the grid cell
+    cell : ee.Geometry
+        geometry of the grid cell
+    config_dict : dict
+        configuration of the run
+    mode : str
+        'points' or 'image'
+    """
+    
+    ccdc_params = config_dict['ccdc_params']
     band = config_dict['ts_params']['band']
-    start_monitor = config_dict['ts_params']['start_monitor']
+    band = ccdc_params.get('magnitude_band') or (band if isinstance(band, str) else band[0])
+    breakpoint_bands = ccdc_params.get('breakpoint_bands') or BREAKPOINT_BANDS
+    # as for the local CCDC, ccdc_params may set its own start of the monitoring period
+    start_monitor = ccdc_params.get('start_monitor') or config_dict['ts_params']['start_monitor']
     end = config_dict['ts_params']['end_date']
-    point_id_name = config_dict['ts_params']['point_id']
-    
-    # get geometry of grid cell and filter points for that
-    cell = ee.Geometry.Polygon(cell['coordinates'])
-    points = points_fc.filterBounds(cell)
-    nr_points = points.size().getInfo()
-    if nr_points == 0:
-        return
     
     # create image collection (not being changed)
     lsat = lsat.filterDate(ee.Date(start_monitor).advance(-2, 'year'), ee.Date(end).advance(2, 'year')).filterBounds(cell)
     
-    def get_magnitude(point):
-
+    def segment_image(geometry):
         ccdc = ee.Algorithms.TemporalSegmentation.Ccdc(
-            collection=lsat.map(lambda image: image.clip(point)),
-            breakpointBands=['green', 'red', 'nir', 'swir1', 'swir2'],
-            #breakpointBands=['ndvi'],
+            collection=lsat.map(lambda image: image.clip(geometry)),
+            breakpointBands=breakpoint_bands,
             dateFormat=2
-          )
-
-        # create array of start of monitoring in shape of tEnd
-        tEnd = ccdc.select('tEnd')
-        mon_date_array_start = tEnd.multiply(0).add(ee.Date(start_monitor).millis())
-        mon_date_array_end = tEnd.multiply(0).add(ee.Date(end).advance(2, 'year').millis())
-        # create the date mask
-        date_mask = tEnd.gte(mon_date_array_start).And(tEnd.lte(mon_date_array_end))
-        # use date mask to mask all of ccdc 
-        monitoring_ccdc = get_segments(ccdc, date_mask)
-
-        # mask for highest magnitude in monitoring period
-        magnitude = monitoring_ccdc.select(band + '_magnitude')
-        max_abs_magnitude = (magnitude
-          .abs()
-          .arrayReduce(ee.Reducer.max(), [0])
-          .arrayGet([0])
-          .rename('max_abs_magnitude')
         )
-
-        mask = magnitude.abs().eq(max_abs_magnitude)
-        segment = get_segment(monitoring_ccdc, mask)
-        magnitude = ee.Image(segment.select(['ndvi_magnitude', 'tBreak', 'tEnd']))
-
-        def ndvi_nan(feature):
-            ndvi = ee.List([feature.get('ndvi'), -9999]).reduce(ee.Reducer.firstNonNull())
-            return feature.set({'ndvi': ndvi, 'imageID': image.id(),})
-
-        return point.set(magnitude.reduceRegion(
+        return monitoring_segment(ccdc, band, start_monitor, end)
+    
+    if mode == 'image':
+        # points without a segment keep empty properties, as in points mode
+        return segment_image(cell).reduceRegions(
+            collection=points,
+            reducer=ee.Reducer.first(),
+            scale=30
+        )
+    
+    if mode != 'points':
+        raise ValueError(f"Unknown CCDC mode '{mode}'. Choose one of ['points', 'image'].")
+    
+    def get_magnitude(point):
+        return point.set(segment_image(point.geometry()).reduceRegion(
           reducer=ee.Reducer.first(),
           geometry=point.geometry(),
           scale=30
         ))
     
-    
+    return points.map(get_magnitude)
 
-    cell_fc = points.map(get_magnitude)
-    url = cell_fc.getDownloadUrl('geojson')
 
-    # Handle downloading the actual pixels.
-    r = requests.get(url, stream=True)
-    if r.status_code != 200:
-        raise r.raise_for_status()
+@retry(tries=10, delay=1, backoff=2)
+def extract_ccdc(lsat, points_fc, cell, config_dict, client=None, point_ids=None):
+    """
+    Extracts the CCDC change date and magnitude of the points of a grid cell
+    
+    ccdc_params['ee_mode'] selects a CCDC per point ('points', default) or 
+    one CCDC per cell ('image'), see ccdc_request. The number of EE requests,
+    CCDC runs and the size of the serialized request graph are reported.
+    """
+    
+    # extract configuration values
+    mode = config_dict['ccdc_params'].get('ee_mode', 'points')
+    band = config_dict['ts_params']['band']
+    band = config_dict['ccdc_params'].get('magnitude_band') or (band if isinstance(band, str) else band[0])
+    point_id_name = config_dict['ts_params']['point_id']
+    
+    # get geometry of grid cell and filter points for that, by their ids if known from the point index
+    cell = ee.Geometry.Polygon(cell['coordinates'])
+    if point_ids is None:
+        points = points_fc.filterBounds(cell)
+        nr_points = points.size().getInfo()
+        nr_requests = 1
+    else:
+        points = points_fc.filter(ee.Filter.inList(point_id_name, np.asarray(point_ids).tolist()))
+        nr_points = len(point_ids)
+        nr_requests = 0
+    if nr_points == 0:
+        return
+    
+    cell_fc = ccdc_request(lsat, points, cell, config_dict, mode)
+    graph_size = len(cell_fc.serialize())
 
-    # write the FC to a geodataframe
-    gdf = gpd.GeoDataFrame.from_features(r.json())
+    # download the FC into a table with only the needed properties
+    df = download_fc(
+        cell_fc, 
+        {point_id_name: None, 'tBreak': float, band + '_magnitude': float}, 
+        config_dict['ts_params'].get('download_format', 'geojson'),
+        client=client
+    )
+    print(
+        f' CCDC in {mode} mode: {nr_points if mode == "points" else 1} segmentation(s), '
+        f'{nr_requests + 1} EE request(s), request graph of {graph_size / 1024:.1f} kB.'
+    )
     
-    gdf['ccdc_change_date'] = gdf['tBreak'].apply(lambda x: transform_date(x))
-    gdf['point_id'] = gdf[point_id_name]
-    gdf['ccdc_magnitude'] = gdf['ndvi_magnitude']
-    return gdf[['ccdc_change_date', 'ccdc_magnitude', 'point_id']]
\ No newline at end of file
+    df['ccdc_change_date'] = df['tBreak'].apply(lambda x: transform_date(x))
+    df['point_id'] = df[point_id_name]
+    df['ccdc_magnitude'] = df[band + '_magnitude']
+    return df[['ccdc_change_date', 'ccdc_magnitude', 'point_id']]
@@ -0,0 +1,54 @@
+from helpers.ee.get_time_series import get_time_series
+from helpers.ee.ccdc import extract_ccdc
+from helpers.ts_analysis.ccdc import extraction_bands
+
+
+class EarthEngineClient:
+    """
+    Interface to all Earth Engine requests of a grid cell
+    
+    The orchestration only talks to EE through this class, so that it can 
+    be run with a fake client implementing the same methods.
+    
+    Parameters
+    ----------
+    lsat : ee.ImageCollection
+        landsat collection holding all bands
+    points : ee.FeatureCollection
+        point feature collection
+    config_dict : dict
+        configuration of the run
+    download_client : DownloadClient, optional
+        HTTP client used for the downloads
+    """
+    
+    def __init__(self, lsat, points, config_dict, download_client=None):
+        self.lsat = lsat
+        self.points = points
+        self.config_dict = config_dict
+        self.download_client = download_client
+    
+    def time_series(self, cell, point_ids=None, point_coords=None):
+        """
+        Returns point table, TimeSeriesStore and number of points of a grid cell
+        
+        The points are selected by point_ids if given, by the cell bounds otherwise. 
+        point_coords (point id, x, y) spare the coordinate download of tabular formats. 
+        ts_params['band'] is a band name or a list of bands, extracted together 
+        with the bands of a local CCDC (see extraction_bands).
+        """
+        return get_time_series(
+            self.lsat.select(extraction_bands(self.config_dict)), 
+            self.points, 
+            cell, 
+            self.config_dict, 
+            self.download_client,
+            point_ids,
+            point_coords
+        )
+    
+    def ccdc(self, cell, point_ids=None):
+        """
+        Returns the CCDC change date and magnitude per point of a grid cell, computed on EE
+        """
+        return extract_ccdc(self.lsat, self.points, cell, self.config_dict, self.download_client, point_ids)
@@ -0,0 +1,380 @@
+import io
+import os
+import json
+import codecs
+import threading
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# typecodes of the column buffers, anything else is kept as python objects
+TYPECODES = {float: 'd', int: 'q'}
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_delimiters = _whitespace + ',:]}'
+
+
+def iter_chunks(source, chunk_size=2**20):
+    """
+    Yields byte chunks from a file path, a file-like object or an iterable of chunks 
+    (e.g. requests' Response.iter_content)
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+    elif hasattr(source, 'read'):
+        yield from iter(lambda: source.read(chunk_size), b'')
+    else:
+        yield from source
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Read-only file-like object over an iterable of byte chunks
+    """
+    
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.leftover = b''
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        while not self.leftover:
+            try:
+                self.leftover = next(self.chunks)
+            except StopIteration:
+                return 0
+        
+        n = min(len(b), len(self.leftover))
+        b[:n], self.leftover = self.leftover[:n], self.leftover[n:]
+        return n
+
+
+class _JSONStream:
+    """
+    Minimal pull parser over a stream of byte chunks, decoding one JSON value at a time
+    """
+    
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer, self.pos = '', 0
+    
+    def _fill(self):
+        # read the next chunk, dropping what has been consumed already
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buffer, self.pos = self.buffer[self.pos:] + text, 0
+                return True
+        return False
+    
+    def peek(self):
+        # next non-whitespace character, without consuming it
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise json.JSONDecodeError('Unexpected end of data', self.buffer, self.pos)
+    
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f'Expected {char!r}', self.buffer, self.pos)
+        self.pos += 1
+    
+    def value(self):
+        # decode the next complete value, reading more data while it is incomplete
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            
+            # a number (e.g. '12.' + '5') is only complete when followed by a delimiter or the end of the data
+            if not isinstance(value, (dict, list, str)):
+                if (end == len(self.buffer) or self.buffer[end] not in _delimiters) and self._fill():
+                    continue
+            self.pos = end
+            return value
+    
+    def items(self, close):
+        # yields nothing but consumes the separators between the members of an object/array
+        first = True
+        while self.peek() != close:
+            if not first:
+                self.expect(',')
+            first = False
+            yield
+        self.pos += 1
+
+
+def iter_features(source):
+    """
+    Yields the features of a GeoJSON FeatureCollection one by one, 
+    without loading the whole document into memory
+    
+    Parameters
+    ----------
+    source : str, Path, file-like or iterable of bytes
+        GeoJSON document to read
+    """
+    
+    stream = _JSONStream(iter_chunks(source))
+    stream.expect('{')
+    for _ in stream.items('}'):
+        key = stream.value()
+        stream.expect(':')
+        if key != 'features':
+            # small top-level members (type, columns) are decoded and dropped
+            stream.value()
+            continue
+        
+        stream.expect('[')
+        for _ in stream.items(']'):
+            yield stream.value()
+
+
+def read_features(source, columns, coordinates=False):
+    """
+    Reads selected properties of a GeoJSON FeatureCollection into a DataFrame
+    
+    Features are parsed incrementally and only the requested properties 
+    are appended to typed column buffers, so that peak memory stays 
+    close to the size of the final table.
+    
+    Parameters
+    ----------
+    source : str, Path, file-like or iterable of bytes
+        GeoJSON document, e.g. requests.get(url, stream=True).iter_content(2**20)
+    columns : dict or list
+        property names to keep, optionally mapped to their python type (float, int or str). 
+        Missing values of float columns become NaN, int columns with missing values 
+        become nullable Int64 columns
+    coordinates : bool
+        whether to add the x and y coordinates of point geometries
+        
+    Returns
+    -------
+    df : pandas DataFrame
+        one row per feature and one column per property (plus x, y)
+    """
+    
+    columns = columns if isinstance(columns, dict) else dict.fromkeys(columns)
+    buffers = {
+        name: array(TYPECODES[dtype]) if dtype in TYPECODES else [] for name, dtype in columns.items()
+    }
+    if coordinates:
+        buffers['x'], buffers['y'] = array('d'), array('d')
+    
+    # rows of the missing values of int columns, which have no NaN
+    missing = {name: [] for name, dtype in columns.items() if dtype is int}
+    
+    for i, feature in enumerate(iter_features(source)):
+        properties = feature.get('properties') or {}
+        for name in columns:
+            value = properties.get(name)
+            if value is None and name in missing:
+                missing[name].append(i)
+                value = 0
+            elif value is None and isinstance(buffers[name], array):
+                value = np.nan
+            buffers[name].append(value)
+        
+        if coordinates:
+            geometry = feature.get('geometry') or {}
+            x, y = (geometry.get('coordinates') or (np.nan, np.nan))[:2]
+            buffers['x'].append(x)
+            buffers['y'].append(y)
+    
+    df = pd.DataFrame({
+        name: np.frombuffer(buffer, dtype=buffer.typecode) if isinstance(buffer, array) else buffer
+        for name, buffer in buffers.items()
+    })
+    for name, rows in missing.items():
+        if rows:
+            mask = np.zeros(len(df), dtype=bool)
+            mask[rows] = True
+            df[name] = pd.arrays.IntegerArray(df[name].to_numpy(), mask)
+    return df
+
+
+def read_csv_table(source, columns):
+    """
+    Reads selected columns of a CSV table export into a DataFrame
+    
+    Parameters
+    ----------
+    source : str, Path, file-like or iterable of bytes
+        CSV document, e.g. requests.get(url, stream=True).iter_content(2**20)
+    columns : dict or list
+        column names to keep, optionally mapped to their python type (float, int or str). 
+        int columns with missing values become nullable Int64 columns, as in read_features
+        
+    Returns
+    -------
+    df : pandas DataFrame
+        one row per feature and one column per selected property
+    """
+    
+    columns = columns if isinstance(columns, dict) else dict.fromkeys(columns)
+    dtypes = {name: 'Int64' if dtype is int else dtype for name, dtype in columns.items() if dtype is not None}
+    
+    df = pd.read_csv(
+        io.BufferedReader(ChunkReader(iter_chunks(source)), buffer_size=2**20), 
+        usecols=list(columns), 
+        dtype=dtypes
+    )[list(columns)]
+    
+    # int columns without missing values stay plain int64
+    for name, dtype in columns.items():
+        if dtype is int and not df[name].isna().any():
+            df[name] = df[name].astype('int64')
+    return df
+
+
+class DownloadClient:
+    """
+    Shared HTTP client for the downloads of all grid cells
+    
+    Keeps a pool of keep-alive connections, so that consecutive downloads 
+    reuse TCP/TLS connections, and limits the number of concurrent 
+    downloads with a semaphore, independently of the number of workers.
+    
+    Parameters
+    ----------
+    pool_size : int
+        maximum number of kept-alive connections per host, e.g. the number of workers
+    max_downloads : int, optional
+        maximum number of downloads in flight, defaults to pool_size
+    chunk_size : int
+        size of the chunks read from the response
+    session : requests.Session, optional
+        session to use, e.g. one pointed at a local stub server
+    """
+    
+    def __init__(self, pool_size=10, max_downloads=None, chunk_size=2**20, session=None):
+        self.chunk_size = chunk_size
+        self.session = session or requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip'})
+        self.semaphore = threading.BoundedSemaphore(max_downloads or pool_size)
+        self._lock = threading.Lock()
+        self._stats = dict(requests=0, bytes=0, transferred_bytes=0)
+    
+    @contextmanager
+    def stream(self, url):
+        """
+        Context manager yielding the (decompressed) byte chunks of a download
+        """
+        with self.semaphore:
+            r = self.session.get(url, stream=True)
+            try:
+                if r.status_code != 200:
+                    raise r.raise_for_status()
+                yield self._iter_content(r)
+            finally:
+                with self._lock:
+                    self._stats['requests'] += 1
+                    self._stats['transferred_bytes'] += r.raw.tell()
+                r.close()
+    
+    def _iter_content(self, r):
+        for chunk in r.iter_content(chunk_size=self.chunk_size):
+            with self._lock:
+                self._stats['bytes'] += len(chunk)
+            yield chunk
+    
+    @property
+    def connections(self):
+        """
+        Number of connections (i.e. handshakes) opened so far by the pool
+        """
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+    
+    def stats(self):
+        """
+        Returns the number of requests, opened connections and downloaded bytes 
+        (decompressed and as transferred)
+        """
+        with self._lock:
+            return dict(self._stats, connections=self.connections)
+
+
+# client used when none is passed explicitly
+_default_client = None
+
+def get_client():
+    """
+    Returns the shared default DownloadClient, creating it on first use
+    """
+    global _default_client
+    if _default_client is None:
+        _default_client = DownloadClient()
+    return _default_client
+
+
+def set_client(client):
+    """
+    Replaces the shared default DownloadClient, e.g. with one sized to the number of workers
+    """
+    global _default_client
+    _default_client = client
+
+
+def download_fc(fc, columns, download_format='geojson', coordinates=False, client=None):
+    """
+    Downloads selected properties of an ee.FeatureCollection into a DataFrame
+    
+    Parameters
+    ----------
+    fc : ee.FeatureCollection
+        collection to download
+    columns : dict or list
+        property names to keep, optionally mapped to their python type
+    download_format : str
+        'geojson' or 'csv'. The csv table holds only the selected 
+        columns, without repeating geometries and property names
+    coordinates : bool
+        whether to add x and y coordinates of the (point) geometries
+    client : DownloadClient, optional
+        client used for the download, defaults to the shared client
+    """
+    
+    columns = columns if isinstance(columns, dict) else dict.fromkeys(columns)
+    client = client or get_client()
+    if download_format == 'csv':
+        selectors = list(columns) + (['.geo'] if coordinates else [])
+        url = fc.getDownloadURL(filetype='csv', selectors=selectors)
+    elif download_format == 'geojson':
+        url = fc.getDownloadUrl('geojson')
+    else:
+        raise ValueError(f"Unknown download format '{download_format}'. Choose one of ['geojson', 'csv'].")
+    
+    # Handle downloading the actual data.
+    with client.stream(url) as chunks:
+        if download_format == 'geojson':
+            return read_features(chunks, columns, coordinates=coordinates)
+        
+        if not coordinates:
+            return read_csv_table(chunks, columns)
+        
+        # split the geojson geometry column into x and y
+        df = read_csv_table(chunks, {**columns, '.geo': str})
+    
+    xy = np.array([json.loads(geo)['coordinates'][:2] for geo in df.pop('.geo')], dtype='float64').reshape(-1, 2)
+    return df.assign(x=xy[:, 0], y=xy[:, 1])
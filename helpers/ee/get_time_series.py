@@ -1,110 +1,253 @@
-import time
+import json
 
 import ee
 import pandas as pd
 import geopandas as gpd
 import numpy as np
-import requests
 from retry import retry
 
+from helpers.ee.download import download_fc
+from helpers.ts_analysis.ts_store import TimeSeriesStore, to_day_numbers
+
+# trailing bands of the per-point arrays of the array extraction
+ARRAY_BANDS = ['pathrow', 'day']
+
+
+def ts_array_request(imageCollection, points, bands):
+    """
+    Builds the feature collection of the array extraction: one feature per point
+    
+    Each image is stacked with its path/row and date (day number), both parsed 
+    from the image id as in structure_ts_data, and masked where the first band 
+    is masked. The collection becomes one array image (images x bands) that is 
+    sampled once per point, so the 'ts' property of a point holds the rows of 
+    all its valid observations. No request is made, so the graph can be 
+    inspected offline by its serialize() output.
+    """
+    
+    def stack(image):
+        # ids end with _PATHROW_YYYYMMDD
+        id_parts = ee.String(image.id()).split('_')
+        pathrow = ee.Number.parse(id_parts.get(-2))
+        day = ee.Date.parse('yyyyMMdd', id_parts.get(-1)).millis().divide(86400000)
+        return (
+            ee.Image.cat([image.select(bands).unmask(-9999), ee.Image.constant(pathrow), ee.Image.constant(day)])
+            .rename([*bands, *ARRAY_BANDS])
+            .toDouble()
+            .updateMask(image.select(bands[0]).mask())
+        )
+    
+    return imageCollection.map(stack).toArray().reduceRegions(
+        collection=points,
+        reducer=ee.Reducer.first().setOutputs(['ts']),
+        crs=imageCollection.first().select(0).projection()
+    )
+
+
+def decode_ts_arrays(df, point_id_name, bands):
+    """
+    Expands the per-point arrays of the array extraction into one row per observation
+    
+    The 'ts' column holds the arrays (nested lists, or their JSON text for csv 
+    downloads) of ts_array_request. Returns the observation table of 
+    structure_ts_data, with pathrow and date columns instead of the imageID 
+    and the point coordinates repeated per observation.
+    """
+    
+    def to_array(value):
+        if isinstance(value, str):
+            value = json.loads(value) if value else None
+        if not isinstance(value, list) or len(value) == 0:
+            return np.empty((0, len(bands) + len(ARRAY_BANDS)))
+        return np.asarray(value, dtype='float64').reshape(len(value), -1)
+    
+    arrays = [to_array(value) for value in df['ts']]
+    lengths = np.array([len(a) for a in arrays], dtype='int64')
+    table = np.concatenate(arrays) if arrays else np.empty((0, len(bands) + len(ARRAY_BANDS)))
+    
+    obs = pd.DataFrame(table[:, :len(bands)], columns=bands)
+    obs.insert(0, point_id_name, np.repeat(df[point_id_name].to_numpy(), lengths))
+    obs['pathrow'] = table[:, len(bands)].astype('int64')
+    obs['date'] = table[:, len(bands) + 1].astype('int64').astype('datetime64[D]')
+    for column in ['x', 'y']:
+        if column in df:
+            obs[column] = np.repeat(df[column].to_numpy(), lengths)
+    return obs
+
+
 @retry(tries=10, delay=1, backoff=2)
-def get_time_series(imageCollection, points, geometry, config_dict):
+def get_time_series(imageCollection, points, geometry, config_dict, client=None, point_ids=None, point_coords=None):
+    """
+    Extracts the time-series of the points of a grid cell
+    
+    With ts_params['extraction'] = 'images' (default) each image is reduced 
+    over the points and yields one feature per point and image. 'array' 
+    samples an array image of the whole collection once per point (see 
+    ts_array_request), which cuts the number of exported features by about 
+    the number of images.
+    
+    Tabular download formats carry no geometry, the point coordinates are 
+    then taken from point_coords (point id, x, y, see PointIndex.coordinates) 
+    or downloaded from the points if not given.
     
-    band = imageCollection.first().bandNames().getInfo()[0]
+    Returns
+    -------
+    df, store, nr_of_points
+        point table, TimeSeriesStore and number of points (0 if empty, -1 if the download failed)
+    """
+    
+    # all bands of the collection are reduced in the same pass
+    bands = imageCollection.first().bandNames().getInfo()
     point_id_name = config_dict['ts_params']['point_id']
     
-    # get geometry of grid cell and filter points for that
+    # get geometry of grid cell and filter points for that, by their ids if known from the point index
     cell = ee.Geometry.Polygon(geometry['coordinates'])
-    points = points.filterBounds(geometry)
-    nr_of_points = points.size().getInfo()
+    if point_ids is None:
+        points = points.filterBounds(geometry)
+        nr_of_points = points.size().getInfo()
+    else:
+        points = points.filter(ee.Filter.inList(point_id_name, np.asarray(point_ids).tolist()))
+        nr_of_points = len(point_ids)
     if nr_of_points == 0:
-        return None, 0
+        return None, None, 0
     
     # mask lsat collection for grid cell
     masked_coll = imageCollection.filterBounds(cell)
-
+    download_format = config_dict['ts_params'].get('download_format', 'geojson')
+    
+    if config_dict['ts_params'].get('extraction', 'images') == 'array':
+        try:
+            point_df = download_fc(
+                ts_array_request(masked_coll, points, bands), 
+                {point_id_name: None, 'ts': None if download_format == 'geojson' else str}, 
+                download_format,
+                coordinates=True,
+                client=client
+            )
+        except ValueError: # JSONDecodeError:
+            return None, None, -1
+        
+        point_df = decode_ts_arrays(point_df, point_id_name, bands)
+        if len(point_df) == 0:
+            return None, None, 0
+        
+        df, store = structure_ts_data(point_df, point_id_name, None, bands)
+        return df, store, nr_of_points
+    
     # mapping function to extract NDVI time-series from each image
     def mapOverImgColl(image):
         
         geom = image.geometry()
         
         def pixel_value_nan(feature):
-            pixel_value = ee.List([feature.get(band), -9999]).reduce(ee.Reducer.firstNonNull())
-            return feature.set({'pixel_value': pixel_value, 'imageID': image.id(),})
+            pixel_values = {
+                band: ee.List([feature.get(band), -9999]).reduce(ee.Reducer.firstNonNull()) for band in bands
+            }
+            return feature.set({**pixel_values, 'imageID': image.id(),})
                 
         return image.reduceRegions(
             collection = points.filterBounds(geom),
-            reducer = ee.Reducer.first().setOutputs([band]),
+            reducer = ee.Reducer.first().forEach(bands),
             scale = 30            
         ).map(pixel_value_nan)
 
     # apply mapping ufnciton over landsat collection and get the url of the returned FC
-    cell_fc = masked_coll.map(mapOverImgColl).flatten().filter(ee.Filter.neq('pixel_value', -9999));
-    url = cell_fc.getDownloadUrl('geojson')
+    # (bands share the cloud mask, observations are kept where the first band is valid)
+    cell_fc = masked_coll.map(mapOverImgColl).flatten().filter(ee.Filter.neq(bands[0], -9999));
 
-    # Handle downloading the actual pixels.
-    r = requests.get(url, stream=True)
-    if r.status_code != 200:
-        raise r.raise_for_status()
-    
-    # write the FC to a geodataframe
+    # download the FC into a table with only the needed properties
     try:
-        point_gdf = gpd.GeoDataFrame.from_features(r.json())
-    except: # JSONDecodeError:
-        return None, -1
+        point_df = download_fc(
+            cell_fc, 
+            {point_id_name: None, 'imageID': str, **{band: float for band in bands}}, 
+            download_format,
+            coordinates=download_format == 'geojson',
+            client=client
+        )
+    except ValueError: # JSONDecodeError:
+        return None, None, -1
+        
+    if len(point_df) > 0:
+        # tabular formats carry no geometry, it is attached once per point from the point index
+        if download_format == 'geojson':
+            point_coords = None
+        elif point_coords is None:
+            point_coords = download_fc(points, [point_id_name], download_format, coordinates=True, client=client)
         
-    if len(point_gdf) > 0:
-        return structure_ts_data(point_gdf, point_id_name), nr_of_points
+        df, store = structure_ts_data(point_df, point_id_name, point_coords, bands)
+        return df, store, nr_of_points
     else:
-        return None, 0
+        return None, None, 0
     
 
-def structure_ts_data(df, point_id_name):
+def structure_ts_data(df, point_id_name, point_coords=None, bands=None):
+    """
+    Restructures the extracted observations into one row per point 
+    and a TimeSeriesStore holding the series in the same point order
     
-    df.index = pd.DatetimeIndex(pd.to_datetime(df.imageID.apply(lambda x: x.split('_')[-1]), format='%Y%m%d'))
+    The values of all bands (columns of df, default: pixel_value) are stored as 
+    one (observations x bands) block, -9999 (no data) of a band becomes NaN.
     
-    # loop over point_ids and run cusum
-    d = {}
-    for i, point in enumerate(df[point_id_name].unique()):
-        
-        # read only orws of points and sort by date
-        sub = df[df[point_id_name] == point].sort_index()
-        
-        #### LANDSAT ONLY ###########
-        sub['pathrow'] = sub.imageID.apply(lambda x: x.split('_')[-2])
-
-        # if more than one path row combination covers the point, we select only the one with the most images
-        if len(sub.pathrow.unique()) > 1:
-            # set an initil length
-            length = -1
-            # loop through pathrw combinations
-            for pathrow in sub.pathrow.unique():
-                # check length
-                l = len(sub[sub.pathrow == pathrow])
-                # compare ot previous length, and if higher reset pathrow and length variable
-                if l > length:
-                    pr = pathrow
-                    length = l
-            # finally filter sub df for pathrow with most images
-            sub = sub[sub.pathrow == pr]
-        #### LANDSAT ONLY ###########
-        
-        # get the geometry
-        geometry = sub.geometry.head(1).values[0]
-
-        # get number of images
-        nr_images = len(sub)
-        
-        # write everything to a dict
-        d[i] = dict(
-            point_idx=i,
-            point_id=point,
-            dates=sub.index,
-            ts=sub.pixel_value.tolist(),  #### THIS CREATES PROBLEMS FOR DIFFERENT INDICES
-            images=nr_images,
-            geometry=geometry
-        )
+    Date and path/row are parsed once from the imageID (or taken from the 
+    pathrow and date columns, see decode_ts_arrays) and the dominant 
+    path/row of each point is selected with a single groupby. Point geometries 
+    are looked up in point_coords (point id, x, y) if given, or taken from 
+    a geometry column or x/y coordinate columns of df.
+    """
+    
+    # parse path/row and date of all observations at once (ids end with _PATHROW_YYYYMMDD)
+    if 'imageID' in df:
+        id_parts = df.imageID.str.rsplit('_', n=2, expand=True)
+        pathrow, date = id_parts[1].to_numpy(), pd.to_datetime(id_parts[2], format='%Y%m%d').to_numpy()
+    else:
+        pathrow, date = df.pathrow.to_numpy(), df.date.to_numpy()
+    obs = pd.DataFrame(dict(
+        point_idx=pd.factorize(df[point_id_name])[0],
+        pathrow=pathrow,
+        date=date,
+        row=np.arange(len(df))
+    ))
+    
+    # sort by point (in order of appearance) and date
+    obs = obs.sort_values(['point_idx', 'date'], kind='stable')
+    
+    #### LANDSAT ONLY ###########
+    # if more than one path row combination covers the point, we select only the one with the most images
+    # (on ties the one appearing first in time, as groups keep their order of appearance)
+    counts = obs.groupby(['point_idx', 'pathrow'], sort=False).size()
+    dominant = counts.groupby(level='point_idx').idxmax()
+    obs = obs[pd.MultiIndex.from_arrays([obs.point_idx, obs.pathrow]).isin(dominant.to_numpy())]
+    #### LANDSAT ONLY ###########
+    
+    # csr offsets of the points within the sorted observations
+    nr_images = np.bincount(obs.point_idx, minlength=len(dominant))
+    offsets = np.concatenate([[0], np.cumsum(nr_images)])
+    first_rows = obs.row.to_numpy()[offsets[:-1]]
+    
+    point_ids = df[point_id_name].to_numpy()[first_rows]
+    if point_coords is not None:
+        xy = point_coords.drop_duplicates(point_id_name).set_index(point_id_name).reindex(point_ids)
+        geometry = gpd.points_from_xy(xy.x, xy.y)
+    elif 'geometry' in df:
+        geometry = df.geometry.to_numpy()[first_rows]
+    else:
+        geometry = gpd.points_from_xy(df.x.to_numpy()[first_rows], df.y.to_numpy()[first_rows])
+    
+    gdf = gpd.GeoDataFrame(
+        dict(
+            point_idx=np.arange(len(nr_images)),
+            point_id=point_ids,
+            images=nr_images
+        ), 
+        geometry=geometry
+    )
+    
+    # all bands of the kept observations, a 1-D array for a single band
+    bands = bands or ['pixel_value']
+    values = df[bands].to_numpy('float32')[obs.row.to_numpy()]
+    values[values == -9999] = np.nan
+    store = TimeSeriesStore.from_offsets(
+        values if len(bands) > 1 else values[:, 0], to_day_numbers(obs.date), offsets, bands
+    )
     
-    # turn the dict into a geodataframe and return
-    return  gpd.GeoDataFrame(pd.DataFrame.from_dict(d, orient='index')).set_geometry('geometry')
-            
\ No newline at end of file
+    return gdf, store
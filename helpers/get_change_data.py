@@ -1,21 +1,115 @@
 import json
 import time
 import pandas as pd
-import geopandas as gpd
 from pathlib import Path
+from functools import partial
 from godale import Executor
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
 
-from helpers.ee.get_time_series import get_time_series
 from helpers.ee.util import generate_grid
 from helpers.ee.landsat.landsat_collection import landsat_collection
-from helpers.ee.ccdc import extract_ccdc
+from helpers.ee.client import EarthEngineClient
+from helpers.ee.download import DownloadClient
+
+from helpers.analysis import analyse_cell
+from helpers.pipeline import run_pipeline
+from helpers.results import finalise_results
+from helpers.checkpoint import CheckpointStore
+from helpers.ts_cache import TimeSeriesCache
+from helpers.stage_cache import StageCache
+from helpers.point_index import PointIndex
+from helpers.scheduler import plan_cells
+from helpers.ts_analysis.ccdc import runs_locally
+
+
+def extract_cell(ee_client, idx, cell, config_dict, cache=None, point_ids=None, point_coords=None):
+    """
+    I/O part of a grid cell: extracts time-series (and ccdc) data via the ee_client
+    
+    Cells found in the time-series cache are read from there without any EE 
+    request, newly extracted cells are added to it. The points of the cell are 
+    selected by point_ids if given (see PointIndex), by the cell bounds otherwise, 
+    and located by point_coords if given (see PointIndex.coordinates).
+    
+    Returns
+    -------
+    df, store, nr_of_points, start_time
+    """
+    
+    # get start time
+    start_time = time.time()
+    
+    # already extracted
+    if cache is not None and cache.is_done(idx):
+        status = cache.status(idx)
+        if status == 'done':
+            df, store = cache.read_result(idx)
+            return df, store, len(df), start_time
+        return None, None, 0 if status == 'empty' else -1, start_time
+
+    # get the timeseries data
+    df, store, nr_of_points = ee_client.time_series(cell, point_ids, point_coords)
+    
+    if nr_of_points > 0:
+        print(f' Processing gridcell {idx}')
+        # a local CCDC runs as analysis stage on the extracted bands instead
+        if config_dict['ccdc_params']['run'] and not runs_locally(config_dict['ccdc_params']):
+            ccdc_df = ee_client.ccdc(cell, point_ids)
+            # left merge keeps the row order aligned with the store
+            df = pd.merge(
+                df,
+                ccdc_df[['point_id', 'ccdc_change_date', 'ccdc_magnitude']], 
+                on='point_id',
+                how='left'
+            )
+        
+        # if gfc:
+            # df = h.extract_gfc_change(df)
+
+        # if tmf:
+          # df = h.extract_tmf_change(df)
+    
+    if cache is not None:
+        if nr_of_points > 0:
+            cache.write_result(idx, df, store, time.time() - start_time)
+        else:
+            cache.record(idx, 'empty' if nr_of_points == 0 else 'no_data')
+    
+    return df, store, nr_of_points, start_time
+
+
+def write_cell(checkpoints, idx, df, store, nr_of_points, start_time):
+    """
+    Writes the results of a grid cell to the checkpoint store and records its status
+    """
+    
+    # stop timer
+    elapsed = time.time() - start_time
+    
+    if nr_of_points > 0:
+        checkpoints.write_result(idx, df, store, elapsed)
+        print(f' Grid cell {idx} with {nr_of_points} points done in: {timedelta(seconds=elapsed)}')    
+    elif nr_of_points == 0:
+        checkpoints.record(idx, 'empty', 0, elapsed)
+        print(f' Grid cell {idx} does not contain any points. Going on with next grid cell.')    
+    elif nr_of_points == -1:
+        checkpoints.record(idx, 'no_data', 0, elapsed)
+        print(f' No point data could been extracted from grid cell {idx}. Going on with next grid cell.')        
+
+
+def _analyse_extracted(config_dict, idx, extracted):
+    # pipeline step, runs in a worker process of the cpu stage
+    df, store, nr_of_points, start_time = extracted
+    if nr_of_points > 0:
+        df, store = analyse_cell(df, store, config_dict, StageCache.from_config(config_dict))
+    return df, store, nr_of_points, start_time
+
+
+def _write_analysed(checkpoints, idx, analysed):
+    # pipeline step, writes the analysed grid cell
+    write_cell(checkpoints, idx, *analysed)
 
-from helpers.ts_analysis.cusum import run_cusum_deforest, cusum_deforest
-from helpers.ts_analysis.bfast_wrapper import run_bfast_monitor
-from helpers.ts_analysis.bootstrap_slope import run_bs_slope
-from helpers.ts_analysis.timescan import run_timescan_metrics
-from helpers.ts_analysis.helpers import subset_ts
 
 def get_change_data(aoi, fc, config_dict):
     
@@ -25,6 +119,14 @@ def get_change_data(aoi, fc, config_dict):
     
     with open(config_file, "w") as f:
         json.dump(config_dict, f)
+    
+    # manifest and per-cell results of the work_dir
+    checkpoints = CheckpointStore(outdir)
+    
+    # outputs of the analysis stages by parameters and input data
+    stage_cache = StageCache.from_config(config_dict)
+    if stage_cache is not None:
+        stage_cache.reset_stats()
 
     # create image collection (not being changed)
     lsat = landsat_collection(
@@ -34,111 +136,127 @@ def get_change_data(aoi, fc, config_dict):
         bands=['green', 'red', 'nir', 'swir1', 'swir2', 'ndvi']
     )
     
-    def cell_computation(args):
+    # one connection pool shared by all grid cells, with an optional separate cap on downloads in flight
+    client = DownloadClient(pool_size=config_dict['workers'], max_downloads=config_dict.get('max_downloads'))
+    ee_client = EarthEngineClient(lsat, fc, config_dict, client)
+    
+    # raw time-series of the grid cells, so the analysis can be re-run without re-extraction (see run_analysis)
+    cache = TimeSeriesCache.for_extraction(aoi, fc, config_dict)
+    
+    # ids and coordinates of all points, downloaded once and kept in the work_dir
+    index = PointIndex.for_points(
+        fc, 
+        config_dict['ts_params']['point_id'], 
+        outdir, 
+        config_dict['ts_params'].get('download_format', 'geojson'), 
+        client
+    )
+    
+    def extract(idx, cell):
+        point_coords = index.coordinates(cell_ids[idx], config_dict['ts_params']['point_id'])
+        return extract_cell(ee_client, idx, cell, config_dict, cache, cell_ids[idx], point_coords)
+    
+    def cell_computation(cpu_pool, args):
         
         idx, cell, config_file = args
         with open(config_file, "r") as f:
             config_dict = json.load(f)
             
         # check if already been calculated
-        if outdir.joinpath(f'tmp_{idx}_results.pickle').exists() or outdir.joinpath(f'tmp_{idx}_noresult.txt').exists():
+        if checkpoints.is_done(idx):
             print(f' Grid cell {idx} already has been extracted. Going on with next grid cell.')    
             return
         
-        # get start time
         start_time = time.time()
-
-        # get the timeseries data
-        df, nr_of_points = get_time_series(lsat.select(config_dict['ts_params']['band']), fc, cell, config_dict)
+        try:
+            df, store, nr_of_points, start_time = extract(idx, cell)
+            if nr_of_points > 0:
+                # the analysis runs in the process pool shared by all cell threads, its stages serially inside
+                analysis_config = dict(config_dict, executor_params=dict(config_dict.get('executor_params') or {}, executor='serial'))
+                df, store, nr_of_points, start_time = cpu_pool.submit(
+                    _analyse_extracted, analysis_config, idx, (df, store, nr_of_points, start_time)
+                ).result()
+        except Exception as e:
+            # failed cells are kept in the manifest and retried on resume
+            checkpoints.record(idx, 'failed', runtime=time.time() - start_time, error=repr(e))
+            raise
+        write_cell(checkpoints, idx, df, store, nr_of_points, start_time)
+    
+    # create a grid, balanced by the number of points per cell or of fixed grid_size squares
+    points_per_cell = config_dict['ts_params'].get('points_per_cell')
+    if points_per_cell:
+        grid, cell_ids = index.adaptive_grid(points_per_cell)
+        print(f' Created {len(grid)} grid cells of up to {points_per_cell} points.')
+    else:
+        grid, grid_fc = generate_grid(aoi, config_dict['ts_params']['grid_size'], config_dict['ts_params']['grid_size'])
+        cell_ids = index.cell_ids(grid)
+    
+    # split cells above max_cell_cost and dispatch the most expensive cells first, so no long cell runs last
+    years = (pd.Timestamp(config_dict['ts_params']['end_date']) - pd.Timestamp(config_dict['ts_params']['start_date'])).days / 365.25
+    grid, cell_ids, costs = plan_cells(grid, cell_ids, index, years, config_dict['ts_params'].get('max_cell_cost'))
+    
+    # report the progress of a resumed run
+    pending = checkpoints.pending(range(len(grid)))
+    if len(pending) < len(grid):
+        progress = checkpoints.progress()
+        print(f' Resuming: {len(grid) - len(pending)} of {len(grid)} grid cells already processed ({progress}).')
+    
+    # cells without points are done without any request
+    for idx in pending:
+        if len(cell_ids[idx]) == 0:
+            checkpoints.record(idx, 'empty')
+    pending = [idx for idx in pending if len(cell_ids[idx])]
+    pending = sorted(pending, key=lambda idx: -costs[idx])
+    if pending:
+        print(f' Estimated cost of the pending grid cells: largest {costs[pending[0]]:.3g}, total {costs[pending].sum():.3g} point images.')
+    
+    if config_dict.get('pipeline') == 'async':
         
-        if nr_of_points > 0:
-            print(f' Processing gridcell {idx}')
-            if config_dict['ccdc_params']['run']:
-                ccdc_df = extract_ccdc(lsat, fc, cell, config_dict)
-                df = pd.merge(
-                    ccdc_df[['point_id', 'ccdc_change_date', 'ccdc_magnitude']], 
-                    df, 
-                    on='point_id'
-                )
-            
-            # if gfc:
-                # df = h.extract_gfc_change(df)
-
-            # if tmf:
-              # df = h.extract_tmf_change(df)
-                
-                
-            if config_dict['bfast_params']['run']:
-                df = run_bfast_monitor(df, config_dict['bfast_params'])
-
-            ### THINGS WE RUN WITHOUT HISTORIC PERIOD #####
-
-            # we cut ts data to monitoring period only
-            df[['dates', 'ts', 'mon_images']] = df.apply(
-                lambda row: subset_ts(row, config_dict['ts_params']['start_monitor']), axis=1, result_type='expand'
-            )
-
-            if config_dict['cusum_params']['run']:
-                df = run_cusum_deforest(df, config_dict['cusum_params'])
-
-            if config_dict['ts_metrics_params']['run']:
-                df = run_timescan_metrics(df, config_dict['ts_metrics_params'])
-
-            if config_dict['bs_slope_params']['run']:
-                df = run_bs_slope(df, config_dict['bs_slope_params'])
-
-            df.to_pickle(outdir.joinpath(f'tmp_{idx}_results.pickle'))
-
-            # stop timer and print runtime
-            elapsed = time.time() - start_time
+        # skip grid cells that have already been calculated
+        cells = [(idx, grid[idx]) for idx in pending]
+        print(f' Running asynchronous pipeline with up to {config_dict.get("ee_limit", config_dict["workers"])} concurrent EE requests for {len(cells)} of {len(grid)} grid cells.')
         
-        if nr_of_points > 0:
-            print(f' Grid cell {idx} with {nr_of_points} points done in: {timedelta(seconds=elapsed)}')    
-        elif nr_of_points == 0:
-            with open(outdir.joinpath(f'tmp_{idx}_noresult.txt'), 'w') as f:
-                f.write('0 points')
-            print(f' Grid cell {idx} does not contain any points. Going on with next grid cell.')    
-        elif nr_of_points == -1:
-            with open(outdir.joinpath(f'tmp_{idx}_noresult.txt'), 'w') as f:
-                f.write('0 points')  
-            print(f' No point data could been extracted from grid cell {idx}. Going on with next grid cell.')        
-    
-    # create a grid
-    grid, grid_fc = generate_grid(aoi, config_dict['ts_params']['grid_size'], config_dict['ts_params']['grid_size'])
-    print(f' Parallelizing time-series extraction on {str(config_dict["workers"])} threads for a total of {len(grid)} grid cells.')
-    
-    args_list = [(*l, config_file) for l in list(enumerate(grid))]
-    
-    # ---------------debug line--------------------------
-    #cell_computation([5, grid[5], config_file])
-    # ---------------debug line end--------------------------
-    
-    executor = Executor(executor="concurrent_threads", max_workers=config_dict["workers"])
-    for i, task in enumerate(executor.as_completed(
-        func=cell_computation,
-        iterable=args_list
-    )):
-        try:
-            task.result()
-        except ValueError:
-            print("gridcell task failed")
-    
-    files = list(outdir.glob('tmp*results.pickle'))
-    gdf = pd.read_pickle(files[0])
-    df = pd.DataFrame(columns=gdf.columns)
-    for file in outdir.glob('tmp*results.pickle'):
-        df2 = pd.read_pickle(file)
-        #file.unlink()
-        df = pd.concat([df, df2], ignore_index=True)
-    
-    # write to pickle with all ts and dates
-    df.to_pickle(outdir.joinpath(f'final_results.pickle'))
-    
-    # write to geo file
-    gpd.GeoDataFrame(
-                df.drop(['dates', 'ts'], axis=1), 
-                crs="EPSG:4326", 
-                geometry=df['geometry']
-            ).to_file(
-                outdir.joinpath(f'final_results.gpkg'), driver='GPKG'
-            )
+        # the process pool of the pipeline is the cpu stage, so analysis stages run serially inside
+        analysis_config = dict(config_dict, executor_params=dict(config_dict.get('executor_params') or {}, executor='serial'))
+        run_pipeline(
+            cells,
+            extract=extract,
+            analyse=partial(_analyse_extracted, analysis_config),
+            write=partial(_write_analysed, checkpoints),
+            ee_limit=config_dict.get('ee_limit', config_dict['workers']),
+            queue_size=config_dict.get('queue_size'),
+            workers=(config_dict.get('executor_params') or {}).get('workers'),
+            on_error=lambda idx, e: checkpoints.record(idx, 'failed', error=repr(e))
+        )
+    else:
+        print(f' Parallelizing time-series extraction on {str(config_dict["workers"])} threads for a total of {len(grid)} grid cells.')
+        
+        args_list = [(idx, grid[idx], config_file) for idx in pending]
+        
+        # ---------------debug line--------------------------
+        #cell_computation([5, grid[5], config_file])
+        # ---------------debug line end--------------------------
+        
+        # one process pool for the analysis of all grid cells, started before any cell thread exists,
+        # as forking while other threads hold locks can deadlock the children (see helpers/pipeline.py)
+        with ProcessPoolExecutor((config_dict.get('executor_params') or {}).get('workers')) as cpu_pool:
+            cpu_pool.submit(int).result()
+            
+            executor = Executor(executor="concurrent_threads", max_workers=config_dict["workers"])
+            for i, task in enumerate(executor.as_completed(
+                func=partial(cell_computation, cpu_pool),
+                iterable=args_list
+            )):
+                try:
+                    task.result()
+                except ValueError:
+                    print("gridcell task failed")
+    
+    stats = client.stats()
+    print(f' Downloaded {stats["bytes"] / 2**20:.1f} MB in {stats["requests"]} requests over {stats["connections"]} connections.')
+    
+    if stage_cache is not None:
+        stage_cache.report()
+    
+    # stream the grid cell results into the final parquet dataset and geopackage
+    finalise_results(outdir)
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def adaptive_grid(x, y, target=1000, margin=1e-5):
+    """
+    Partitions points into grid cells of at most target points by k-d splits
+
+    Starting from all points, a cell holding more than target points is split
+    along its wider extent, between the two distinct coordinates closest to
+    the median, until all cells hold at most target points. Each cell is the
+    bounding box of its points, extended by margin but never beyond the split
+    lines of its parents, so cells do not overlap and empty areas are never
+    part of a cell. The partition only depends on the coordinates, so the
+    same points always give the same cells (in the same order).
+
+    Parameters
+    ----------
+    x, y : 1-D float arrays
+        point coordinates (e.g. lon/lat in EPSG:4326)
+    target : int
+        maximum number of points per cell, except for more points at the same location
+    margin : float
+        buffer around the points of a cell, in units of the coordinates
+
+    Returns
+    -------
+    boxes : 2-D float array
+        (xmin, ymin, xmax, ymax) of each cell
+    members : list of 1-D int arrays
+        positions of the points of each cell in x and y
+    """
+
+    x, y = np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64')
+    coords = np.stack([x, y])
+    target = max(int(target), 1)
+
+    boxes, members = [], []
+    # cells still to be checked, with the region between the split lines of their parents
+    stack = [(np.arange(len(x)), np.array([-np.inf, -np.inf, np.inf, np.inf]))] if len(x) else []
+    while stack:
+        idx, region = stack.pop()
+
+        split = None
+        if len(idx) > target:
+            # wider axis first, the other one if all points share the coordinate
+            extent = np.ptp(coords[:, idx], axis=1)
+            for axis in np.argsort(-extent, kind='stable'):
+                values = np.sort(coords[axis, idx])
+                breaks = np.flatnonzero(np.diff(values) > 0) + 1
+                if len(breaks):
+                    k = breaks[np.abs(breaks - len(idx) // 2).argmin()]
+                    split = axis, (values[k - 1] + values[k]) / 2
+                    break
+
+        if split is None:
+            points = coords[:, idx]
+            box = np.concatenate([points.min(axis=1) - margin, points.max(axis=1) + margin])
+            boxes.append(np.concatenate([np.maximum(box[:2], region[:2]), np.minimum(box[2:], region[2:])]))
+            members.append(idx)
+            continue
+
+        axis, value = split
+        lower = coords[axis, idx] < value
+        lower_region, upper_region = region.copy(), region.copy()
+        lower_region[axis + 2], upper_region[axis] = value, value
+
+        # the lower half is processed first, so cells are ordered spatially
+        stack.append((idx[~lower], upper_region))
+        stack.append((idx[lower], lower_region))
+
+    return np.array(boxes).reshape(-1, 4), members
+
+
+def box_geometry(box):
+    """
+    Returns a (planar) GeoJSON polygon of a (xmin, ymin, xmax, ymax) box, as the cells of generate_grid
+    """
+    xmin, ymin, xmax, ymax = (float(value) for value in box)
+    return {
+        'type': 'Polygon',
+        'coordinates': [[[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]],
+        'geodesic': False
+    }
@@ -0,0 +1,94 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+async def _run_pipeline(items, extract, analyse, write, ee_limit, queue_size, workers, on_error):
+    
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    ee_slots = asyncio.Semaphore(ee_limit)
+    
+    with ThreadPoolExecutor(ee_limit) as io_pool, ProcessPoolExecutor(workers) as cpu_pool:
+        
+        async def produce(idx, item):
+            # the slot is only released once the result is queued, so that 
+            # finished downloads waiting for the cpu stage are bounded as well
+            async with ee_slots:
+                try:
+                    result = await loop.run_in_executor(io_pool, extract, idx, item)
+                except Exception as e:
+                    print(f' Extraction of grid cell {idx} failed: {e!r}')
+                    if on_error:
+                        on_error(idx, e)
+                    return
+                await queue.put((idx, result))
+        
+        async def consume():
+            while True:
+                task = await queue.get()
+                if task is None:
+                    return
+                idx, result = task
+                try:
+                    result = await loop.run_in_executor(cpu_pool, analyse, idx, result)
+                    await loop.run_in_executor(io_pool, write, idx, result)
+                except Exception as e:
+                    print(f' Analysis of grid cell {idx} failed: {e!r}')
+                    if on_error:
+                        on_error(idx, e)
+        
+        # start the worker processes before any extraction thread exists,
+        # forking while other threads hold locks can deadlock the children
+        await loop.run_in_executor(cpu_pool, int)
+
+        consumers = [asyncio.create_task(consume()) for _ in range(workers)]
+        await asyncio.gather(*(produce(idx, item) for idx, item in items))
+        
+        # stop the consumers once everything is processed
+        for _ in consumers:
+            await queue.put(None)
+        await asyncio.gather(*consumers)
+
+
+def run_pipeline(items, extract, analyse, write, ee_limit=10, queue_size=None, workers=None, on_error=None):
+    """
+    Runs extraction and analysis of grid cells as two decoupled, overlapping stages
+    
+    An I/O stage runs up to ee_limit extractions concurrently in threads and 
+    puts finished cells on a bounded queue. A CPU stage takes cells from the 
+    queue and analyses them in a process pool. When the queue is full, 
+    extraction waits (backpressure), so memory stays bounded.
+    
+    Parameters
+    ----------
+    items : iterable
+        (idx, cell) tuples
+    extract : function
+        extract(idx, cell) -> result, blocking I/O function run in a thread
+    analyse : function
+        analyse(idx, result) -> result, picklable function run in a process
+    write : function
+        write(idx, result), called with every analysed result
+    ee_limit : int
+        maximum number of concurrent extractions (EE requests)
+    queue_size : int, optional
+        maximum number of extracted cells waiting for analysis, defaults to 2 * workers
+    workers : int, optional
+        number of processes of the CPU stage, defaults to the number of cores
+    on_error : function, optional
+        on_error(idx, exception), called for every grid cell that failed
+    """
+    
+    workers = workers or os.cpu_count()
+    queue_size = queue_size or 2 * workers
+    coro = _run_pipeline(list(items), extract, analyse, write, ee_limit, queue_size, workers, on_error)
+    
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    
+    # inside a running event loop (e.g. a jupyter kernel) the pipeline gets its own thread
+    with ThreadPoolExecutor(1) as thread:
+        return thread.submit(asyncio.run, coro).result()
@@ -0,0 +1,97 @@
+import json
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+from helpers.ee.download import download_fc
+from helpers.grid import adaptive_grid, box_geometry
+
+
+class PointIndex:
+    """
+    Local spatial index (STRtree) of the ids and coordinates of the input points
+
+    The points are downloaded once per point collection, so point counts and
+    id lists of the grid cells are known before any request for a cell is made.
+    Cells are then selected on EE by their point ids instead of their bounds.
+
+    Parameters
+    ----------
+    ids : 1-D array
+        point ids
+    x, y : 1-D float arrays
+        point coordinates in EPSG:4326
+    """
+
+    def __init__(self, ids, x, y):
+        self.ids = np.asarray(ids)
+        self.x = np.asarray(x, dtype='float64')
+        self.y = np.asarray(y, dtype='float64')
+        self.tree = shapely.STRtree(shapely.points(self.x, self.y))
+        self.positions = pd.Index(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def for_points(cls, fc, point_id_name, work_dir, download_format='geojson', client=None):
+        """
+        Opens the index of a point collection cached in work_dir, or downloads and caches it
+
+        The cache file is named by the hash of the serialized collection, so a
+        changed collection is downloaded again.
+        """
+        key = hashlib.sha1(json.dumps([fc.serialize(), point_id_name]).encode()).hexdigest()[:16]
+        path = Path(work_dir).joinpath(f'point_index_{key}.parquet')
+        if path.exists():
+            points = pd.read_parquet(path)
+        else:
+            points = download_fc(fc, [point_id_name], download_format, coordinates=True, client=client)
+            points = pd.DataFrame({'id': points[point_id_name], 'x': points['x'], 'y': points['y']})
+            tmp_path = path.with_suffix('.tmp')
+            points.to_parquet(tmp_path, index=False)
+            tmp_path.replace(path)
+
+        return cls(points['id'].to_numpy(), points['x'].to_numpy(), points['y'].to_numpy())
+
+    def query(self, cell):
+        """ Returns the ids of the points intersecting a grid cell (GeoJSON geometry), as by filterBounds
+        """
+        return self.ids[np.sort(self.tree.query(shape(cell), predicate='intersects'))]
+
+    def cell_ids(self, grid):
+        """ Returns the point ids of each cell of a grid
+        """
+        return [self.query(cell) for cell in grid]
+
+    def adaptive_grid(self, target=1000):
+        """
+        Grid of cells holding at most target points each, see helpers.grid.adaptive_grid
+
+        Returns
+        -------
+        grid : list of dict
+            GeoJSON polygons of the grid cells, as by generate_grid
+        cell_ids : list of arrays
+            ids of the points of each grid cell
+        """
+        boxes, members = adaptive_grid(self.x, self.y, target)
+        return [box_geometry(box) for box in boxes], [self.ids[idx] for idx in members]
+
+    def coordinates(self, ids, point_id_name='id'):
+        """ Returns the coordinates of the points of a cell, as table of point id, x and y
+        """
+        positions = self.positions.get_indexer(ids)
+        return pd.DataFrame({point_id_name: self.ids[positions], 'x': self.x[positions], 'y': self.y[positions]})
+
+    def split(self, ids, target):
+        """
+        Splits the points of a cell into sub-cells of at most target points, as adaptive_grid
+        """
+        positions = self.positions.get_indexer(ids)
+        boxes, members = adaptive_grid(self.x[positions], self.y[positions], target)
+        return [box_geometry(box) for box in boxes], [self.ids[positions[idx]] for idx in members]
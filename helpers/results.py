@@ -0,0 +1,109 @@
+from pathlib import Path
+from contextlib import nullcontext
+
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from helpers.checkpoint import CheckpointStore, atomic_path
+
+
+def _write_gpkg(tables, gpkg_file, append):
+    # write one batch of grid cells to the geopackage, without the list columns (ts, ts_<band>, dates)
+    df = pd.concat(
+        [table.drop_columns([f.name for f in table.schema if pa.types.is_list(f.type)]).to_pandas() for table in tables],
+        ignore_index=True
+    )
+    gpd.GeoDataFrame(
+        df.drop('geometry', axis=1),
+        crs="EPSG:4326",
+        geometry=gpd.GeoSeries.from_wkb(df['geometry'])
+    ).to_file(
+        gpkg_file, driver='GPKG', mode='a' if append else 'w'
+    )
+
+
+def _unified_schema(files):
+    # schema of the columns of all grid cells, e.g. of a stage that failed in some cells, with
+    # types promoted where cells differ (e.g. an all-NaN or all-null column of a cell)
+    return pa.unify_schemas([pq.read_schema(file) for file in files], promote_options='permissive')
+
+
+def _conform(table, schema):
+    # puts a grid cell on the unified schema, columns it lacks become nulls
+    return pa.table([
+        table.column(field.name).cast(field.type) if field.name in table.schema.names else pa.nulls(table.num_rows, field.type)
+        for field in schema
+    ], schema=schema)
+
+
+def finalise_results(work_dir, gpkg=True, batch_size=50000):
+    """
+    Merges the grid cell results of a work_dir into the final outputs
+
+    The finished cells listed in the manifest of the work_dir are streamed one
+    after another into a Parquet dataset (final_results.parquet, one partition
+    per grid cell, ts/dates as list columns) and, in batches of around batch_size
+    points, into final_results.gpkg. Memory use therefore depends on the batch
+    size, not on the number of cells, and the function can be run on its own
+    on an existing work_dir. The outputs are rebuilt on every call and hold the
+    columns of all cells, columns a cell lacks (e.g. of a failed stage) are null.
+
+    Parameters
+    ----------
+    work_dir : str or Path
+        directory with the results of get_change_data
+    gpkg : bool, default=True
+        also write the points without ts/dates into a GeoPackage
+    batch_size : int, default=50000
+        number of points written to the GeoPackage at once
+
+    Returns
+    -------
+    int
+        number of points written
+    """
+
+    work_dir = Path(work_dir)
+    dataset_dir = work_dir.joinpath('final_results.parquet')
+    gpkg_file = work_dir.joinpath('final_results.gpkg')
+
+    results = CheckpointStore(work_dir).results()
+    schema = _unified_schema([file for _, file in results]) if results else None
+
+    # the outputs are rebuilt and swapped in, so they never keep cells of an earlier run (e.g. of another grid)
+    batch, batch_points, nr_of_points, appended = [], 0, 0, False
+    with atomic_path(dataset_dir) as tmp_dir, (atomic_path(gpkg_file) if gpkg else nullcontext()) as tmp_gpkg:
+        tmp_dir.mkdir()
+        for idx, file in results:
+            table = _conform(pq.read_table(file), schema)
+
+            # one partition per grid cell
+            partition = tmp_dir.joinpath(f'cell={idx}')
+            partition.mkdir()
+            pq.write_table(table, partition.joinpath('part-0.parquet'))
+            nr_of_points += table.num_rows
+
+            if gpkg:
+                batch.append(table)
+                batch_points += table.num_rows
+                if batch_points >= batch_size:
+                    _write_gpkg(batch, tmp_gpkg, appended)
+                    batch, batch_points, appended = [], 0, True
+
+        if gpkg and batch:
+            _write_gpkg(batch, tmp_gpkg, appended)
+
+    print(f' Merged {nr_of_points} points into {dataset_dir}.')
+    return nr_of_points
+
+
+def read_results(work_dir, columns=None):
+    """
+    Reads the final Parquet dataset of a work_dir into a GeoDataFrame
+    """
+    df = pd.read_parquet(Path(work_dir).joinpath('final_results.parquet'), columns=columns)
+    if 'geometry' in df:
+        df = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkb(df['geometry']), crs="EPSG:4326")
+    return df
@@ -0,0 +1,122 @@
+import math
+import heapq
+
+import numpy as np
+
+# revisit time of a landsat satellite in days, WRS-2 swath width and
+# distance of neighbouring paths at the equator in km
+REVISIT_DAYS = 16
+SWATH_KM = 185
+PATH_SPACING_KM = 172
+
+
+def expected_images(lat, years):
+    """
+    Expected number of landsat acquisitions of a location over a number of years
+
+    Paths overlap more towards the poles, so locations there are covered by
+    more path/rows and get more acquisitions than at the equator.
+    """
+    overlap = SWATH_KM / (PATH_SPACING_KM * np.cos(np.radians(np.clip(lat, -80, 80))))
+    return years * 365.25 / REVISIT_DAYS * np.maximum(overlap, 1)
+
+
+def cell_costs(grid, cell_ids, years):
+    """
+    Estimated cost of each grid cell, as its number of points times the expected images per point
+    """
+    lat = np.array([np.mean([y for _, y in cell['coordinates'][0]]) for cell in grid])
+    points = np.array([len(ids) for ids in cell_ids], dtype='float64')
+    return points * expected_images(lat, years)
+
+
+def plan_cells(grid, cell_ids, index, years, max_cost=None):
+    """
+    Splits oversize grid cells and estimates the cost of all cells
+
+    Cells whose estimated cost exceeds max_cost are replaced by sub-cells of
+    their points (see PointIndex.split) right where they are in the grid, so
+    the plan, and thus the cell indices, only depends on points and parameters
+    and stays valid for resumed runs.
+
+    Parameters
+    ----------
+    grid : list of dict
+        GeoJSON polygons of the grid cells
+    cell_ids : list of arrays
+        ids of the points of each grid cell
+    index : PointIndex
+        index of the points
+    years : float
+        length of the extracted period in years
+    max_cost : float, optional
+        maximum estimated cost (points x images) of a cell, no splitting if None
+
+    Returns
+    -------
+    grid, cell_ids
+        grid cells after splitting and their point ids
+    costs : 1-D float array
+        estimated cost of each cell, to dispatch the most expensive cells first
+    """
+
+    costs = cell_costs(grid, cell_ids, years)
+    if max_cost:
+        planned_grid, planned_ids = [], []
+        for cell, ids, cost in zip(grid, cell_ids, costs):
+            if cost > max_cost and len(ids) > 1:
+                sub_grid, sub_ids = index.split(ids, max(1, int(len(ids) * max_cost / cost)))
+                planned_grid += sub_grid
+                planned_ids += sub_ids
+            else:
+                planned_grid.append(cell)
+                planned_ids.append(ids)
+        grid, cell_ids = planned_grid, planned_ids
+        costs = cell_costs(grid, cell_ids, years)
+
+    return grid, cell_ids, costs
+
+
+def simulate(costs, workers, largest_first=True, max_cost=None):
+    """
+    Simulated wall clock time of processing cells of the given costs on a pool of workers
+
+    As the thread pool, each worker takes the next cell as soon as it is
+    idle. Cells above max_cost are split into equal parts first.
+    """
+    costs = [float(cost) for cost in costs if cost > 0]
+    if max_cost:
+        costs = [cost / parts for cost in costs for parts in [math.ceil(cost / max_cost)] for _ in range(parts)]
+    if largest_first:
+        costs = sorted(costs, reverse=True)
+
+    finish = [0.0] * workers
+    for cost in costs:
+        heapq.heappush(finish, heapq.heappop(finish) + cost)
+    return max(finish)
+
+
+def synthetic_costs(nr_of_cells=2000, empty=0.6, seed=0):
+    """
+    Heavy-tailed synthetic cell costs, most cells empty and a few dense ones, as for a country run
+    """
+    rng = np.random.default_rng(seed)
+    costs = rng.lognormal(mean=10, sigma=1.5, size=nr_of_cells)
+    return np.where(rng.random(nr_of_cells) < empty, 0, costs)
+
+
+def simulation_report(costs=None, workers=10, max_cost=None):
+    """
+    Prints the simulated wall clock time of grid order, largest-first and largest-first
+    with splitting, relative to the ideal of total cost divided by the workers
+    """
+    costs = synthetic_costs() if costs is None else np.asarray(costs, dtype='float64')
+    ideal = costs.sum() / workers
+    max_cost = max_cost or ideal / 10
+
+    for name, elapsed in [
+        ('grid order', simulate(costs, workers, largest_first=False)),
+        ('largest first', simulate(costs, workers)),
+        (f'largest first, split above {max_cost:.3g}', simulate(costs, workers, max_cost=max_cost)),
+    ]:
+        print(f' {name}: {elapsed / ideal:.2f} x total work / workers.')
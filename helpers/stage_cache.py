@@ -0,0 +1,160 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from helpers.checkpoint import atomic_path
+
+
+def data_fingerprint(df, store):
+    """
+    Hash of the input data of a stage: the point ids and their time-series
+    """
+    store = store.compact()
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(df['point_id'], index=False).to_numpy().tobytes())
+    h.update(np.ascontiguousarray(store.values).tobytes())
+    h.update(np.ascontiguousarray(store.dates).tobytes())
+    h.update(store.stops.tobytes())
+    return h.hexdigest()
+
+
+class StageCache:
+    """
+    Size-bounded cache of the output columns of the analysis stages
+
+    Outputs are stored per stage and grid cell as Parquet files (point_id and
+    the stage columns) under a key made from the stage name, the hash of its
+    parameters and the fingerprint of its input data. A SQLite index holds
+    size and last use of every entry, entries are evicted least recently used
+    first once the cache exceeds max_bytes. Hits and misses are counted per
+    stage in the same index, so the counts of all worker processes add up.
+
+    Parameters
+    ----------
+    cache_dir : str or Path
+        directory of the cache
+    max_bytes : int, default=2**30
+        maximum size of the cached files
+    """
+
+    def __init__(self, cache_dir, max_bytes=2**30):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        # one connection shared by the threads of a process, serialised by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.cache_dir.joinpath('index.sqlite'), timeout=60, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, stage TEXT, nbytes INTEGER, last_used REAL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS stats (stage TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)'
+        )
+
+        # the size limit may have been lowered since the last run
+        self.evict()
+
+    @classmethod
+    def from_config(cls, config_dict):
+        """
+        Opens the stage cache of a run, None if it is disabled (stage_cache_mb set to 0 or None)
+
+        The cache lives in stage_cache_dir (default: work_dir/stage_cache).
+        """
+        size = config_dict.get('stage_cache_mb', 1024)
+        if not size:
+            return None
+
+        cache_dir = config_dict.get('stage_cache_dir') or Path(config_dict['work_dir']).joinpath('stage_cache')
+        return cls(cache_dir, int(size * 2**20))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _count(self, stage, hit):
+        self._query(
+            'INSERT INTO stats VALUES (?, ?, ?) ON CONFLICT(stage) DO UPDATE SET '
+            'hits = hits + excluded.hits, misses = misses + excluded.misses',
+            (stage, int(hit), int(not hit))
+        )
+
+    @staticmethod
+    def key(stage, params_key, fingerprint):
+        """ Returns the cache key of a stage run
+        """
+        return f'{stage}-' + hashlib.sha1(f'{stage}:{params_key}:{fingerprint}'.encode()).hexdigest()[:24]
+
+    def _path(self, key):
+        return self.cache_dir.joinpath(f'{key}.parquet')
+
+    def get(self, stage, key):
+        """ Returns the cached output of a stage run as DataFrame, None if it is not cached
+        """
+        try:
+            df = pq.read_table(self._path(key)).to_pandas()
+        except (OSError, pa.ArrowException):
+            # not cached, or evicted by another process in the meantime
+            self._count(stage, False)
+            return None
+
+        self._query('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        self._count(stage, True)
+        return df
+
+    def put(self, stage, key, df):
+        """ Caches the output of a stage run and evicts old entries if the cache is full
+        """
+        path = self._path(key)
+        with atomic_path(path) as tmp_path:
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+
+        self._query(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, stage, path.stat().st_size, time.time())
+        )
+        self.evict()
+
+    def evict(self):
+        """ Removes least recently used entries until the cache fits into max_bytes
+        """
+        total = self._query('SELECT COALESCE(SUM(nbytes), 0) FROM entries')[0][0]
+        if total <= self.max_bytes:
+            return
+
+        for key, nbytes in self._query('SELECT key, nbytes FROM entries ORDER BY last_used'):
+            self._path(key).unlink(missing_ok=True)
+            self._query('DELETE FROM entries WHERE key = ?', (key,))
+            total -= nbytes
+            if total <= self.max_bytes:
+                break
+
+    @property
+    def nbytes(self):
+        return self._query('SELECT COALESCE(SUM(nbytes), 0) FROM entries')[0][0]
+
+    def stats(self):
+        """ Returns hits and misses per stage as DataFrame
+        """
+        return pd.DataFrame(
+            self._query('SELECT stage, hits, misses FROM stats ORDER BY stage'), columns=['stage', 'hits', 'misses']
+        ).set_index('stage')
+
+    def reset_stats(self):
+        self._query('DELETE FROM stats')
+
+    def report(self):
+        """ Prints hits and misses per stage and the size of the cache
+        """
+        for stage, (hits, misses) in self.stats().iterrows():
+            print(f' Stage cache {stage}: {hits} hits, {misses} misses.')
+        print(f' Stage cache size: {self.nbytes / 2**20:.1f} of {self.max_bytes / 2**20:.1f} MB.')
@@ -1,9 +1,12 @@
 import numpy as np
-import pandas as pd
 from datetime import datetime as dt
 
 from bfast import BFASTMonitor
-from godale import Executor
+from bfast.monitor.utils import compute_lam
+
+from helpers.ts_analysis.parallel import map_chunks, map_points, to_columns
+from helpers.ts_analysis.ts_store import to_datetime_index
+from helpers.ts_analysis.dates import design_matrix, parse_date, to_day_number, to_fractional_year
 
 # default bFast parameters
 defaults = {
@@ -48,12 +51,13 @@ def bfast_monitor(args):
     
     # initialize model
     params = bfast_params.copy()
-    params.update(start_monitor=dt.strptime(bfast_params['start_monitor'], '%Y-%m-%d'))
+    start_monitor = parse_date(bfast_params['start_monitor'])
+    params.update(start_monitor=start_monitor)
     del params['run']
+    params.pop('batch', None)
     model = BFASTMonitor(**params)
     
     # check if we have dates in the monitoring period
-    start_monitor = dt.strptime(bfast_params['start_monitor'], '%Y-%m-%d')
     mon_dates = [date for date in dates if date > start_monitor]
     if mon_dates: 
         # fit gistorical period
@@ -87,24 +91,178 @@ def bfast_monitor(args):
     return bfast_date, bfast_magnitude, bfast_means, point_id
 
 
-def run_bfast_monitor(df, bfast_params):
+def bfast_monitor_batch(data, days, start_monitor, freq=365, k=3, hfrac=0.25, trend=False, level=0.05, period=10):
+    """
+    BFAST Monitor for many points at once on a shared date axis
+    
+    Follows bfast's python backend point by point: the season-trend model is fit 
+    on the history period of each point by batched least squares, and the MOSUM 
+    process of the residuals over the monitoring period is compared against 
+    the boundary. Zero values are treated as missing, as by bfast.
+    
+    Parameters
+    ----------
+    data : 2-D float array
+        values of shape (points x dates), NaN where a point has no observation
+    days : 1-D int array
+        sorted day numbers (days since 1970-01-01) of the date axis
+    start_monitor : int
+        day number of the start of the monitoring period
+    freq, k, hfrac, trend, level, period
+        parameters of BFASTMonitor
+        
+    Returns
+    -------
+    breaks : 1-D int array
+        index of the first break within each point's own dates of the monitoring 
+        period, -1 if there is none and -2 if there are not enough observations
+    means : 1-D float array
+        mean of the MOSUM process
+    magnitudes : 1-D float array
+        median residual of the monitoring period
+    """
+    
+    days = np.asarray(days, dtype='int64')
+    nr_points, nr_dates = data.shape
+    present = np.isfinite(data)
+    valid = present & (data != 0)
+    history = days < start_monitor
+    
+    # number of observations (n) and of valid ones (ns, Ns) per point
+    n = (present & history).sum(axis=1)
+    ns = (valid & history).sum(axis=1)
+    Ns = valid.sum(axis=1)
+    enough = (ns > 5) & (Ns - ns > 5) & (present & (days > start_monitor)).any(axis=1)
+    
+    # (1) fit the history model of all points at once, phase and offset differences 
+    # of the per-point time origins are absorbed by the harmonic and intercept terms
+    X = design_matrix(days, freq, k, trend)
+    y = np.where(valid, data, 0)
+    W = (valid & history).astype('float64')
+    A = (W[:, None, :] * X[None]) @ X.T
+    b = (W * y) @ X.T
+    coef = (np.linalg.pinv(A) @ b[:, :, None])[:, :, 0]
+    errors = np.where(valid, y - coef @ X, 0)
+    
+    # pack the valid observations of each point to the front (in date order)
+    order = np.argsort(~valid, axis=1, kind='stable')
+    packed = np.take_along_axis(errors, order, axis=1)
+    packed_days = days[order]
+    own_position = np.take_along_axis(np.cumsum(present, axis=1) - 1, order, axis=1)
+    position = np.arange(nr_dates)
+    monitoring = (position >= ns[:, None]) & (position < Ns[:, None])
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        
+        # (2) moving sums over windows of h valid residuals, ending at each monitored observation
+        h = (ns * hfrac).astype('int64')
+        cumsum = np.concatenate([np.zeros((nr_points, 1)), np.cumsum(packed, axis=1)], axis=1)
+        window_start = np.clip(position[None] + 1 - h[:, None], 0, nr_dates)
+        mosum = cumsum[:, 1:] - np.take_along_axis(cumsum, window_start, axis=1)
+        
+        sigma = np.sqrt((np.where(position < ns[:, None], packed, 0) ** 2).sum(axis=1) / (ns - (2 + 2 * k)))
+        mosum = mosum / (sigma * np.sqrt(ns))[:, None]
+        
+        means = np.where(monitoring, mosum, 0).sum(axis=1) / np.maximum(Ns - ns, 1)
+        
+        # median of the monitoring period residuals, which are sorted to the front of each row
+        sorted_errors = np.sort(np.where(monitoring, packed, np.inf), axis=1)
+        middle = np.clip(np.stack([(Ns - ns - 1) // 2, (Ns - ns) // 2], axis=1), 0, max(nr_dates - 1, 0))
+        magnitudes = np.take_along_axis(sorted_errors, middle, axis=1).mean(axis=1) if nr_dates else np.zeros(nr_points)
+        
+        # boundary on each point's own time axis (days since the 1st of January of its first year)
+        first_day = np.where(present, days, np.iinfo('int64').max).min(axis=1)
+        origin = first_day.astype('datetime64[D]').astype('datetime64[Y]').astype('datetime64[D]').astype('int64')
+        last_history_day = np.where(present & history, days, 0).max(axis=1, initial=0)
+        a = (packed_days - origin[:, None]) / (last_history_day - origin)[:, None]
+        bounds = compute_lam(nr_dates, hfrac, level, period) * np.sqrt(np.where(a > np.e, np.log(np.maximum(a, 1)), 1))
+    
+        crossing = monitoring & (np.abs(mosum) > bounds)
+    
+    # first break as position within the point's own monitoring period dates
+    first = crossing.argmax(axis=1)
+    breaks = np.where(crossing.any(axis=1), own_position[np.arange(nr_points), first] - n, -1)
+    
+    breaks = np.where(enough, breaks, -2)
+    means = np.where(enough, means, 0)
+    magnitudes = np.where(enough, magnitudes, 0)
+    
+    return breaks, means, magnitudes
+
+
+def bfast_monitor_chunk(chunk, bfast_params):
+    """
+    Runs bfast_monitor_batch on a chunk of (values, dates) items, with dates as day numbers
+    
+    Returns the (bfast_change_date, bfast_magnitude, bfast_means) of each item as bfast_monitor
+    """
+    
+    start_monitor = to_day_number(bfast_params['start_monitor'])
+    
+    # regrid the series onto the union of their dates, NaN where a point has no observation
+    days = np.unique(np.concatenate([dates for _, dates in chunk] + [np.zeros(0, dtype='int32')]))
+    data = np.full((len(chunk), len(days)), np.nan)
+    for i, (values, dates) in enumerate(chunk):
+        data[i, np.searchsorted(days, dates)] = values
+    
+    breaks, means, magnitudes = bfast_monitor_batch(
+        data, days, start_monitor, 
+        freq=bfast_params['freq'], 
+        k=bfast_params['k'], 
+        hfrac=bfast_params['hfrac'], 
+        trend=bfast_params['trend'], 
+        level=bfast_params['level'], 
+        period=bfast_params.get('period', 10)
+    )
+    
+    # the date of a break is taken as by the wrapper: mon_dates[breaks - 1]
+    present = np.isfinite(data)
+    own_columns = np.argsort(~present, axis=1, kind='stable')
+    mon_start = (present & (days <= start_monitor)).sum(axis=1)
+    own_index = np.where(breaks >= 1, mon_start + breaks - 1, present.sum(axis=1) - 1)
+    break_days = days[own_columns[np.arange(len(chunk)), np.maximum(own_index, 0)]] if len(days) else breaks
+    
+    found = breaks >= 0
+    change_date = np.where(found, to_fractional_year(break_days), breaks)
+    return list(zip(
+        change_date, 
+        np.where(found, magnitudes, 0).astype('float32'), 
+        np.where(found, means, 0).astype('float32')
+    ))
+
+
+def run_bfast_monitor_batch(store, bfast_params, executor_params=None):
+    """
+    Batched implementation of bfast_monitor over a whole grid cell
+    
+    Points are ordered by their date vector before chunking, so that chunks hold points 
+    of the same acquisitions (e.g. path/row), their union date axis stays short and 
+    the design matrix of a date vector is built once for all its chunks.
+    """
+    group = store.date_context.groups(store.starts, store.stops)
+    order = np.argsort(group, kind='stable')
+    
+    results = map_chunks(bfast_monitor_chunk, list(store.take(order)), executor_params, fargs=[bfast_params])
+    return to_columns(
+        [results[i] for i in np.argsort(order)], 
+        ['bfast_change_date', 'bfast_magnitude', 'bfast_means']
+    )
+
+
+def run_bfast_monitor(store, bfast_params, executor_params=None):
     """
     Parallel implementation of the bfast_monitor function
+    
+    Returns a dict of result columns aligned with the points of store
     """
-    args_list, d = [], {}
-    for i, row in df.iterrows():
-        args_list.append([row.ts, row.dates, row.point_id, bfast_params])
+    if bfast_params.get('batch', False):
+        return run_bfast_monitor_batch(store, bfast_params, executor_params)
+    
+    args_list = []
+    for i, (values, dates) in enumerate(store):
+        args_list.append([values.tolist(), to_datetime_index(dates), i, bfast_params])
         
-    executor = Executor(executor="concurrent_threads", max_workers=16)
-    for i, task in enumerate(executor.as_completed(
-        func=bfast_monitor,
-        iterable=args_list
-    )):
-        try:
-            d[i] = list(task.result())
-        except ValueError:
-            print("bfast task failed")
-            
-    bfast_df = pd.DataFrame.from_dict(d, orient='index')
-    bfast_df.columns = ['bfast_change_date', 'bfast_magnitude', 'bfast_means', 'point_id']
-    return pd.merge(df, bfast_df, on='point_id')    
\ No newline at end of file
+    return to_columns(
+        map_points(bfast_monitor, args_list, executor_params), 
+        ['bfast_change_date', 'bfast_magnitude', 'bfast_means']
+    )    
\ No newline at end of file
@@ -1,12 +1,88 @@
 import numpy as np
-import pandas as pd
-from godale import Executor
+
+from helpers.ts_analysis.helpers import to_padded_array
+from helpers.ts_analysis.parallel import map_chunks, to_columns, point_rngs, random_keys
 
 def slope(x, y):
     A = np.vstack([x, np.ones(len(x))]).T
     m, c = np.linalg.lstsq(A, y, rcond=None)[0]
     return m
 
+
+def bootstrap_slope_batch(y, x, nr_bootstraps, rngs, size=.66, chunk_size=None):
+    """
+    Bootstrap of the linear regression slope, vectorised over points and replicates
+    
+    Each replicate draws a random subsample of int(n * size) observations per point 
+    and the OLS slopes of all subsamples are calculated in closed form from the 
+    masked sums of x, y, xy and x².
+    
+    Parameters
+    ----------
+    y : 2-D float array
+        time-series values of shape (points x dates), NaN padded at the end
+    x : 2-D float array
+        fractional year dates of the same shape as y
+    nr_bootstraps : int
+        number of bootstrap replicates
+    rngs : list of numpy.random.Generator
+        random number generator of each point used for its subsamples
+    size : float
+        fraction of the observations drawn per replicate
+    chunk_size : int, optional
+        number of replicates processed at once
+        
+    Returns
+    -------
+    mean, sd, min, max : 1-D float arrays
+        statistics of the bootstrapped slopes per point (0 for empty series)
+    """
+    
+    y, x = np.asarray(y, dtype='float64'), np.asarray(x, dtype='float64')
+    valid = np.isfinite(y)
+    lengths = valid.sum(axis=1)
+    nr_points, nr_dates = y.shape
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(nr_points * nr_dates, 1))
+    
+    # center the data per point for numerical stability of the closed form
+    x, y = np.where(valid, x, 0), np.where(valid, y, 0)
+    counts = np.maximum(lengths, 1)[:, None]
+    x_c = np.where(valid, x - x.sum(axis=1, keepdims=True) / counts, 0)
+    y_c = np.where(valid, y - y.sum(axis=1, keepdims=True) / counts, 0)
+    
+    # number of samples drawn per point, and the extent of its keys up to the last observation
+    k = (lengths * size).astype('int64')
+    extent = np.where(lengths > 0, nr_dates - valid[:, ::-1].argmax(axis=1), 0)
+    
+    slopes = np.zeros((nr_bootstraps, nr_points))
+    for start in range(0, nr_bootstraps, chunk_size):
+        
+        # random keys, padded positions are never selected
+        keys = random_keys(rngs, extent, min(chunk_size, nr_bootstraps - start), nr_dates)
+        keys[:, ~valid] = 2
+        
+        # select the k smallest keys of each point, i.e. a random subsample without replacement
+        threshold = np.take_along_axis(np.sort(keys, axis=-1), np.maximum(k - 1, 0)[None, :, None], axis=-1)
+        mask = (keys <= threshold) & (k > 0)[None, :, None]
+        
+        # closed form ols slope from the masked sums
+        n = k[None, :]
+        s_x = np.einsum('bpt,pt->bp', mask, x_c)
+        s_y = np.einsum('bpt,pt->bp', mask, y_c)
+        s_xy = np.einsum('bpt,pt->bp', mask, x_c * y_c)
+        s_xx = np.einsum('bpt,pt->bp', mask, x_c * x_c)
+        numerator, denominator = n * s_xy - s_x * s_y, n * s_xx - s_x ** 2
+        slopes[start:start + len(keys)] = np.divide(
+            numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0
+        )
+    
+    # calculate stats and set empty series to 0
+    empty = lengths == 0
+    stats = slopes.mean(axis=0), slopes.std(axis=0), slopes.min(axis=0), slopes.max(axis=0)
+    return tuple(np.where(empty, 0, stat) for stat in stats)
+
+
 def bootstrap_slope(args):
     # This function takes x and y and calculates the bootstrap on the slope of the linear regression between both,
     # whereas values are sorted
@@ -14,51 +90,44 @@ def bootstrap_slope(args):
     # unpack args and transform data and dates into numpy arrays
     y, x, nr_bootstraps, point_id = args
     if x:
-        x, y = np.array(x), np.array(y)
-
-        boot_means = []
-        for _ in range(nr_bootstraps):
-
-            # the fraction of sample we want to include (randon)
-            #size = np.abs(np.random.normal(0.5, 0.1))
-            size = .66
-            # select the random samples
-            rand_idx = sorted(np.random.choice(np.arange(y.size), int(y.size * size), replace=False))
-
-            # calculate the slope on the randomly selected samples
-            s = slope(x[rand_idx], y[rand_idx])
-
-            # add to list of bootstrap samples
-            boot_means.append(s)
-
-        # calculate stats adn return
-        boot_means_np = np.array(boot_means)
-        return np.mean(boot_means_np), np.std(boot_means_np), np.max(boot_means_np), np.min(boot_means_np), point_id
+        x, y = np.array(x, dtype='float64')[None], np.array(y, dtype='float64')[None]
+        mean, sd, min_, max_ = bootstrap_slope_batch(y, x, nr_bootstraps, [np.random.default_rng()])
+        return mean[0], sd[0], min_[0], max_[0], point_id
     else:
         return 0, 0, 0, 0, point_id
 
 
-def run_bs_slope(df, bs_slope_params):
+def bootstrap_slope_chunk(chunk, nr_bootstraps, seed=None, bootstrap_chunk_size=None):
     """
-    Parallel implementation of the bootstrap slope function
+    Runs bootstrap_slope_batch on a chunk of (index, ts, dates) items
     """
     
-    nr_of_bootstraps = bs_slope_params['nr_of_bootstraps']
-    args_list, d = [], {}
-    for i, row in df.iterrows():
-        dates_float = [(date.year + np.round(date.dayofyear/365, 3)) for date in row.dates] 
-        args_list.append([row.ts, dates_float, nr_of_bootstraps, row.point_id])
-        
-    executor = Executor(executor="concurrent_threads", max_workers=16)
-    for i, task in enumerate(executor.as_completed(
-        func=bootstrap_slope,
-        iterable=args_list
-    )):
-        try:
-            d[i] = list(task.result())
-        except ValueError:
-            print("bootstrap task failed")
-            
-    slope_df = pd.DataFrame.from_dict(d, orient='index')
-    slope_df.columns = ['bs_slope_mean', 'bs_slope_sd', 'bs_slope_min', 'bs_slope_max', 'point_id']
-    return pd.merge(df, slope_df, on='point_id')    
\ No newline at end of file
+    rngs = point_rngs(seed, [i for i, _, _ in chunk])
+    y, _ = to_padded_array([ts for _, ts, _ in chunk])
+    x, _ = to_padded_array([dates for _, _, dates in chunk])
+    
+    stats = bootstrap_slope_batch(y, x, nr_bootstraps, rngs, chunk_size=bootstrap_chunk_size)
+    return list(zip(*stats))
+
+
+def run_bs_slope(store, bs_slope_params, executor_params=None):
+    """
+    Vectorised implementation of the bootstrap slope function, run in chunks of points
+    
+    Returns a dict of result columns aligned with the points of store
+    """
+    
+    dates_float = store.date_context.fractional_years
+    args_list = []
+    for i, (start, stop) in enumerate(zip(store.starts, store.stops)):
+        args_list.append((i, store.values[start:stop], dates_float[start:stop]))
+    
+    return to_columns(
+        map_chunks(
+            bootstrap_slope_chunk, 
+            args_list, 
+            executor_params, 
+            fargs=[bs_slope_params['nr_of_bootstraps'], bs_slope_params.get('seed'), bs_slope_params.get('bootstrap_chunk_size')]
+        ), 
+        ['bs_slope_mean', 'bs_slope_sd', 'bs_slope_min', 'bs_slope_max']
+    )
@@ -0,0 +1,221 @@
+import numpy as np
+from scipy import stats
+
+from helpers.ts_analysis.parallel import map_chunks, to_columns
+from helpers.ts_analysis.dates import to_day_number, to_fractional_year
+
+# default parameters of the local CCDC, named after the ones of ee.Algorithms.TemporalSegmentation.Ccdc
+defaults = {
+    'backend': 'local',
+    'breakpoint_bands': ['green', 'red', 'nir', 'swir1', 'swir2'],
+    'magnitude_band': 'ndvi',
+    'min_observations': 6,
+    'chi_square_probability': 0.99,
+    'min_years': 1.33,
+    'harmonics': 3,
+    'init_observations': 12
+}
+
+
+def runs_locally(ccdc_params):
+    """ If CCDC runs as local analysis stage (backend 'local') instead of on EE (backend 'ee')
+    """
+    return bool(ccdc_params['run']) and ccdc_params.get('backend', defaults['backend']) == 'local'
+
+
+def extraction_bands(config_dict):
+    """
+    Bands to extract: the band(s) of ts_params, plus the breakpoint and magnitude bands of a local CCDC
+    """
+    band = config_dict['ts_params']['band']
+    bands = [band] if isinstance(band, str) else list(band)
+
+    ccdc_params = config_dict.get('ccdc_params') or {'run': False}
+    if runs_locally(ccdc_params):
+        params = dict(defaults, **ccdc_params)
+        bands += [b for b in [*params['breakpoint_bands'], params['magnitude_band']] if b not in bands]
+
+    return bands
+
+
+def design(years, harmonics):
+    """
+    Regressors of the CCDC model (intercept, slope and annual harmonics) of shape (... x coefficients)
+    """
+    t = years - 2000
+    rows = [np.ones_like(t), t]
+    for k in range(1, harmonics + 1):
+        rows += [np.cos(2 * np.pi * k * years), np.sin(2 * np.pi * k * years)]
+    return np.stack(rows, axis=-1)
+
+
+def ccdc_batch(
+    values, years, valid, breakpoint_bands, magnitude_band, start_monitor=None, min_observations=6,
+    chi_square_probability=0.99, min_years=1.33, harmonics=3, init_observations=12
+):
+    """
+    CCDC-style harmonic segmentation of many points at once
+
+    Follows the continuous change detection of Zhu & Woodcock (2014): a
+    harmonic model is fit per band on at least init_observations observations
+    spanning min_years, and updated with every observation that fits it. An
+    observation exceeds the model if the sum of its squared residuals over the
+    breakpoint bands, normalised by the RMSE of each band, exceeds the
+    chi-square quantile of chi_square_probability. min_observations exceeding
+    observations in a row make a break, dated at the first of them, with the
+    median residual of the magnitude band as magnitude. A new segment starts
+    with the exceeding observations. The model is updated by accumulating its
+    normal equations, so all points advance through time together.
+
+    Parameters
+    ----------
+    values : 3-D float array
+        values of shape (points x dates x bands), packed to the front of each row
+    years : 2-D float array
+        fractional years of the observations, of shape (points x dates)
+    valid : 2-D bool array
+        mask of the observations to use
+    breakpoint_bands : list of int
+        band positions used to detect breaks
+    magnitude_band : int
+        band position of the magnitude
+    start_monitor : float, optional
+        only breaks after this fractional year are reported
+
+    Returns
+    -------
+    change_date : 1-D float array
+        fractional year of the break of largest absolute magnitude after start_monitor, 0 if there is none
+    magnitude : 1-D float array
+        magnitude of that break, 0 if there is none
+    """
+
+    nr_points, nr_dates, nr_bands = values.shape
+    X = design(years, harmonics)
+    p = X.shape[-1]
+    threshold = stats.chi2.ppf(chi_square_probability, len(breakpoint_bands))
+    init_observations = max(init_observations, p + 1)
+    valid = valid & np.isfinite(values).all(axis=2)
+    values = np.where(valid[..., None], values, 0)
+    rows = np.arange(nr_points)
+
+    # normal equations of the current segment and of the running streak of exceeding observations
+    A, b, yy, n = np.zeros((nr_points, p, p)), np.zeros((nr_points, nr_bands, p)), np.zeros((nr_points, nr_bands)), np.zeros(nr_points, dtype='int64')
+    Ap, bp, yyp, npend = np.zeros_like(A), np.zeros_like(b), np.zeros_like(yy), np.zeros_like(n)
+    streak_start, streak_residuals = np.zeros(nr_points), np.zeros((nr_points, min_observations))
+    segment_start = np.full(nr_points, np.nan)
+
+    coef, rmse = np.zeros((nr_points, nr_bands, p)), np.ones((nr_points, nr_bands))
+    fitted = np.zeros(nr_points, dtype=bool)
+    change_date, magnitude = np.zeros(nr_points), np.zeros(nr_points)
+
+    for j in range(nr_dates):
+        x, y, ok, year = X[:, j], values[:, j], valid[:, j], years[:, j]
+        xx = x[:, :, None] * x[:, None, :]
+
+        # test the observation against the model of the fitted points
+        residuals = y - np.einsum('nbp,np->nb', coef, x)
+        score = ((residuals[:, breakpoint_bands] / rmse[:, breakpoint_bands]) ** 2).sum(axis=1)
+        exceed = ok & fitted & (score > threshold)
+        accept = ok & ~exceed
+
+        # an interrupted streak belongs to the segment
+        join = accept & (npend > 0)
+        A[join] += Ap[join]; b[join] += bp[join]; yy[join] += yyp[join]; n[join] += npend[join]
+        Ap[join], bp[join], yyp[join], npend[join] = 0, 0, 0, 0
+
+        # accepted observations extend the segment
+        segment_start = np.where(accept & (n == 0), year, segment_start)
+        A[accept] += xx[accept]
+        b[accept] += y[accept][:, :, None] * x[accept][:, None, :]
+        yy[accept] += y[accept] ** 2
+        n[accept] += 1
+
+        # exceeding observations extend the streak
+        streak_start = np.where(exceed & (npend == 0), year, streak_start)
+        streak_residuals[rows[exceed], npend[exceed]] = residuals[exceed, magnitude_band]
+        Ap[exceed] += xx[exceed]
+        bp[exceed] += y[exceed][:, :, None] * x[exceed][:, None, :]
+        yyp[exceed] += y[exceed] ** 2
+        npend[exceed] += 1
+
+        # a full streak is a break, and the start of a new segment
+        brk = npend >= min_observations
+        if brk.any():
+            brk_magnitude = np.median(streak_residuals[brk], axis=1)
+            report = np.abs(brk_magnitude) > np.abs(magnitude[brk])
+            if start_monitor is not None:
+                report &= streak_start[brk] > start_monitor
+            idx = rows[brk][report]
+            change_date[idx], magnitude[idx] = streak_start[idx], brk_magnitude[report]
+
+            A[brk], b[brk], yy[brk], n[brk] = Ap[brk], bp[brk], yyp[brk], npend[brk]
+            Ap[brk], bp[brk], yyp[brk], npend[brk] = 0, 0, 0, 0
+            segment_start[brk], fitted[brk] = streak_start[brk], False
+
+        # (re-)fit the models of all points whose segment grew
+        fit = (accept | brk) & (n >= init_observations) & (year - segment_start >= min_years)
+        if fit.any():
+            ridge = 1e-9 * np.eye(p)
+            c = np.linalg.solve(A[fit] + ridge, b[fit].transpose(0, 2, 1)).transpose(0, 2, 1)
+            sse = yy[fit] - 2 * (c * b[fit]).sum(axis=2) + np.einsum('nbp,npq,nbq->nb', c, A[fit], c)
+            coef[fit] = c
+            rmse[fit] = np.sqrt(np.maximum(sse, 0) / np.maximum(n[fit] - p, 1)[:, None]) + 1e-9
+            fitted |= fit
+
+    return change_date, magnitude
+
+
+def ccdc_chunk(chunk, band_positions, magnitude_position, ccdc_params):
+    """
+    Runs ccdc_batch on a chunk of (values, years) items, values of shape (dates x bands)
+    """
+    lengths = np.array([len(years) for _, years in chunk])
+    valid = np.arange(lengths.max(initial=1)) < lengths[:, None]
+    values = np.full(valid.shape + (chunk[0][0].shape[1],), np.nan)
+    years = np.zeros(valid.shape)
+    values[valid] = np.concatenate([v for v, _ in chunk])
+    years[valid] = np.concatenate([y for _, y in chunk])
+
+    start_monitor = ccdc_params.get('start_monitor')
+    if start_monitor is not None:
+        start_monitor = to_fractional_year([to_day_number(start_monitor)])[0]
+
+    change_date, magnitude = ccdc_batch(
+        values, years, valid, band_positions, magnitude_position,
+        start_monitor=start_monitor,
+        min_observations=ccdc_params['min_observations'],
+        chi_square_probability=ccdc_params['chi_square_probability'],
+        min_years=ccdc_params['min_years'],
+        harmonics=ccdc_params['harmonics'],
+        init_observations=ccdc_params['init_observations']
+    )
+    return list(zip(change_date, magnitude))
+
+
+def run_ccdc(store, ccdc_params, executor_params=None):
+    """
+    Local CCDC on the extracted multi-band time-series of a grid cell, run in chunks of points
+
+    Only breaks after ccdc_params['start_monitor'] are reported, the analysis
+    stage sets it to ts_params['start_monitor'] unless given (see stage_params).
+    Without it, breaks of the whole series are reported.
+
+    Returns a dict of result columns aligned with the points of store
+    """
+    params = dict(defaults, **ccdc_params)
+    missing = [band for band in [*params['breakpoint_bands'], params['magnitude_band']] if band not in (store.bands or [])]
+    if missing:
+        raise ValueError(f"Bands {missing} needed for CCDC are not in the extracted bands {store.bands}.")
+
+    band_positions = [store.bands.index(band) for band in params['breakpoint_bands']]
+    magnitude_position = store.bands.index(params['magnitude_band'])
+
+    years = store.date_context.fractional_years
+    values = store.values if store.values.ndim == 2 else store.values[:, None]
+    args_list = [(values[start:stop], years[start:stop]) for start, stop in zip(store.starts, store.stops)]
+
+    return to_columns(
+        map_chunks(ccdc_chunk, args_list, executor_params, fargs=[band_positions, magnitude_position, params]),
+        ['ccdc_change_date', 'ccdc_magnitude']
+    )
@@ -1,51 +1,49 @@
+import importlib
+
 import numpy as np
-import pandas as pd
-import tensorflow as tf 
-from godale import Executor
+
+from helpers.ts_analysis.helpers import to_padded_array
+from helpers.ts_analysis.parallel import map_chunks, map_points, to_columns, point_rngs, random_keys
+
+# available backends of the per-point cusum_deforest function, 
+# the tensorflow one is only imported on request
+BACKENDS = {
+    'numpy': 'helpers.ts_analysis.cusum',
+    'tensorflow': 'helpers.ts_analysis.cusum_tf'
+}
+
+def get_backend(name='numpy'):
+    """
+    Returns the module implementing cusum_calculation and bootstrap for a backend name
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown cusum backend '{name}'. Choose one of {list(BACKENDS)}.")
+    
+    return importlib.import_module(BACKENDS[name])
+
 
 def cusum_calculation(residuals):
     
     # do cumsum calculation
-    cumsum = tf.math.cumsum(residuals, axis=0)
-    s_max = tf.math.reduce_max(cumsum, axis=0)
-    s_min = tf.math.reduce_min(cumsum, axis=0)
-    s_diff = tf.subtract(s_max, s_min)
+    cumsum = np.cumsum(residuals, axis=0)
+    s_diff = cumsum.max(axis=0) - cumsum.min(axis=0)
    
-    # get podition of max value
-    argmax = tf.math.argmax(cumsum, axis=0)
+    # get position of max value
+    argmax = cumsum.argmax(axis=0)
                 
     return s_diff, argmax
 
 
-def bootstrap(stack, s_diff, nr_bootstraps):
+def bootstrap(stack, s_diff, nr_bootstraps, rng=None):
     
-    # intialize iteration variables
-    i, comparison_array, change_sum = 0, tf.zeros(s_diff.shape), tf.zeros(s_diff.shape)
-    while i < nr_bootstraps:
-        
-        # shuffle first axis 
-        shuffled_index = tf.random.shuffle(range(stack.shape[0]))
-        
-        # run cumsum on re-shuffled stack
-        s_diff_bs, _ = cusum_calculation(tf.gather(stack, shuffled_index, axis=0))
-        
-        # compare if s_diff_bs is greater and sum up
-        comparison_array += tf.cast(tf.greater(s_diff, s_diff_bs), 'float32') 
-        
-        # sum up random change magnitude s_diff_bs 
-        change_sum += s_diff_bs
-        
-        # set counter
-        i+=1
-    
-    # calculate final confidence and significance
-    confidences = tf.math.divide_no_nan(comparison_array, nr_bootstraps)
-    signficance = tf.math.subtract(1, tf.math.divide_no_nan(tf.math.divide_no_nan(change_sum, nr_bootstraps), s_diff))
+    # the batched bootstrap with a single point is the per-point bootstrap
+    rng = np.random.default_rng() if rng is None else rng
+    stack = np.asarray(stack, dtype='float64')
+    change_point_confidence = bootstrap_batch(
+        stack[None], np.array([stack.shape[0]]), np.array([s_diff]), nr_bootstraps, [rng]
+    )
     
-    # calculate final confidence level
-    change_point_confidence = tf.math.multiply(confidences, signficance)
-    
-    return change_point_confidence
+    return change_point_confidence[0]
 
 
 def cusum_deforest(args):
@@ -57,6 +55,8 @@ def cusum_deforest(args):
     stack : pandas series
             dates as index and values of the time-series
     nr_bootstraps : int, default=1000
+    backend : str, optional
+            'numpy' (default) or 'tensorflow'
                 
     Returns
     -------
@@ -68,56 +68,213 @@ def cusum_deforest(args):
             Change magnitude based on the s_max parameter
     """
     
-    # unpack args
-    data, dates, point_id, nr_bootstraps = args
+    # unpack args, the name of the backend is optional
+    data, dates, point_id, nr_bootstraps = args[:4]
+    backend = get_backend(args[4] if len(args) > 4 else 'numpy')
     
     if data:
-        stack_tf = tf.convert_to_tensor(np.nan_to_num(data), dtype='float32')
-        mask = tf.convert_to_tensor(np.isfinite(data).astype('float32'), dtype='float32')
+        stack = np.nan_to_num(np.asarray(data, dtype='float32'))
+        mask = np.isfinite(data).astype('float32')
 
         # calculate mean
-        mean_tf = tf.math.divide_no_nan(tf.math.reduce_sum(stack_tf, axis=0), tf.math.reduce_sum(mask, axis=0))
+        mean = stack.sum(axis=0) / max(mask.sum(axis=0), 1)
 
         # calculate residuals (broadcasting here)
-        residuals = tf.math.subtract(stack_tf, mean_tf)
+        residuals = stack - mean
 
         # mask original nans of stack and treat them as zeros
-        residuals = tf.where(tf.math.equal(stack_tf, 0), tf.zeros_like(stack_tf), residuals)
+        residuals = np.where(stack == 0, np.float32(0), residuals)
 
         # get original cumsum caluclation and dates
-        s_diff, argmax = cusum_calculation(residuals)
+        s_diff, argmax = backend.cusum_calculation(residuals)
 
         # get dates into change array
-        date = np.array(dates)[argmax.numpy()]
-        magnitude = s_diff.numpy()
+        date = np.array(dates)[np.asarray(argmax)]
+        magnitude = np.asarray(s_diff)
 
         # get confidence from bootstrap procedure
-        confidence = bootstrap(residuals, s_diff, nr_bootstraps).numpy()
+        confidence = np.asarray(backend.bootstrap(residuals, s_diff, nr_bootstraps))
     else:
         date, confidence, magnitude = 0, 0, 0
     return date, confidence, magnitude, point_id
 
 
-def run_cusum_deforest(df, cusum_params):
+def cusum_calculation_batch(residuals):
+    """
+    Cumulative sum calculation along the time axis of a (... x points x dates) array
+    """
+    
+    # do cumsum calculation
+    cumsum = np.cumsum(residuals, axis=-1)
+    s_diff = cumsum.max(axis=-1) - cumsum.min(axis=-1)
+    
+    # get position of max value
+    argmax = cumsum.argmax(axis=-1)
+    
+    return s_diff, argmax
+
+
+def bootstrap_batch(residuals, lengths, s_diff, nr_bootstraps, rngs, chunk_size=None):
+    """
+    Bootstrap procedure of cusum_deforest, vectorised over points and replicates
+    
+    Parameters
+    ----------
+    residuals : 2-D float array
+        residuals of shape (points x dates), padded with zeros at the end
+    lengths : 1-D int array
+        number of valid dates per point
+    s_diff : 1-D float array
+        original cusum magnitude per point
+    nr_bootstraps : int
+        number of bootstrap replicates
+    rngs : list of numpy.random.Generator
+        random number generator of each point used for its shuffles
+    chunk_size : int, optional
+        number of replicates processed at once. By default chosen 
+        to keep the shuffled stack at a few million elements
+        
+    Returns
+    -------
+    change_point_confidence : 1-D float array
+        confidence per point
+    """
+    
+    nr_points, nr_dates = residuals.shape
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(nr_points * nr_dates, 1))
+    
+    comparison_array, change_sum = np.zeros(nr_points), np.zeros(nr_points)
+    for start in range(0, nr_bootstraps, chunk_size):
+        
+        # shuffle each row of each replicate independently, padded positions stay at the end
+        keys = random_keys(rngs, lengths, min(chunk_size, nr_bootstraps - start), nr_dates)
+        shuffled = np.take_along_axis(residuals[None], keys.argsort(axis=-1), axis=-1)
+        
+        # run cumsum on re-shuffled stack
+        s_diff_bs, _ = cusum_calculation_batch(shuffled)
+        
+        # compare if s_diff_bs is greater and sum up over replicates
+        comparison_array += np.greater(s_diff, s_diff_bs).sum(axis=0)
+        change_sum += s_diff_bs.sum(axis=0)
+    
+    # calculate final confidence and significance (0 where tf would divide by zero)
+    confidences = comparison_array / nr_bootstraps
+    mean_change = change_sum / nr_bootstraps
+    significance = 1 - np.divide(mean_change, s_diff, out=np.zeros(nr_points), where=s_diff != 0)
+    
+    return confidences * significance
+
+
+def cusum_deforest_batch(data, dates, nr_bootstraps, seed=None, chunk_size=None, indices=None):
+    """
+    Batched version of cusum_deforest over all points of a grid cell
+    
+    Parameters
+    ----------
+    data : 2-D float array
+        time-series values of shape (points x dates), NaN padded
+    dates : 2-D float array
+        fractional year dates of the same shape as data
+    nr_bootstraps : int
+        number of bootstrap replicates
+    seed : int, optional
+        seed for the bootstrap shuffles
+    chunk_size : int, optional
+        number of bootstrap replicates processed at once
+    indices : list of int, optional
+        point indices seeding the shuffles of each point (see point_rngs), 
+        defaults to the row positions
+        
+    Returns
+    -------
+    date : 1-D float array
+        Change Date in fractional year date format (0 for empty series)
+    confidence : 1-D float array
+        Change confidence based on the bootstrapping procedure
+    magnitude : 1-D float array
+        Change magnitude based on the s_max parameter
+    """
+    
+    data = np.asarray(data, dtype='float32')
+    valid = np.isfinite(data)
+    stack = np.where(valid, data, 0).astype('float64')
+    lengths = valid.sum(axis=1)
+    
+    # calculate mean
+    mean = np.divide(stack.sum(axis=1), lengths, out=np.zeros(len(stack)), where=lengths > 0)
+    
+    # calculate residuals and treat original nans (and padding) as zeros
+    residuals = np.where(stack == 0, 0, stack - mean[:, None])
+    
+    # get original cumsum calculation and dates
+    s_diff, argmax = cusum_calculation_batch(residuals)
+    
+    empty = lengths == 0
+    date = np.where(empty, 0, np.take_along_axis(dates, argmax[:, None], axis=1)[:, 0])
+    magnitude = np.where(empty, 0, s_diff)
+    
+    # get confidence from bootstrap procedure
+    rngs = point_rngs(seed, range(len(data)) if indices is None else indices)
+    confidence = bootstrap_batch(residuals, lengths, s_diff, nr_bootstraps, rngs, chunk_size)
+    confidence[empty] = 0
+    
+    return date, confidence, magnitude
+
+
+def cusum_deforest_chunk(chunk, nr_bootstraps, seed=None, bootstrap_chunk_size=None):
+    """
+    Runs cusum_deforest_batch on a chunk of (index, ts, dates) items
+    """
+    
+    data, _ = to_padded_array([ts for _, ts, _ in chunk])
+    dates, _ = to_padded_array([dates for _, _, dates in chunk])
+    
+    date, confidence, magnitude = cusum_deforest_batch(
+        data, dates, nr_bootstraps, seed=seed, chunk_size=bootstrap_chunk_size, indices=[i for i, _, _ in chunk]
+    )
+    return list(zip(date, confidence, magnitude))
+
+
+def run_cusum_deforest_batch(store, cusum_params, executor_params=None):
+    """
+    Batched implementation of the cusum_deforest function over a whole grid cell
+    """
+    dates_float = store.date_context.fractional_years
+    args_list = []
+    for i, (start, stop) in enumerate(zip(store.starts, store.stops)):
+        args_list.append((i, store.values[start:stop], dates_float[start:stop]))
+    
+    return to_columns(
+        map_chunks(
+            cusum_deforest_chunk, 
+            args_list, 
+            executor_params, 
+            fargs=[cusum_params['nr_of_bootstraps'], cusum_params.get('seed'), cusum_params.get('bootstrap_chunk_size')]
+        ), 
+        ['cusum_change_date', 'cusum_confidence', 'cusum_magnitude']
+    )
+
+
+def run_cusum_deforest(store, cusum_params, executor_params=None):
     """
     Parallel implementation of the cusum_deforest function
+    
+    Returns a dict of result columns aligned with the points of store
     """
+    if cusum_params.get('batch', False):
+        return run_cusum_deforest_batch(store, cusum_params, executor_params)
+    
     nr_of_bootstraps = cusum_params['nr_of_bootstraps']
-    args_list, d = [], {}
-    for i, row in df.iterrows():
-        dates_float = [date.year + np.round(date.dayofyear/365, 3) for date in row.dates]
-        args_list.append([row.ts, dates_float, row.point_id, nr_of_bootstraps])
+    backend = cusum_params.get('backend', 'numpy')
+    dates_float = store.date_context.fractional_years
+    args_list = []
+    for i, (start, stop) in enumerate(zip(store.starts, store.stops)):
+        args_list.append([
+            store.values[start:stop].tolist(), dates_float[start:stop].tolist(), i, nr_of_bootstraps, backend
+        ])
         
-    executor = Executor(executor="concurrent_threads", max_workers=16)
-    for i, task in enumerate(executor.as_completed(
-        func=cusum_deforest,
-        iterable=args_list
-    )):
-        try:
-            d[i] = list(task.result())
-        except ValueError:
-            print("cusum task failed")
-            
-    cusum_df = pd.DataFrame.from_dict(d, orient='index')
-    cusum_df.columns = ['cusum_change_date', 'cusum_confidence', 'cusum_magnitude', 'point_id']
-    return pd.merge(df, cusum_df, on='point_id')    
\ No newline at end of file
+    return to_columns(
+        map_points(cusum_deforest, args_list, executor_params), 
+        ['cusum_change_date', 'cusum_confidence', 'cusum_magnitude']
+    )
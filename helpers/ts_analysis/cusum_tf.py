@@ -0,0 +1,51 @@
+"""
+TensorFlow backend of the cusum_deforest function. 
+
+This module is only imported when the 'tensorflow' backend is selected 
+via cusum_params['backend'].
+"""
+import tensorflow as tf 
+
+def cusum_calculation(residuals):
+    
+    # do cumsum calculation
+    cumsum = tf.math.cumsum(residuals, axis=0)
+    s_max = tf.math.reduce_max(cumsum, axis=0)
+    s_min = tf.math.reduce_min(cumsum, axis=0)
+    s_diff = tf.subtract(s_max, s_min)
+   
+    # get podition of max value
+    argmax = tf.math.argmax(cumsum, axis=0)
+                
+    return s_diff, argmax
+
+
+def bootstrap(stack, s_diff, nr_bootstraps):
+    
+    # intialize iteration variables
+    i, comparison_array, change_sum = 0, tf.zeros(s_diff.shape), tf.zeros(s_diff.shape)
+    while i < nr_bootstraps:
+        
+        # shuffle first axis 
+        shuffled_index = tf.random.shuffle(range(stack.shape[0]))
+        
+        # run cumsum on re-shuffled stack
+        s_diff_bs, _ = cusum_calculation(tf.gather(stack, shuffled_index, axis=0))
+        
+        # compare if s_diff_bs is greater and sum up
+        comparison_array += tf.cast(tf.greater(s_diff, s_diff_bs), 'float32') 
+        
+        # sum up random change magnitude s_diff_bs 
+        change_sum += s_diff_bs
+        
+        # set counter
+        i+=1
+    
+    # calculate final confidence and significance
+    confidences = tf.math.divide_no_nan(comparison_array, nr_bootstraps)
+    signficance = tf.math.subtract(1, tf.math.divide_no_nan(tf.math.divide_no_nan(change_sum, nr_bootstraps), s_diff))
+    
+    # calculate final confidence level
+    change_point_confidence = tf.math.multiply(confidences, signficance)
+    
+    return change_point_confidence
@@ -0,0 +1,126 @@
+import hashlib
+from functools import lru_cache
+from collections import OrderedDict
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+# design matrices by date vector and model parameters, shared by all grid cells of a process
+_design_matrices = OrderedDict()
+MAX_DESIGN_MATRICES = 256
+
+
+@lru_cache(maxsize=None)
+def parse_date(date):
+    """ Helper function to parse a 'YYYY-MM-DD' date string, once per string
+    """
+    return dt.strptime(date, '%Y-%m-%d')
+
+
+@lru_cache(maxsize=None)
+def to_day_number(date):
+    """ Helper function to transform a 'YYYY-MM-DD' date string into a day number (days since 1970-01-01)
+    """
+    return int(np.datetime64(parse_date(date).date(), 'D').astype('int64'))
+
+
+def to_fractional_year(days):
+    """ Helper function to transform day numbers (days since 1970-01-01) into fractional years
+
+    Same as date.year + np.round(date.dayofyear/365, 3), but vectorised
+    """
+
+    days = np.asarray(days, dtype='int64').astype('datetime64[D]')
+    years = days.astype('datetime64[Y]')
+    dayofyear = (days - years).astype('int64') + 1
+
+    return years.astype('int64') + 1970 + np.round(dayofyear / 365, 3)
+
+
+def date_key(days):
+    """ Hash of an int date array, used to memoise the transforms of a date vector
+    """
+    return hashlib.sha1(np.ascontiguousarray(days, dtype='int32').tobytes()).hexdigest()
+
+
+def design_matrix(days, freq=365, k=3, trend=False):
+    """
+    Harmonic (and trend) regressors of BFAST Monitor's season-trend model, memoised by date vector
+
+    Time is counted in days since the 1st of January of the first year,
+    as by bfast's map_indices.
+
+    Parameters
+    ----------
+    days : 1-D int array
+        sorted day numbers (days since 1970-01-01)
+
+    Returns
+    -------
+    X : 2-D float array
+        read-only regressors of shape (2 * k + 1 (+ 1 with trend) x dates)
+    """
+
+    key = (date_key(days), freq, k, bool(trend))
+    if key in _design_matrices:
+        _design_matrices.move_to_end(key)
+        return _design_matrices[key]
+
+    days = np.asarray(days, dtype='int64')
+    first_year = days[:1].astype('datetime64[D]').astype('datetime64[Y]').astype('datetime64[D]').astype('int64')
+    t = (days - first_year).astype('float64')
+
+    rows = [np.ones(len(t)), t] if trend else [np.ones(len(t))]
+    for j in range(1, k + 1):
+        rows += [np.sin(j * 2 * np.pi * t / freq), np.cos(j * 2 * np.pi * t / freq)]
+
+    X = np.vstack(rows)
+    X.flags.writeable = False
+    _design_matrices[key] = X
+    if len(_design_matrices) > MAX_DESIGN_MATRICES:
+        _design_matrices.popitem(last=False)
+
+    return X
+
+
+class DateContext:
+    """
+    Date transforms of the date buffer of a TimeSeriesStore
+
+    Fractional years are computed once for the whole buffer and shared
+    by all stages and by all stores viewing the same buffer (e.g. the
+    monitoring period subset). Points sharing the same acquisition dates
+    (e.g. the same path/row) are grouped, so that per date vector work
+    like design matrices is done once per group.
+
+    Parameters
+    ----------
+    dates : 1-D int32 array
+        flat array of day numbers
+    """
+
+    def __init__(self, dates):
+        self.dates = dates
+        self._fractional_years = None
+
+    @property
+    def fractional_years(self):
+        """ Fractional years of all dates of the buffer
+        """
+        if self._fractional_years is None:
+            self._fractional_years = to_fractional_year(self.dates)
+        return self._fractional_years
+
+    def groups(self, starts, stops):
+        """
+        Groups points with identical date vectors
+
+        Returns
+        -------
+        group : 1-D int array
+            group index of each point
+        """
+        vectors = [self.dates[start:stop].tobytes() for start, stop in zip(starts, stops)]
+        group, _ = pd.factorize(pd.Series(vectors, dtype=object))
+        return group
@@ -1,20 +1,43 @@
 import numpy as np
-from datetime import datetime as dt
 
-def subset_ts(row, start_monitor):
+from helpers.ts_analysis.dates import to_day_number
+
+def subset_ts(store, start_monitor):
     """ Helper function to extract only monitoring period
+    
+    Returns a TimeSeriesStore sharing the buffers of store, 
+    holding only dates after start_monitor
     """
     
-    # create index for monitoring period
-    idx = row.dates > dt.strptime(start_monitor, '%Y-%m-%d')
+    # day number of the start of the monitoring period, parsed once per run
+    return store.subset_dates(start=to_day_number(start_monitor))
+
+
+def to_padded_array(series, fill=np.nan, dtype='float64'):
+    """ Helper function to pack ragged per-point series into one 2-D array
     
-    # subset dates
-    dates = row.dates[idx]
+    Parameters
+    ----------
+    series : list
+        list of per-point sequences (e.g. the ts column of a grid cell)
+    fill : float
+        value used for padding the shorter series
+        
+    Returns
+    -------
+    padded : 2-D array
+        array of shape (points x max. series length), padded at the end
+    lengths : 1-D int array
+        original length of each series
+    """
     
-    # subset ts data
-    ts = np.array(row.ts)[idx].tolist()
+    # keep at least one column, so reductions along the time axis never see an empty axis
+    lengths = np.array([len(s) for s in series], dtype='int64')
+    padded = np.full((len(series), lengths.max(initial=1)), fill, dtype=dtype)
     
-    # get new image length
-    images = len(ts)
+    # mask of valid positions, which are always aligned to the start of a row
+    valid = np.arange(padded.shape[1]) < lengths[:, None]
+    if valid.any():
+        padded[valid] = np.concatenate([np.asarray(s, dtype=dtype) for s in series if len(s)])
     
-    return dates, ts, images
\ No newline at end of file
+    return padded, lengths
@@ -0,0 +1,133 @@
+import os
+from functools import partial
+
+import numpy as np
+from godale import Executor
+
+# default execution parameters of the analysis stages
+defaults = {
+    'executor': 'processes',
+    'workers': os.cpu_count(),
+    'chunk_size': 250
+}
+
+# executor kinds mapped to godale's implementations
+EXECUTORS = {
+    'threads': 'concurrent_threads',
+    'processes': 'concurrent_processes',
+    'serial': None
+}
+
+def get_executor_params(executor_params=None):
+    """
+    Completes a (partial) dict of execution parameters with the defaults
+    """
+    params = defaults.copy()
+    params.update({k: v for k, v in (executor_params or {}).items() if v is not None})
+    if params['executor'] not in EXECUTORS:
+        raise ValueError(f"Unknown executor '{params['executor']}'. Choose one of {list(EXECUTORS)}.")
+    
+    return params
+
+
+def map_chunks(func, items, executor_params=None, fargs=None):
+    """
+    Applies a function to chunks of items in parallel
+    
+    Parameters
+    ----------
+    func : function
+        module level function taking a list of items (and fargs) 
+        and returning a list of results of the same length
+    items : list
+        items to process, e.g. one args list per point
+    executor_params : dict, optional
+        'executor' ('threads', 'processes' or 'serial'), 'workers' and 
+        'chunk_size', i.e. the number of items sent to a worker per task
+    fargs : list, optional
+        additional arguments passed to func after the chunk
+        
+    Returns
+    -------
+    results : list
+        flat list of results in the order of items
+    """
+    
+    params, fargs = get_executor_params(executor_params), fargs or []
+    chunk_size = max(1, int(params['chunk_size']))
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    
+    if params['executor'] == 'serial' or len(chunks) <= 1:
+        results = [func(chunk, *fargs) for chunk in chunks]
+    else:
+        executor = Executor(executor=EXECUTORS[params['executor']], max_workers=params['workers'])
+        results = [task.result() for task in executor.map(func=func, iterable=chunks, fargs=fargs)]
+    
+    return [result for chunk_results in results for result in chunk_results]
+
+
+def apply_to_chunk(chunk, func):
+    """
+    Applies a per-point function to a chunk of args lists, failed points yield None
+    """
+    results = []
+    for args in chunk:
+        try:
+            results.append(func(args))
+        except ValueError:
+            print(f"{func.__name__} task failed")
+            results.append(None)
+    
+    return results
+
+
+def map_points(func, args_list, executor_params=None):
+    """
+    Applies a per-point function to a list of args lists in chunks and in parallel
+    
+    The results stay aligned with args_list, with None for the failed points.
+    """
+    return map_chunks(partial(apply_to_chunk, func=func), args_list, executor_params)
+
+
+def point_rngs(seed, indices):
+    """
+    Returns one random number generator per point, seeded by seed and the point's index
+    
+    Each point draws from its own child stream, so seeded results of the bootstrap 
+    stages do not depend on how the points are chunked or scheduled. Without a 
+    seed, the streams are spawned from fresh entropy.
+    """
+    if seed is None:
+        return [np.random.default_rng(s) for s in np.random.SeedSequence().spawn(len(indices))]
+    return [np.random.default_rng([seed, int(i)]) for i in indices]
+
+
+def random_keys(rngs, lengths, nr_replicates, nr_dates):
+    """
+    Uniform random keys of shape (replicates x points x dates) from the generator of each point
+    
+    A point only draws keys for its own length, the padded positions get the key 2,
+    so that they sort after all observations.
+    """
+    keys = np.full((nr_replicates, len(rngs), nr_dates), 2.0)
+    for i, (rng, length) in enumerate(zip(rngs, lengths)):
+        keys[:, i, :length] = rng.random((nr_replicates, length))
+    return keys
+
+
+def to_columns(results, columns):
+    """
+    Packs aligned per-point result tuples into a dict of float64 result columns
+    
+    Failed points (None) get NaN in all columns and are flagged in the 'failed' 
+    entry. Elements of a tuple beyond the columns (e.g. the point_id) are dropped.
+    """
+    failed = np.array([result is None for result in results], dtype=bool)
+    table = np.full((len(results), len(columns)), np.nan)
+    if not failed.all():
+        table[~failed] = np.array(
+            [result[:len(columns)] for result in results if result is not None], dtype='float64'
+        )
+    
+    return dict({column: table[:, i] for i, column in enumerate(columns)}, failed=failed)
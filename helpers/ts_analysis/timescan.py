@@ -1,42 +1,119 @@
 import numpy as np
-from scipy import stats
-import pandas as pd
-from godale import Executor
-    
-def calc_timescan_metrics(args):
-    
-    ts, point_id, outlier_removal, z_threshhold = args
-    if ts:
-        if outlier_removal:
-            z_score = np.abs(stats.zscore(np.array(ts)))
-            ts_out = np.ma.MaskedArray(ts, mask=z_score > z_threshhold)
-        else:
-            ts_out = df.ts
-
-        return np.nanmean(ts_out), np.nanstd(ts_out), np.nanmin(ts_out), np.nanmax(ts_out), point_id
-    else:
-        return 0, 0, 0, 0, point_id
-    
-    
-def run_timescan_metrics(df, ts_metrics_params):
+
+# optional metrics in addition to mean, sd, min and max
+METRICS = ['median', 'iqr', 'count']
+
+
+def timescan_columns(ts_metrics_params):
+    """
+    Returns the output columns of the timescan metrics for a parameter dict
+    """
+    columns = ['ts_mean', 'ts_sd', 'ts_min', 'ts_max']
+    columns += [f'ts_{metric}' for metric in ts_metrics_params.get('metrics', [])]
+    columns += [f'ts_p{q:g}' for q in ts_metrics_params.get('percentiles', [])]
+    return columns
+
+
+def _percentiles(sorted_values, counts, q):
+    # linear interpolation between the closest ranks, as np.percentile,
+    # on rows sorted with the valid values at the front
+    position = q / 100 * np.maximum(counts - 1, 0)
+    lower = np.floor(position).astype('int64')
+    upper = np.ceil(position).astype('int64')
+    rows = np.arange(len(counts))
+    low, high = sorted_values[rows, lower], sorted_values[rows, upper]
+    return low + (high - low) * (position - lower)
+
+
+def timescan_metrics_batch(values, valid, outlier_removal=True, z_threshhold=3, metrics=(), percentiles=()):
+    """
+    Timescan metrics of many points at once
+
+    Observations with an absolute z-score above z_threshhold are excluded
+    before the metrics are calculated, if outlier_removal is set. Points
+    without observations get 0 for all metrics.
+
+    Parameters
+    ----------
+    values : 2-D float array
+        values of shape (points x dates), padded at the end
+    valid : 2-D bool array
+        mask of the non-padded positions
+    outlier_removal : bool
+        if observations with a z-score above z_threshhold are excluded
+    z_threshhold : float
+        z-score threshold of the outlier removal
+    metrics : list of str, optional
+        additional metrics out of 'median', 'iqr' and 'count'
+    percentiles : list of float, optional
+        additional percentiles (0-100)
+
+    Returns
+    -------
+    metrics : dict
+        1-D float arrays by column name, see timescan_columns
+    """
+
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown timescan metrics {sorted(unknown)}. Choose from {METRICS}.")
+
+    valid = valid & np.isfinite(values)
+
+    def moments(mask):
+        count = mask.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(mask, values, 0).sum(axis=1) / count
+            sd = np.sqrt(np.where(mask, (values - mean[:, None]) ** 2, 0).sum(axis=1) / count)
+        return count, mean, sd
+
+    count, mean, sd = moments(valid)
+    if outlier_removal:
+        # as scipy's zscore, a constant series (sd of 0) keeps all observations
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_score = np.abs(values - mean[:, None]) / sd[:, None]
+        valid = valid & ~(z_score > z_threshhold)
+        count, mean, sd = moments(valid)
+
+    # valid values sorted to the front of each row, for min, max and the percentiles
+    sorted_values = np.sort(np.where(valid, values, np.inf), axis=1)
+    if not sorted_values.shape[1]:
+        sorted_values = np.zeros((len(values), 1))
+
+    results = {
+        'ts_mean': mean,
+        'ts_sd': sd,
+        'ts_min': sorted_values[:, 0],
+        'ts_max': _percentiles(sorted_values, count, 100),
+    }
+    for metric in metrics:
+        if metric == 'median':
+            results['ts_median'] = _percentiles(sorted_values, count, 50)
+        elif metric == 'iqr':
+            results['ts_iqr'] = _percentiles(sorted_values, count, 75) - _percentiles(sorted_values, count, 25)
+        elif metric == 'count':
+            results['ts_count'] = count.astype('float64')
+    for q in percentiles:
+        results[f'ts_p{q:g}'] = _percentiles(sorted_values, count, q)
+
+    # no observations, no metrics
+    empty = count == 0
+    return {column: np.where(empty, 0, result).astype('float64') for column, result in results.items()}
+
+
+def run_timescan_metrics(store, ts_metrics_params, executor_params=None):
     """
-    Parallel implementation of the bootstrap slope function
+    Vectorised implementation of the timescan metrics over a whole grid cell
+
+    The metrics are reductions along the time axis of the padded series,
+    computed in one pass for all points, so no executor is used. Returns
+    a dict of result columns aligned with the points of store.
     """
-    outlier_removal, z_threshhold = ts_metrics_params['outlier_removal'], ts_metrics_params['z_threshhold']
-    args_list, d = [], {}
-    for i, row in df.iterrows(): 
-        args_list.append([row.ts, row.point_id, outlier_removal, z_threshhold])
-        
-    executor = Executor(executor="concurrent_threads", max_workers=16)
-    for i, task in enumerate(executor.as_completed(
-        func=calc_timescan_metrics,
-        iterable=args_list
-    )):
-        try:
-            d[i] = list(task.result())
-        except ValueError:
-            print("timescan task failed")
-            
-    tscan_df = pd.DataFrame.from_dict(d, orient='index')
-    tscan_df.columns = ['ts_mean', 'ts_sd', 'ts_min', 'ts_max', 'point_id']
-    return pd.merge(df, tscan_df, on='point_id')    
\ No newline at end of file
+    values, _, valid = store.to_padded()
+    return timescan_metrics_batch(
+        values, valid,
+        outlier_removal=ts_metrics_params['outlier_removal'],
+        z_threshhold=ts_metrics_params['z_threshhold'],
+        metrics=ts_metrics_params.get('metrics', []),
+        percentiles=ts_metrics_params.get('percentiles', [])
+    )
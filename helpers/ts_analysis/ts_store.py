@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+
+from helpers.ts_analysis.dates import DateContext
+
+
+def to_day_numbers(dates):
+    """ Helper function to transform datetime-likes into int32 day numbers (days since 1970-01-01)
+    """
+    return np.asarray(pd.DatetimeIndex(dates).values.astype('datetime64[D]').astype('int64'), dtype='int32')
+
+
+def to_datetime_index(days):
+    """ Helper function to transform int day numbers back into a DatetimeIndex
+    """
+    return pd.DatetimeIndex(np.asarray(days, dtype='int64').astype('datetime64[D]'))
+
+
+class TimeSeriesStore:
+    """
+    Columnar store of the time-series of all points of a grid cell
+    
+    All observations live in two flat arrays, ordered by point and date. The 
+    series of point i are the slices values[starts[i]:stops[i]] and 
+    dates[starts[i]:stops[i]], so that subsets in time or by point only 
+    create new start/stop arrays and share the underlying buffers. Several 
+    bands of the same observations are held as columns of a 2-D values 
+    array, band() returns the store of a single band on the same buffers.
+    
+    Parameters
+    ----------
+    values : 1-D or 2-D float32 array
+        flat array of all observations, of shape (observations x bands) for several bands
+    dates : 1-D int32 array
+        flat array of day numbers (days since 1970-01-01) of the observations
+    starts, stops : 1-D int64 arrays
+        start (inclusive) and stop (exclusive) position of each point
+    context : DateContext, optional
+        date transforms of the dates buffer, shared by stores on the same buffers
+    bands : list of str, optional
+        band names of the columns of values
+    """
+    
+    def __init__(self, values, dates, starts, stops, context=None, bands=None):
+        self.values = np.asarray(values, dtype='float32')
+        self.dates = np.asarray(dates, dtype='int32')
+        self.starts = np.asarray(starts, dtype='int64')
+        self.stops = np.asarray(stops, dtype='int64')
+        self._context = context
+        self.bands = None if bands is None else list(bands)
+    
+    @classmethod
+    def from_offsets(cls, values, dates, offsets, bands=None):
+        """ Creates a store from CSR-style offsets of length points + 1
+        """
+        offsets = np.asarray(offsets, dtype='int64')
+        return cls(values, dates, offsets[:-1], offsets[1:], bands=bands)
+    
+    @classmethod
+    def from_lists(cls, ts_list, dates_list):
+        """ Creates a store from per-point lists of values and datetime-like dates
+        """
+        lengths = np.array([len(ts) for ts in ts_list], dtype='int64')
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        values = np.concatenate([np.asarray(ts, dtype='float32') for ts in ts_list]) if len(ts_list) else []
+        dates = np.concatenate([to_day_numbers(dates) for dates in dates_list]) if len(dates_list) else []
+        return cls.from_offsets(values, dates, offsets)
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    @property
+    def lengths(self):
+        return self.stops - self.starts
+    
+    @property
+    def nr_of_bands(self):
+        return 1 if self.values.ndim == 1 else self.values.shape[1]
+    
+    def band(self, name):
+        """ Returns the single band store of a band, sharing dates, offsets and date context
+        """
+        if self.values.ndim == 1:
+            if self.bands is not None and name not in self.bands:
+                raise ValueError(f"Unknown band '{name}'. Choose one of {self.bands}.")
+            return self
+        
+        if self.bands is None or name not in self.bands:
+            raise ValueError(f"Unknown band '{name}'. Choose one of {self.bands}.")
+        i = self.bands.index(name)
+        return TimeSeriesStore(self.values[:, i], self.dates, self.starts, self.stops, self.date_context, [name])
+    
+    def select(self, names):
+        """ Returns the store of a list of bands, a single band store if only one band is selected
+        """
+        if len(names) == 1:
+            return self.band(names[0])
+        
+        missing = [name for name in names if self.values.ndim == 1 or name not in (self.bands or [])]
+        if missing:
+            raise ValueError(f"Unknown bands {missing}. Choose from {self.bands}.")
+        idx = [self.bands.index(name) for name in names]
+        if idx == list(range(self.nr_of_bands)):
+            return self
+        return TimeSeriesStore(self.values[:, idx], self.dates, self.starts, self.stops, self.date_context, names)
+    
+    @property
+    def date_context(self):
+        """ DateContext of the dates buffer, created on first use and shared with subsets
+        """
+        if self._context is None:
+            self._context = DateContext(self.dates)
+        return self._context
+    
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.dates.nbytes + self.starts.nbytes + self.stops.nbytes
+    
+    def series(self, i):
+        """ Returns views on values and day numbers of point i
+        """
+        return self.values[self.starts[i]:self.stops[i]], self.dates[self.starts[i]:self.stops[i]]
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.series(i)
+    
+    def take(self, idx):
+        """ Returns a store of a subset of points, sharing the buffers
+        """
+        return TimeSeriesStore(self.values, self.dates, self.starts[idx], self.stops[idx], self.date_context, self.bands)
+    
+    def compact(self):
+        """ Returns a store with contiguous buffers holding only the observations of its points
+
+        After subsets in time or by point the buffers still hold all observations,
+        compacting drops them before a store is written or sent to another process.
+        """
+        lengths = self.lengths
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        idx = np.repeat(self.starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return TimeSeriesStore.from_offsets(self.values[idx], self.dates[idx], offsets, self.bands)
+
+    def subset_dates(self, start=None, end=None):
+        """ Returns a store restricted to start < date <= end, sharing the buffers
+        
+        start and end are day numbers or anything pandas can turn into a date.
+        """
+        
+        def nr_before(day):
+            # number of observations per point that are on or before day
+            if not isinstance(day, (int, np.integer)):
+                day = to_day_numbers([day])[0]
+            counts = np.concatenate([[0], np.cumsum(self.dates <= day)])
+            return counts[self.stops] - counts[self.starts]
+        
+        starts = self.starts if start is None else self.starts + nr_before(start)
+        stops = self.stops if end is None else self.starts + nr_before(end)
+        return TimeSeriesStore(self.values, self.dates, starts, np.maximum(stops, starts), self.date_context, self.bands)
+    
+    def to_padded(self, fill=np.nan):
+        """ Packs the series into (points x max. length) arrays of values and day numbers
+        
+        Returns
+        -------
+        values : 2-D (or 3-D, points x max. length x bands) float array
+            values padded at the end with fill
+        dates : 2-D int32 array
+            day numbers, padded with -1
+        valid : 2-D bool array
+            mask of the non-padded positions
+        """
+        lengths = self.lengths
+        valid = np.arange(lengths.max(initial=0)) < lengths[:, None]
+        
+        # positions of each (point, position) pair within the flat buffers
+        idx = (self.starts[:, None] + np.arange(valid.shape[1]))[valid]
+        values = np.full(valid.shape + self.values.shape[1:], fill, dtype='float64')
+        values[valid] = self.values[idx]
+        dates = np.full(valid.shape, -1, dtype='int32')
+        dates[valid] = self.dates[idx]
+        return values, dates, valid
+    
+    def to_lists(self):
+        """ Returns the per-point lists of values and DatetimeIndexes (e.g. for export)
+        """
+        ts_list = [values.tolist() for values, _ in self]
+        dates_list = [to_datetime_index(dates) for _, dates in self]
+        return ts_list, dates_list
@@ -0,0 +1,118 @@
+import json
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from helpers.checkpoint import CheckpointStore, atomic_path, to_arrow, from_arrow
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+from helpers.ts_analysis.ccdc import extraction_bands, runs_locally
+
+# settings of the extraction that change the extracted data
+EXTRACTION_PARAMS = ['start_date', 'end_date', 'point_id', 'grid_size', 'points_per_cell', 'max_cell_cost', 'band', 'satellite']
+
+
+def extraction_key(aoi, fc, config_dict):
+    """
+    Hash of everything that determines the extracted time-series of the grid cells
+
+    AOI and point collection enter with their serialized EE graphs, so the same
+    definition always maps to the same key, independent of the work_dir. A local
+    CCDC adds its bands. A CCDC on EE adds its results to the point tables, so
+    all its parameters and its start of the monitoring period enter the key.
+    """
+    ccdc_params = config_dict['ccdc_params']
+    if runs_locally(ccdc_params):
+        ccdc = extraction_bands(config_dict)
+    elif ccdc_params['run']:
+        ccdc = dict(ccdc_params, start_monitor=ccdc_params.get('start_monitor') or config_dict['ts_params']['start_monitor'])
+    else:
+        ccdc = False
+
+    settings = dict(
+        aoi=aoi.serialize(),
+        points=fc.serialize(),
+        ts_params={param: config_dict['ts_params'].get(param) for param in EXTRACTION_PARAMS},
+        ccdc=ccdc
+    )
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class TimeSeriesCache(CheckpointStore):
+    """
+    Cache of the raw extracted time-series of the grid cells
+
+    Each cell is stored as a directory holding the flat buffers of its
+    TimeSeriesStore as .npy files (values, dates and offsets), which are
+    memory-mapped on reading, and the point table as Parquet. Cell states
+    are kept in a manifest as for the CheckpointStore.
+
+    Parameters
+    ----------
+    cache_dir : str or Path
+        directory of the cache, one per extraction key
+    """
+
+    @classmethod
+    def for_extraction(cls, aoi, fc, config_dict):
+        """
+        Opens the cache of an extraction and links it to the work_dir of the config
+
+        The cache lives in ts_cache_dir (default: work_dir/ts_cache) in a
+        sub-directory named by the extraction key, so runs in different work_dirs
+        can share a cache directory.
+        """
+        work_dir = Path(config_dict['work_dir'])
+        cache_root = Path(config_dict.get('ts_cache_dir') or work_dir.joinpath('ts_cache'))
+        cache = cls(cache_root.joinpath(extraction_key(aoi, fc, config_dict)))
+
+        with open(work_dir.joinpath('ts_cache.json'), 'w') as f:
+            json.dump({'path': str(cache.work_dir.resolve())}, f)
+        return cache
+
+    @classmethod
+    def for_work_dir(cls, work_dir):
+        """
+        Opens the cache linked to a work_dir by a previous extraction
+        """
+        link = Path(work_dir).joinpath('ts_cache.json')
+        if not link.exists():
+            raise ValueError(f'No time-series cache found for {work_dir}. Run get_change_data first.')
+
+        with open(link) as f:
+            return cls(json.load(f)['path'])
+
+    def result_path(self, idx):
+        return self.cells_dir.joinpath(f'cell_{idx}')
+
+    def write_result(self, idx, df, store=None, runtime=None):
+        """ Writes the extracted points and time-series of a grid cell and marks it as done
+        """
+        store = store.compact()
+        with atomic_path(self.result_path(idx)) as tmp_path:
+            tmp_path.mkdir()
+            np.save(tmp_path.joinpath('values.npy'), store.values)
+            np.save(tmp_path.joinpath('dates.npy'), store.dates)
+            np.save(tmp_path.joinpath('offsets.npy'), np.concatenate([[0], store.stops]))
+            with open(tmp_path.joinpath('bands.json'), 'w') as f:
+                json.dump(store.bands, f)
+            pq.write_table(to_arrow(df), tmp_path.joinpath('points.parquet'))
+        self.record(idx, 'done', len(df), runtime)
+
+    def read_result(self, idx):
+        """ Returns the point table and a TimeSeriesStore on memory-mapped buffers of a grid cell
+        """
+        path = self.result_path(idx)
+        df, _ = from_arrow(pq.read_table(path.joinpath('points.parquet')))
+        bands = None
+        if path.joinpath('bands.json').exists():
+            with open(path.joinpath('bands.json')) as f:
+                bands = json.load(f)
+        store = TimeSeriesStore.from_offsets(
+            np.load(path.joinpath('values.npy'), mmap_mode='r'),
+            np.load(path.joinpath('dates.npy'), mmap_mode='r'),
+            np.load(path.joinpath('offsets.npy')),
+            bands
+        )
+        return df, store
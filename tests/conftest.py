@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the helpers package is imported from the repository root, as by the notebook
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
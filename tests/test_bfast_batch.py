@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+BFASTMonitor = pytest.importorskip('bfast').BFASTMonitor
+
+from helpers.ts_analysis.bfast_wrapper import bfast_monitor_batch, run_bfast_monitor
+from helpers.ts_analysis.ts_store import TimeSeriesStore, to_day_numbers
+from helpers.ts_analysis.dates import to_fractional_year
+
+START_MONITOR = '2019-01-01'
+
+
+def synthetic_series(nr_points=20, seed=0):
+    # two acquisition patterns with gaps, zero values, a break in every other point and some short series
+    rng = np.random.default_rng(seed)
+    series = []
+    for i in range(nr_points):
+        start = pd.Timestamp('2013-04-01') + pd.Timedelta(days=int(rng.integers(0, 300)))
+        dates = pd.date_range(start, '2021-12-31', freq='16D' if i % 2 else '8D')
+        dates = dates[rng.random(len(dates)) > 0.2]
+        t = (dates - dates[0]).days.to_numpy()
+        values = 5000 + 1500 * np.sin(2 * np.pi * t / 365 + i) + rng.normal(0, 300, len(dates))
+        if i % 3:
+            values[dates > pd.Timestamp('2019-09-01')] -= 3000
+        values[rng.random(len(dates)) < 0.05] = 0
+        if i % 7 == 0:
+            dates, values = dates[:20], values[:20]
+        series.append((values, dates))
+    return series
+
+
+def reference(values, dates, trend):
+    # bfast's python backend on a single pixel
+    model = BFASTMonitor(
+        start_monitor=datetime.strptime(START_MONITOR, '%Y-%m-%d'), 
+        freq=365, k=3, hfrac=0.25, trend=trend, level=0.05, backend='python'
+    )
+    model.fit(values[:, None, None], list(dates.to_pydatetime()))
+    return model.breaks[0, 0], model.means[0, 0], model.magnitudes[0, 0]
+
+
+def test_batch_matches_bfast_python_backend():
+    series = [(values, dates) for values, dates in synthetic_series() if dates[-1] > pd.Timestamp(START_MONITOR)]
+    days = np.unique(np.concatenate([to_day_numbers(dates) for _, dates in series]))
+    data = np.full((len(series), len(days)), np.nan)
+    for i, (values, dates) in enumerate(series):
+        data[i, np.searchsorted(days, to_day_numbers(dates))] = values
+    
+    for trend in [False, True]:
+        breaks, means, magnitudes = bfast_monitor_batch(data, days, to_day_numbers([START_MONITOR])[0], trend=trend)
+        expected = np.array([reference(values, dates, trend) for values, dates in series])
+        
+        np.testing.assert_array_equal(breaks, expected[:, 0])
+        # bfast computes in float32
+        np.testing.assert_allclose(means, expected[:, 1], rtol=1e-3, atol=1e-3)
+        np.testing.assert_allclose(magnitudes, expected[:, 2], rtol=1e-3, atol=0.5)
+
+
+def test_run_batch_dates_follow_wrapper_indexing():
+    series = synthetic_series()
+    store = TimeSeriesStore.from_lists([values for values, _ in series], [dates for _, dates in series])
+    params = {'run': True, 'batch': True, 'start_monitor': START_MONITOR, 'freq': 365, 'k': 3, 'hfrac': 0.25, 'trend': False, 'level': 0.05}
+    result = run_bfast_monitor(store, params, {'executor': 'serial'})
+    
+    for i, (values, dates) in enumerate(series):
+        mon_dates = dates[dates > pd.Timestamp(START_MONITOR)]
+        if len(mon_dates) == 0:
+            assert result['bfast_change_date'][i] == -2
+            continue
+        brk, mean, magnitude = reference(values, dates, False)
+        if brk < 0:
+            assert result['bfast_change_date'][i] == brk
+            assert result['bfast_magnitude'][i] == 0
+        else:
+            # the date of a break is mon_dates[breaks - 1], as in bfast_monitor
+            expected = to_fractional_year(to_day_numbers([mon_dates[brk - 1]]))[0]
+            assert result['bfast_change_date'][i] == expected
+            assert np.isclose(result['bfast_magnitude'][i], magnitude, rtol=1e-3)
+            assert np.isclose(result['bfast_means'][i], mean, rtol=1e-3, atol=1e-3)
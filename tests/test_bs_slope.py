@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.ts_analysis.bootstrap_slope import run_bs_slope
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+COLUMNS = ['bs_slope_mean', 'bs_slope_sd', 'bs_slope_min', 'bs_slope_max']
+
+
+def synthetic_store(nr_points=40, seed=3):
+    # linear trends of -0.05 per year plus noise, series of different lengths and an empty series
+    rng = np.random.default_rng(seed)
+    ts_list, dates_list = [], []
+    for i in range(nr_points):
+        length = 0 if i == 0 else int(rng.integers(20, 100))
+        dates = pd.date_range('2014-01-01', periods=length, freq='16D')
+        ts_list.append(0.7 - 0.05 * np.arange(length) * 16 / 365.25 + rng.normal(0, 0.005, length))
+        dates_list.append(dates)
+    return TimeSeriesStore.from_lists(ts_list, dates_list)
+
+
+def run(store, executor_params=None, **params):
+    params = dict({'run': True, 'nr_of_bootstraps': 200}, **params)
+    return pd.DataFrame(run_bs_slope(store, params, executor_params or {'executor': 'serial'}))[COLUMNS]
+
+
+def test_slopes():
+    result = run(synthetic_store(), seed=1)
+    assert (result.iloc[0] == 0).all()
+    np.testing.assert_allclose(result['bs_slope_mean'][1:], -0.05, atol=0.01)
+    assert ((result['bs_slope_min'] <= result['bs_slope_mean']) & (result['bs_slope_mean'] <= result['bs_slope_max'])).all()
+
+
+def test_seed_is_reproducible():
+    store = synthetic_store()
+    first = run(store, seed=7, bootstrap_chunk_size=64)
+    pd.testing.assert_frame_equal(first, run(store, seed=7, bootstrap_chunk_size=64))
+    # the replicates only depend on the seed, not on how many are drawn at once
+    pd.testing.assert_frame_equal(first, run(store, seed=7, bootstrap_chunk_size=200))
+    # nor on how the points are chunked and scheduled
+    for executor_params in [{'executor': 'serial', 'chunk_size': 7}, {'executor': 'threads', 'workers': 3, 'chunk_size': 11}]:
+        pd.testing.assert_frame_equal(first, run(store, executor_params, seed=7, bootstrap_chunk_size=64))
+    assert not first.equals(run(store, seed=8, bootstrap_chunk_size=64))
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.ts_analysis.ccdc import ccdc_batch, run_ccdc
+from helpers.ts_analysis.dates import to_fractional_year
+from helpers.ts_analysis.ts_store import TimeSeriesStore, to_day_numbers
+
+BANDS = ['red', 'nir', 'ndvi']
+PARAMS = {'run': True, 'breakpoint_bands': ['red', 'nir'], 'magnitude_band': 'ndvi', 'start_monitor': '2018-01-01'}
+
+
+def synthetic_series(break_date=None, drop=0.3, seed=0):
+    # seasonal red, nir and ndvi every 16 days, with a drop of nir and ndvi from break_date on
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2014-01-01', '2022-12-31', freq='16D')
+    years = to_fractional_year(to_day_numbers(dates))
+    season = np.sin(2 * np.pi * years)
+    values = np.stack([0.05 + 0.02 * season, 0.3 + 0.05 * season, 0.7 + 0.1 * season], axis=1)
+    if break_date is not None:
+        values[dates >= break_date, 1:] -= drop
+    values += rng.normal(0, 0.005, values.shape)
+    return dates, values
+
+
+def store_of(series):
+    offsets = np.concatenate([[0], np.cumsum([len(dates) for dates, _ in series])])
+    values = np.concatenate([values for _, values in series]).astype('float32')
+    dates = np.concatenate([to_day_numbers(dates) for dates, _ in series])
+    return TimeSeriesStore.from_offsets(values, dates, offsets, BANDS)
+
+
+def test_synthetic_break():
+    store = store_of([synthetic_series('2019-06-01'), synthetic_series(seed=1), synthetic_series('2019-06-01', 0.15, seed=2)])
+    results = run_ccdc(store, PARAMS)
+
+    assert not results['failed'].any()
+    # dated at the first observation after the break, 16 days at most
+    break_year = to_fractional_year(to_day_numbers(pd.to_datetime(['2019-06-01'])))[0]
+    assert 0 <= results['ccdc_change_date'][0] - break_year <= 16 / 365
+    assert results['ccdc_change_date'][2] == results['ccdc_change_date'][0]
+    np.testing.assert_allclose(results['ccdc_magnitude'][[0, 2]], [-0.3, -0.15], atol=0.02)
+
+    # no break
+    assert results['ccdc_change_date'][1] == 0 and results['ccdc_magnitude'][1] == 0
+
+
+def test_break_before_monitoring():
+    store = store_of([synthetic_series('2017-01-01')])
+    assert run_ccdc(store, PARAMS)['ccdc_change_date'][0] == 0
+    assert run_ccdc(store, dict(PARAMS, start_monitor='2016-01-01'))['ccdc_change_date'][0] > 2016
+
+
+def test_ccdc_batch_masked_and_padded():
+    # invalid and padded observations are skipped, so they do not move the break
+    dates, values = synthetic_series('2019-06-01')
+    years = to_fractional_year(to_day_numbers(dates))
+    valid = np.ones(len(dates), dtype=bool)
+    valid[::7] = False
+
+    packed = np.zeros((2, len(dates) + 5, 3))
+    packed[0, :len(dates)], packed[1, :valid.sum()] = values, values[valid]
+    packed_years = np.zeros((2, len(dates) + 5))
+    packed_years[0, :len(dates)], packed_years[1, :valid.sum()] = years, years[valid]
+    packed_valid = np.zeros((2, len(dates) + 5), dtype=bool)
+    packed_valid[0, :len(dates)], packed_valid[1, :valid.sum()] = valid, True
+
+    change_date, magnitude = ccdc_batch(packed, packed_years, packed_valid, [0, 1], 2)
+    assert change_date[0] == change_date[1] > 2019
+    assert magnitude[0] == magnitude[1] < 0
+
+    # too short to fit any model
+    change_date, magnitude = ccdc_batch(packed[:, :10], packed_years[:, :10], packed_valid[:, :10], [0, 1], 2)
+    np.testing.assert_array_equal(change_date, 0)
+    np.testing.assert_array_equal(magnitude, 0)
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.checkpoint import CheckpointStore, to_arrow, from_arrow
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+
+def cell_result(nr_of_points=4, bands=None):
+    rng = np.random.default_rng(0)
+    lengths = np.arange(nr_of_points) + 2
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    shape = (offsets[-1],) if bands is None else (offsets[-1], len(bands))
+    dates = np.concatenate([16000 + 16 * np.arange(n) for n in lengths])
+    store = TimeSeriesStore.from_offsets(rng.random(shape).astype('float32'), dates, offsets, bands)
+    df = gpd.GeoDataFrame(
+        dict(point_id=np.arange(nr_of_points), cusum_magnitude=rng.random(nr_of_points), cusum_status='ok'),
+        geometry=gpd.points_from_xy(np.arange(nr_of_points), np.ones(nr_of_points)), 
+        crs="EPSG:4326"
+    )
+    return df, store
+
+
+def assert_same_store(store, expected):
+    assert store.bands == expected.bands
+    np.testing.assert_array_equal(store.lengths, expected.lengths)
+    for (values, dates), (expected_values, expected_dates) in zip(store, expected):
+        np.testing.assert_array_equal(values, expected_values)
+        np.testing.assert_array_equal(dates, expected_dates)
+
+
+@pytest.mark.parametrize('bands', [None, ['ndvi', 'nir']])
+def test_arrow_round_trip(bands):
+    df, store = cell_result(bands=bands)
+    # a subset of points on the shared buffers
+    store = store.take([3, 1, 2, 0])
+    table = to_arrow(df, store)
+    assert table.schema.field('dates').type == pa.list_(pa.date32())
+    
+    result, result_store = from_arrow(table)
+    pd.testing.assert_frame_equal(pd.DataFrame(result.drop(columns='geometry')), pd.DataFrame(df.drop(columns='geometry')))
+    assert result.geometry.equals(df.geometry)
+    assert_same_store(result_store, store)
+    
+    # a slice of a table, as read in batches
+    _, sliced_store = from_arrow(table.slice(1, 2))
+    assert_same_store(sliced_store, store.take([1, 2]))
+
+
+def test_manifest_resume(tmp_path):
+    checkpoints = CheckpointStore(tmp_path)
+    df, store = cell_result()
+    checkpoints.write_result(0, df, store, runtime=1.5)
+    checkpoints.record(1, 'empty')
+    checkpoints.record(2, 'no_data')
+    checkpoints.record(3, 'failed', error='RuntimeError()')
+    
+    # a resumed run opens the same manifest
+    resumed = CheckpointStore(tmp_path)
+    assert resumed.statuses() == {0: 'done', 1: 'empty', 2: 'no_data', 3: 'failed'}
+    assert resumed.pending(range(6)) == [3, 4, 5]
+    assert resumed.is_done(1) and not resumed.is_done(3)
+    assert resumed.status(5) is None
+    assert resumed.progress()['done'] == {'cells': 1, 'points': 4}
+    assert resumed.results() == [(0, resumed.result_path(0))]
+    
+    result, result_store = resumed.read_result(0)
+    np.testing.assert_array_equal(result['point_id'], df['point_id'])
+    assert_same_store(result_store, store)
+
+
+def test_failed_cell_is_retried(tmp_path):
+    checkpoints = CheckpointStore(tmp_path)
+    checkpoints.record(0, 'failed', error='RuntimeError()')
+    assert checkpoints.pending([0]) == [0]
+    
+    checkpoints.write_result(0, *cell_result())
+    assert checkpoints.pending([0]) == []
+    assert checkpoints.status(0) == 'done'
+    # no temporary files are left behind
+    assert [path.name for path in checkpoints.cells_dir.iterdir()] == ['cell_0.parquet']
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.ts_analysis.cusum import run_cusum_deforest
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+COLUMNS = ['cusum_change_date', 'cusum_confidence', 'cusum_magnitude']
+
+
+def synthetic_store(nr_points=40, seed=42):
+    # series of different lengths with a drop in most points, some zero values and an empty series
+    rng = np.random.default_rng(seed)
+    ts_list, dates_list = [], []
+    for i in range(nr_points):
+        length = 0 if i == 0 else int(rng.integers(30, 120))
+        dates = pd.date_range('2014-01-01', periods=length, freq='16D')
+        ts = rng.normal(0.7, 0.05, length)
+        if i % 4:
+            ts[length // 2:] -= 0.2
+        ts[rng.random(length) < 0.05] = 0
+        ts_list.append(ts)
+        dates_list.append(dates)
+    return TimeSeriesStore.from_lists(ts_list, dates_list)
+
+
+def run(store, executor_params=None, **params):
+    params = dict({'run': True, 'nr_of_bootstraps': 1000}, **params)
+    return pd.DataFrame(run_cusum_deforest(store, params, executor_params or {'executor': 'serial'}))[COLUMNS]
+
+
+def test_batch_matches_per_point():
+    store = synthetic_store()
+    per_point = run(store)
+    batch = run(store, batch=True, seed=1)
+    
+    np.testing.assert_array_equal(batch['cusum_change_date'], per_point['cusum_change_date'])
+    # the per-point path computes in float32
+    np.testing.assert_allclose(batch['cusum_magnitude'], per_point['cusum_magnitude'], rtol=1e-4, atol=1e-5)
+    # confidences of independent bootstraps agree within Monte Carlo error
+    np.testing.assert_allclose(batch['cusum_confidence'], per_point['cusum_confidence'], atol=0.05)
+    assert (batch.iloc[0] == 0).all()
+
+
+def test_batch_seed_is_reproducible():
+    store = synthetic_store()
+    first = run(store, batch=True, seed=7, bootstrap_chunk_size=64)
+    pd.testing.assert_frame_equal(first, run(store, batch=True, seed=7, bootstrap_chunk_size=64))
+    # the replicates only depend on the seed, not on how many are shuffled at once
+    pd.testing.assert_frame_equal(first, run(store, batch=True, seed=7, bootstrap_chunk_size=1000))
+    # nor on how the points are chunked and scheduled
+    for executor_params in [{'executor': 'serial', 'chunk_size': 7}, {'executor': 'threads', 'workers': 3, 'chunk_size': 11}]:
+        pd.testing.assert_frame_equal(first, run(store, executor_params, batch=True, seed=7, bootstrap_chunk_size=64))
@@ -0,0 +1,157 @@
+import gzip
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.ee.download import DownloadClient, download_fc, read_features
+
+FEATURES = [
+    {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [10.5 + i, -3.25]}, 'properties': {'point_id': i, 'value': i / 4}}
+    for i in range(200)
+]
+# a feature without point_id
+FEATURES[7]['properties'].pop('point_id')
+
+GEOJSON = json.dumps({'type': 'FeatureCollection', 'columns': {}, 'features': FEATURES}).encode()
+CSV = ('system:index,point_id,value\n' + ''.join(f'{i},{i},{i / 4}\n' for i in range(200))).encode()
+
+
+def small_chunks(data, seed=0):
+    # splits data into chunks of 1 to 7 bytes, cutting through numbers, keys and literals
+    rng = np.random.default_rng(seed)
+    pos = 0
+    while pos < len(data):
+        size = int(rng.integers(1, 8))
+        yield data[pos:pos + size]
+        pos += size
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive, as EE's download servers
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(0.01)
+            body = CSV if self.path.endswith('.csv') else GEOJSON
+            gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+            if gzipped:
+                body = gzip.compress(body)
+            self.send_response(200)
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+    
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.lock, server.in_flight, server.max_in_flight = threading.Lock(), 0, 0
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeCollection:
+    # the download URLs of an ee.FeatureCollection, pointed at the stub server
+    
+    def __init__(self, url):
+        self.url = url
+    
+    def getDownloadUrl(self, filetype):
+        return f'{self.url}/table.{filetype}'
+    
+    def getDownloadURL(self, filetype, selectors):
+        return f'{self.url}/table.{filetype}'
+
+
+def test_gzip_is_decoded(server):
+    client = DownloadClient(pool_size=2)
+    with client.stream(server.url + '/table.geojson') as chunks:
+        assert b''.join(chunks) == GEOJSON
+    
+    stats = client.stats()
+    assert stats['requests'] == 1
+    assert stats['bytes'] == len(GEOJSON)
+    assert stats['transferred_bytes'] == len(gzip.compress(GEOJSON))
+
+
+def test_downloads_are_bounded_and_reuse_connections(server):
+    client = DownloadClient(pool_size=8, max_downloads=3)
+    
+    def download(_):
+        with client.stream(server.url + '/table.geojson') as chunks:
+            return len(b''.join(chunks))
+    
+    with ThreadPoolExecutor(8) as pool:
+        sizes = list(pool.map(download, range(40)))
+    
+    assert sizes == [len(GEOJSON)] * 40
+    assert server.max_in_flight <= 3
+    stats = client.stats()
+    assert stats['requests'] == 40
+    assert stats['bytes'] == 40 * len(GEOJSON)
+    assert stats['transferred_bytes'] < stats['bytes']
+    assert stats['connections'] <= 3
+
+
+def test_download_fc(server):
+    client = DownloadClient(pool_size=1)
+    fc = FakeCollection(server.url)
+    
+    df = download_fc(fc, {'point_id': int, 'value': float}, coordinates=True, client=client)
+    assert len(df) == len(FEATURES)
+    assert df['point_id'].dtype == 'Int64' and df['point_id'].isna().sum() == 1
+    assert df['point_id'][8] == 8
+    np.testing.assert_array_equal(df['value'], np.arange(200) / 4)
+    np.testing.assert_array_equal(df['x'], 10.5 + np.arange(200))
+    
+    df = download_fc(fc, {'point_id': int, 'value': float}, download_format='csv', client=client)
+    pd.testing.assert_frame_equal(df, pd.DataFrame({'point_id': np.arange(200), 'value': np.arange(200) / 4}))
+    
+    # one kept-alive connection for both downloads
+    assert client.stats()['connections'] == 1
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_read_features_from_small_chunks(seed):
+    df = read_features(small_chunks(GEOJSON, seed), {'point_id': int, 'value': float}, coordinates=True)
+    
+    assert len(df) == len(FEATURES)
+    assert df['point_id'].dtype == 'Int64'
+    assert df['point_id'].isna().tolist() == [i == 7 for i in range(200)]
+    np.testing.assert_array_equal(df['point_id'].to_numpy(dtype='float64', na_value=np.nan)[8:], np.arange(8, 200))
+    np.testing.assert_array_equal(df['value'], np.arange(200) / 4)
+    np.testing.assert_array_equal(df['x'], 10.5 + np.arange(200))
+    np.testing.assert_array_equal(df['y'], -3.25)
+
+
+def test_number_split_at_chunk_boundary():
+    chunks = [b'{"type": "FeatureCollection", "features": [{"properties": {"v": 12.', b'5, "n": 1', b'0}}]}']
+    df = read_features(chunks, {'v': float, 'n': int})
+    assert df['v'].tolist() == [12.5] and df['n'].tolist() == [10]
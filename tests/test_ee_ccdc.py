@@ -0,0 +1,109 @@
+import json
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+ee = pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from ee import apitestcase
+
+from helpers.ee.ccdc import ccdc_request, extract_ccdc
+
+CELL = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+
+
+@pytest.fixture
+def ee_offline():
+    # initialises ee with the algorithm definitions shipped with the earthengine-api, without any request
+    case = apitestcase.ApiTestCase()
+    case.setUp()
+    yield
+    case.tearDown()
+
+
+def config(**ccdc_params):
+    return {
+        'ts_params': {'band': 'ndvi', 'start_monitor': '2014-01-01', 'end_date': '2018-12-31', 'point_id': 'PID', 'download_format': 'csv'}, 
+        'ccdc_params': dict({'run': True, 'backend': 'ee'}, **ccdc_params)
+    }
+
+
+def graph(mode, config_dict):
+    lsat = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2')
+    points = ee.FeatureCollection('users/x/points').filter(ee.Filter.inList('PID', list(range(1000))))
+    cell = ee.Geometry.Polygon(CELL['coordinates'])
+    return ccdc_request(lsat, points, cell, config_dict, mode).serialize()
+
+
+def algorithms(serialized):
+    # names of all algorithms called in a serialized graph
+    names = []
+    
+    def walk(node):
+        if isinstance(node, dict):
+            if 'functionName' in node:
+                names.append(node['functionName'])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+    
+    walk(json.loads(serialized))
+    return names
+
+
+def test_image_mode_runs_one_ccdc_for_all_points(ee_offline):
+    names = algorithms(graph('image', config()))
+    assert names.count('TemporalSegmentation.Ccdc') == 1
+    assert names.count('Image.reduceRegions') == 1
+    assert 'Collection.map' in names  # only to clip the images to the cell
+    assert 'Image.reduceRegion' not in names
+
+
+def test_points_mode_maps_ccdc_over_points(ee_offline):
+    names = algorithms(graph('points', config()))
+    assert names.count('TemporalSegmentation.Ccdc') == 1
+    assert 'Image.reduceRegion' in names
+    assert 'Image.reduceRegions' not in names
+
+
+def test_ccdc_params_bands(ee_offline):
+    for mode in ['points', 'image']:
+        assert '"ndvi_magnitude"' in graph(mode, config())
+        serialized = graph(mode, config(magnitude_band='swir1', breakpoint_bands=['nir', 'swir1']))
+        assert '"swir1_magnitude"' in serialized and '"ndvi_magnitude"' not in serialized
+        assert '"green"' not in serialized
+
+
+def test_unknown_mode(ee_offline):
+    with pytest.raises(ValueError):
+        graph('pixels', config())
+
+
+class FakeDownloadClient:
+    # serves the CSV export of the CCDC results of two points
+    
+    def __init__(self):
+        self.urls = []
+    
+    @contextmanager
+    def stream(self, url):
+        self.urls.append(url)
+        yield iter([b'PID,tBreak,ndvi_magnitude\n1,1420070400000,-0.3\n2,0,0\n'])
+
+
+@pytest.mark.parametrize('mode', ['points', 'image'])
+def test_extract_ccdc(ee_offline, mode, capsys):
+    client = FakeDownloadClient()
+    lsat = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2')
+    df = extract_ccdc(lsat, ee.FeatureCollection('users/x/points'), CELL, config(ee_mode=mode), client, np.arange(2))
+    
+    assert len(client.urls) == 1
+    assert list(df['point_id']) == [1, 2]
+    np.testing.assert_allclose(df['ccdc_magnitude'], [-0.3, 0])
+    assert df['ccdc_change_date'][0] > 2014
+    assert f'CCDC in {mode} mode: {2 if mode == "points" else 1} segmentation(s), 1 EE request(s)' in capsys.readouterr().out
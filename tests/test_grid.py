@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.grid import adaptive_grid
+
+
+def inside(box, x, y):
+    return (x >= box[0]) & (y >= box[1]) & (x <= box[2]) & (y <= box[3])
+
+
+def clustered_points(seed=0):
+    # a dense cluster and a sparse background, as typical sample designs
+    rng = np.random.default_rng(seed)
+    x = np.concatenate([rng.normal(10, 0.01, 3000), rng.uniform(0, 20, 1000)])
+    y = np.concatenate([rng.normal(5, 0.01, 3000), rng.uniform(0, 10, 1000)])
+    return x, y
+
+
+def test_points_per_cell():
+    x, y = clustered_points()
+    boxes, members = adaptive_grid(x, y, target=250)
+
+    assert len(boxes) == len(members) > 1
+    assert all(0 < len(idx) <= 250 for idx in members)
+
+    # every point belongs to exactly one cell
+    assert np.array_equal(np.sort(np.concatenate(members)), np.arange(len(x)))
+
+
+def test_cells_cover_points():
+    x, y = clustered_points(1)
+    boxes, members = adaptive_grid(x, y, target=100)
+
+    for box, idx in zip(boxes, members):
+        assert inside(box, x[idx], y[idx]).all()
+        assert box[0] < box[2] and box[1] < box[3]
+
+    # cells do not overlap, so every point lies in exactly one box
+    hits = np.array([inside(box, x, y) for box in boxes])
+    assert (hits.sum(axis=0) == 1).all()
+    assert np.array_equal(hits.argmax(axis=0)[np.concatenate(members)],
+                          np.repeat(np.arange(len(members)), [len(idx) for idx in members]))
+
+    # the partition only depends on the coordinates
+    boxes_again, members_again = adaptive_grid(x, y, target=100)
+    assert np.array_equal(boxes, boxes_again)
+    assert all(np.array_equal(a, b) for a, b in zip(members, members_again))
+
+
+def test_points_on_one_coordinate():
+    # all points on a vertical line, so only y can be split
+    y = np.linspace(0, 1, 1000)
+    x = np.full_like(y, 3.)
+    boxes, members = adaptive_grid(x, y, target=100)
+    assert all(len(idx) <= 100 for idx in members)
+    assert np.allclose(boxes[:, [0, 2]], [3 - 1e-5, 3 + 1e-5])
+
+    # all points at the same location can not be split
+    x, y = np.full(500, 3.), np.full(500, 4.)
+    boxes, members = adaptive_grid(x, y, target=100)
+    assert len(members) == 1 and len(members[0]) == 500
+    assert np.allclose(boxes, [[3 - 1e-5, 4 - 1e-5, 3 + 1e-5, 4 + 1e-5]])
+
+    boxes, members = adaptive_grid([], [], target=100)
+    assert boxes.shape == (0, 4) and members == []
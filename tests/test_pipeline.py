@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.pipeline import run_pipeline
+from helpers.get_change_data import extract_cell
+from helpers.point_index import PointIndex
+from helpers.ee.get_time_series import structure_ts_data
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+
+class FakeExtraction:
+    # thread-safe fake of the I/O stage, recording the extractions in flight
+    
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.in_flight = self.max_in_flight = 0
+    
+    def __call__(self, idx, cell):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.01)
+            if idx in self.fail:
+                raise RuntimeError(f'EE error in cell {idx}')
+            return cell * 10
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def analyse(idx, result):
+    # runs in a worker process, so it has to be a module-level function
+    if result < 0:
+        raise ValueError('negative cell')
+    return result + 1
+
+
+def run(items, extract, **kwargs):
+    written, errors = {}, {}
+    run_pipeline(
+        items, extract, analyse, 
+        write=lambda idx, result: written.update({idx: result}), 
+        on_error=lambda idx, e: errors.update({idx: e}), 
+        workers=2, 
+        **kwargs
+    )
+    return written, errors
+
+
+def test_pipeline_writes_all_cells_within_ee_limit():
+    extract = FakeExtraction()
+    written, errors = run([(idx, idx) for idx in range(30)], extract, ee_limit=4, queue_size=2)
+    
+    assert written == {idx: idx * 10 + 1 for idx in range(30)}
+    assert errors == {}
+    assert extract.max_in_flight <= 4
+
+
+def test_pipeline_reports_failed_cells():
+    extract = FakeExtraction(fail=[3, 5])
+    items = [(idx, -1 if idx == 8 else idx) for idx in range(10)]
+    written, errors = run(items, extract, ee_limit=3)
+    
+    assert sorted(errors) == [3, 5, 8]
+    assert isinstance(errors[3], RuntimeError) and isinstance(errors[8], ValueError)
+    assert sorted(written) == [idx for idx in range(10) if idx not in errors]
+
+
+def test_pipeline_inside_running_event_loop():
+    # e.g. in a jupyter kernel
+    async def main():
+        return run([(idx, idx) for idx in range(5)], FakeExtraction(), ee_limit=2)
+    
+    written, _ = asyncio.run(main())
+    assert written == {idx: idx * 10 + 1 for idx in range(5)}
+
+
+class FakeEarthEngineClient:
+    # implements the methods of EarthEngineClient without any EE request
+    
+    def __init__(self, nr_of_points):
+        self.nr_of_points = nr_of_points
+        self.calls = []
+    
+    def time_series(self, cell, point_ids=None, point_coords=None):
+        self.calls.append('time_series')
+        self.point_coords = point_coords
+        if self.nr_of_points <= 0:
+            return None, None, self.nr_of_points
+        ids = np.arange(self.nr_of_points)
+        dates = [pd.date_range('2015-01-01', periods=5, freq='16D')] * self.nr_of_points
+        store = TimeSeriesStore.from_lists([np.ones(5)] * self.nr_of_points, dates)
+        return pd.DataFrame({'point_id': ids}), store, self.nr_of_points
+    
+    def ccdc(self, cell, point_ids=None):
+        self.calls.append('ccdc')
+        # EE returns the points in any order
+        ids = np.arange(self.nr_of_points)[::-1]
+        return pd.DataFrame({'point_id': ids, 'ccdc_change_date': 2018 + ids / 10, 'ccdc_magnitude': -ids.astype(float), 'extra': 0})
+
+
+def config(ccdc_params):
+    return {'ccdc_params': dict({'run': True}, **ccdc_params)}
+
+
+def test_extract_cell_merges_ee_ccdc_in_store_order():
+    client = FakeEarthEngineClient(4)
+    df, store, nr_of_points, _ = extract_cell(client, 0, 'cell', config({'backend': 'ee'}))
+    
+    assert client.calls == ['time_series', 'ccdc']
+    assert nr_of_points == 4 and len(store) == 4
+    assert list(df.columns) == ['point_id', 'ccdc_change_date', 'ccdc_magnitude']
+    np.testing.assert_array_equal(df['point_id'], np.arange(4))
+    np.testing.assert_allclose(df['ccdc_change_date'], 2018 + np.arange(4) / 10)
+
+
+def test_extract_cell_without_ee_ccdc():
+    # a local CCDC runs as analysis stage instead
+    client = FakeEarthEngineClient(4)
+    extract_cell(client, 0, 'cell', config({'backend': 'local'}))
+    assert client.calls == ['time_series']
+    
+    client = FakeEarthEngineClient(-1)
+    _, store, nr_of_points, _ = extract_cell(client, 0, 'cell', config({'backend': 'ee'}))
+    assert client.calls == ['time_series']
+    assert store is None and nr_of_points == -1
+
+
+def test_csv_points_located_by_point_index():
+    # a tabular download has no geometry, the coordinates come from the point index
+    index = PointIndex([7, 3, 5], [10., 11., 12.], [-1., -2., -3.])
+    point_coords = index.coordinates([5, 3], 'plot')
+    assert list(point_coords.columns) == ['plot', 'x', 'y']
+    np.testing.assert_array_equal(point_coords.x, [12., 11.])
+    
+    client = FakeEarthEngineClient(2)
+    extract_cell(client, 0, 'cell', config({'backend': 'local'}), point_ids=[5, 3], point_coords=point_coords)
+    assert client.point_coords is point_coords
+    
+    df = pd.DataFrame({
+        'plot': [3, 5, 3], 
+        'imageID': ['LC08_001002_20150101', 'LC08_001002_20150101', 'LC08_001002_20150117'], 
+        'pixel_value': [0.5, 0.6, 0.7]
+    })
+    gdf, store = structure_ts_data(df, 'plot', point_coords)
+    np.testing.assert_array_equal(gdf.point_id, [3, 5])
+    np.testing.assert_array_equal(gdf.geometry.x, [11., 12.])
+    np.testing.assert_array_equal(gdf.geometry.y, [-2., -3.])
+    np.testing.assert_array_equal(store.starts, [0, 2])
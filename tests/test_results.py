@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.checkpoint import CheckpointStore
+from helpers.results import finalise_results, read_results
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+
+def cell_result(idx, nr_of_points, **columns):
+    # results of a grid cell with point ids idx * 100 + i
+    ids = idx * 100 + np.arange(nr_of_points)
+    df = gpd.GeoDataFrame(
+        dict(point_id=ids, **columns), geometry=gpd.points_from_xy(ids, np.zeros(nr_of_points)), crs="EPSG:4326"
+    )
+    dates = [pd.date_range('2015-01-01', periods=3, freq='16D')] * nr_of_points
+    return df, TimeSeriesStore.from_lists([np.arange(3) + i for i in range(nr_of_points)], dates)
+
+
+def test_cells_with_different_columns(tmp_path):
+    checkpoints = CheckpointStore(tmp_path)
+    checkpoints.write_result(0, *cell_result(0, 3, cusum_magnitude=[1., 2., 3.]))
+    # a stage failed in this cell, and an all-null column
+    checkpoints.write_result(1, *cell_result(1, 2, bfast_means=[None, None]))
+    checkpoints.write_result(2, *cell_result(2, 2, cusum_magnitude=[4., 5.], bfast_means=[.5, .25]))
+    
+    assert finalise_results(tmp_path) == 7
+    df = read_results(tmp_path).sort_values('point_id', ignore_index=True)
+    np.testing.assert_array_equal(df['point_id'], [0, 1, 2, 100, 101, 200, 201])
+    np.testing.assert_array_equal(df['cusum_magnitude'], [1, 2, 3, np.nan, np.nan, 4, 5])
+    np.testing.assert_array_equal(df['bfast_means'], [np.nan] * 5 + [.5, .25])
+    assert len(gpd.read_file(tmp_path.joinpath('final_results.gpkg'))) == 7
+    np.testing.assert_array_equal(df['ts'][6], [1, 2, 3])
+
+
+def test_outputs_only_hold_current_cells(tmp_path):
+    checkpoints = CheckpointStore(tmp_path)
+    for idx in range(4):
+        checkpoints.write_result(idx, *cell_result(idx, 2))
+    finalise_results(tmp_path, batch_size=3)
+    assert len(read_results(tmp_path)) == 8
+    
+    # e.g. a cell that is no longer finished after re-running on another grid
+    checkpoints.record(3, 'failed')
+    assert finalise_results(tmp_path) == 6
+    assert sorted(read_results(tmp_path)['point_id']) == [0, 1, 100, 101, 200, 201]
+    assert len(gpd.read_file(tmp_path.joinpath('final_results.gpkg'))) == 6
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['cells', 'final_results.gpkg', 'final_results.parquet', 'manifest.sqlite']
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.grid import box_geometry
+from helpers.point_index import PointIndex
+from helpers.scheduler import cell_costs, plan_cells, simulate, simulation_report, synthetic_costs
+
+
+def test_largest_first_makespan():
+    # a dense cell last in grid order starts when all others are done
+    costs = [1.] * 40 + [20.]
+    assert simulate(costs, 4, largest_first=False) == 30
+    assert simulate(costs, 4) == 20
+
+    # largest first is never worse than grid order on heavy-tailed costs
+    for seed in range(5):
+        costs = synthetic_costs(500, seed=seed)
+        ideal = costs.sum() / 8
+        largest_first = simulate(costs, 8)
+        assert ideal <= largest_first <= simulate(costs, 8, largest_first=False)
+        # and within the bound of longest processing time first
+        assert largest_first <= max(4 / 3 * ideal, costs.max())
+
+    # empty cells cost nothing
+    assert simulate([0, 0], 2) == 0
+
+
+def test_split_oversize_cells():
+    costs = [100., 1., 1., 1.]
+    assert simulate(costs, 4) == 100
+    # split into 10 parts of 10
+    assert simulate(costs, 4, max_cost=10) == 30
+    assert simulate(costs, 4, max_cost=100) == 100
+
+
+def test_plan_cells_splits_oversize_cells():
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(0, 1, 1000), rng.uniform(-0.1, 0.1, 1000)
+    index = PointIndex(np.arange(1000), x, y)
+    grid = [box_geometry([0, -0.1, 1, 0.1]), box_geometry([5, 5, 6, 6])]
+    cell_ids = [np.arange(1000), np.array([], dtype=int)]
+
+    max_cost = cell_costs(grid[:1], cell_ids[:1], 10)[0] / 8
+    planned_grid, planned_ids, costs = plan_cells(grid, cell_ids, index, 10, max_cost)
+
+    # the dense cell is replaced by its sub-cells in place, the empty cell is kept
+    assert len(planned_grid) == len(planned_ids) == len(costs) > 8
+    assert planned_grid[-1] == grid[1] and len(planned_ids[-1]) == 0
+    assert np.array_equal(np.sort(np.concatenate(planned_ids[:-1])), cell_ids[0])
+    assert costs.max() <= max_cost * 1.01
+
+    # no splitting without max_cost
+    unchanged_grid, unchanged_ids, _ = plan_cells(grid, cell_ids, index, 10)
+    assert unchanged_grid == grid and unchanged_ids is cell_ids
+
+
+def test_simulation_report(capsys):
+    simulation_report([100., 1., 1., 1.], workers=2, max_cost=10)
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split(':')[0].strip() for line in lines] == [
+        'grid order', 'largest first', 'largest first, split above 10'
+    ]
+    assert lines[1].endswith('1.94 x total work / workers.')
@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.analysis import analyse_cell, stage_keys
+from helpers.stage_cache import StageCache, data_fingerprint
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+
+def cell(nr_of_points=5, shift=0):
+    rng = np.random.default_rng(0)
+    dates = [pd.date_range('2014-01-01', periods=60, freq='16D')] * nr_of_points
+    store = TimeSeriesStore.from_lists([rng.random(60) + shift for _ in range(nr_of_points)], dates)
+    return pd.DataFrame({'point_id': np.arange(nr_of_points)}), store
+
+
+def config(**ts_metrics_params):
+    return {
+        'ts_params': {'band': 'ndvi', 'start_monitor': '2016-01-01'},
+        'ts_metrics_params': dict({'run': True, 'outlier_removal': False, 'z_threshhold': 3}, **ts_metrics_params),
+        'cusum_params': {'run': False},
+        'executor_params': {'executor': 'serial'}
+    }
+
+
+def test_stage_keys():
+    keys = stage_keys(config())
+    assert list(keys) == ['ts_metrics']
+    assert stage_keys(config()) == keys
+    assert stage_keys(config(outlier_removal=True)) != keys
+    
+    # a stage on the monitoring period depends on its start
+    moved = config()
+    moved['ts_params']['start_monitor'] = '2017-01-01'
+    assert stage_keys(moved) != keys
+    
+    # but not on the parameters of other stages
+    other = config()
+    other['bfast_params'] = {'run': False, 'k': 5}
+    assert stage_keys(other) == keys
+
+
+def test_data_fingerprint():
+    df, store = cell()
+    fingerprint = data_fingerprint(df, store)
+    assert data_fingerprint(*cell()) == fingerprint
+    assert data_fingerprint(*cell(shift=1)) != fingerprint
+    assert data_fingerprint(df, store.subset_dates(start='2015-01-01')) != fingerprint
+    # the point order is part of the fingerprint, as cached rows are assigned by position
+    assert data_fingerprint(df.iloc[::-1], store.take(np.arange(5)[::-1])) != fingerprint
+
+
+def run(stage_cache, config_dict, shift=0):
+    df, _ = analyse_cell(*cell(shift=shift), config_dict, stage_cache)
+    return df, stage_cache.stats().loc['ts_metrics'].to_dict()
+
+
+def test_cached_stage_outputs(tmp_path):
+    stage_cache = StageCache(tmp_path)
+    first, stats = run(stage_cache, config())
+    assert stats == {'hits': 0, 'misses': 1}
+    
+    cached, stats = run(stage_cache, config())
+    assert stats == {'hits': 1, 'misses': 1}
+    pd.testing.assert_frame_equal(cached, first)
+    
+    # other parameters or input data are recomputed
+    _, stats = run(stage_cache, config(outlier_removal=True))
+    assert stats == {'hits': 1, 'misses': 2}
+    shifted, stats = run(stage_cache, config(), shift=1)
+    assert stats == {'hits': 1, 'misses': 3}
+    np.testing.assert_allclose(shifted['ts_mean'], first['ts_mean'] + 1, rtol=1e-6)
+
+
+def test_lru_eviction(tmp_path):
+    stage_cache = StageCache(tmp_path)
+    df = pd.DataFrame({'point_id': np.arange(100), 'value': np.arange(100.)})
+    for key in ['a', 'b', 'c']:
+        stage_cache.put('stage', key, df)
+        time.sleep(0.01)
+    size = stage_cache.nbytes // 3
+    
+    # a is used again, so b is the least recently used entry
+    assert stage_cache.get('stage', 'a') is not None
+    time.sleep(0.01)
+    stage_cache.max_bytes = 3 * size
+    stage_cache.put('stage', 'd', df)
+    
+    assert stage_cache.get('stage', 'b') is None
+    for key in ['a', 'c', 'd']:
+        pd.testing.assert_frame_equal(stage_cache.get('stage', key), df)
+    assert stage_cache.nbytes <= stage_cache.max_bytes
+    
+    # a lowered limit evicts on opening
+    assert StageCache(tmp_path, max_bytes=size).nbytes <= size
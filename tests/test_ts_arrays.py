@@ -0,0 +1,98 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+ee = pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from ee import apitestcase
+
+from helpers.ee.get_time_series import ARRAY_BANDS, decode_ts_arrays, structure_ts_data, ts_array_request
+
+BANDS = ['red', 'nir']
+
+
+@pytest.fixture
+def ee_offline():
+    # initialises ee with the algorithm definitions shipped with the earthengine-api, without any request
+    case = apitestcase.ApiTestCase()
+    case.setUp()
+    yield
+    case.tearDown()
+
+
+def algorithms(serialized):
+    # names of all algorithms called in a serialized graph
+    names = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if 'functionName' in node:
+                names.append(node['functionName'])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(serialized))
+    return names
+
+
+def payload():
+    # rows of red, nir, pathrow and day number, as sampled from the array image
+    return pd.DataFrame({
+        'PID': [1, 2, 3, 4, 5],
+        'ts': [
+            [[0.1, 0.3, 1002, 16436], [0.2, 0.4, 1002, 16452]],
+            [],
+            # csv downloads hold the arrays as JSON text, masked bands are unmasked to -9999
+            json.dumps([[0.0, -9999, 1002, 16468], [0.3, 0.0, 2002, 16436], [0.5, 0.0, 1002, 16484]]),
+            '',
+            None
+        ],
+        'x': [1., 2., 3., 4., 5.],
+        'y': [-1., -2., -3., -4., -5.]
+    })
+
+
+def test_decode_ts_arrays():
+    obs = decode_ts_arrays(payload(), 'PID', BANDS)
+
+    # points without observations are dropped
+    assert list(obs.columns) == ['PID', *BANDS, 'pathrow', 'date', 'x', 'y']
+    np.testing.assert_array_equal(obs.PID, [1, 1, 3, 3, 3])
+    np.testing.assert_array_equal(obs.red, [0.1, 0.2, 0.0, 0.3, 0.5])
+    np.testing.assert_array_equal(obs.nir, [0.3, 0.4, -9999, 0.0, 0.0])
+    np.testing.assert_array_equal(obs.pathrow, [1002, 1002, 1002, 2002, 1002])
+    np.testing.assert_array_equal(obs.date, pd.to_datetime(['2015-01-01', '2015-01-17', '2015-02-02', '2015-01-01', '2015-02-18']))
+    np.testing.assert_array_equal(obs.x, [1., 1., 3., 3., 3.])
+
+    # zeros are kept, -9999 is no data
+    gdf, store = structure_ts_data(obs, 'PID', None, BANDS)
+    np.testing.assert_array_equal(gdf.point_id, [1, 3])
+    np.testing.assert_array_equal(gdf.geometry.x, [1., 3.])
+    # only the dominant path/row of point 3 is kept
+    np.testing.assert_array_equal(store.lengths, [2, 2])
+    np.testing.assert_array_equal(store.values[2:], np.array([[0.0, np.nan], [0.5, 0.0]], dtype='float32'))
+
+    empty = decode_ts_arrays(payload().iloc[[1, 3, 4]], 'PID', BANDS)
+    assert len(empty) == 0 and list(empty.columns) == list(obs.columns)
+
+
+def test_ts_array_request_samples_once_per_point(ee_offline):
+    lsat = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2')
+    points = ee.FeatureCollection('users/x/points').filter(ee.Filter.inList('PID', list(range(1000))))
+    serialized = ts_array_request(lsat, points, BANDS).serialize()
+    names = algorithms(serialized)
+
+    # one array image of the stacked collection, sampled by a single reduceRegions
+    assert names.count('ImageCollection.toArray') == 1
+    assert names.count('Image.reduceRegions') == 1
+    assert 'Image.reduceRegion' not in names
+    assert names.count('Collection.map') == 1
+    assert all(f'"{band}"' in serialized for band in [*BANDS, *ARRAY_BANDS, 'ts'])
+    assert '"ndvi"' not in serialized
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# importing helpers needs the earthengine-api and bfast
+pytest.importorskip('ee')
+pytest.importorskip('bfast')
+
+from helpers.ts_cache import TimeSeriesCache, extraction_key
+from helpers.ts_analysis.ts_store import TimeSeriesStore
+
+
+class FakeGraph:
+    # an ee object, identified by its serialized graph
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def serialize(self):
+        return f'{{"{self.name}": {{}}}}'
+
+
+def key(ts_params=None, **ccdc_params):
+    config_dict = {
+        'ts_params': dict({'start_date': '2014-01-01', 'end_date': '2020-12-31', 'start_monitor': '2018-01-01', 'band': 'ndvi', 'point_id': 'PID'}, **(ts_params or {})),
+        'ccdc_params': dict({'run': False}, **ccdc_params)
+    }
+    return extraction_key(FakeGraph('aoi'), FakeGraph('points'), config_dict)
+
+
+def test_extraction_key_without_ccdc():
+    assert key() == key()
+    assert key(ts_params={'band': 'nir'}) != key()
+    # the time-series do not depend on the monitoring period
+    assert key(ts_params={'start_monitor': '2019-01-01'}) == key()
+
+
+def test_extraction_key_of_ee_ccdc():
+    # the point tables hold the CCDC results of EE
+    ee_ccdc = key(run=True, backend='ee')
+    assert ee_ccdc != key()
+    assert key(ts_params={'start_monitor': '2019-01-01'}, run=True, backend='ee') != ee_ccdc
+    assert key(run=True, backend='ee', start_monitor='2019-01-01') != ee_ccdc
+    assert key(run=True, backend='ee', start_monitor='2018-01-01') == ee_ccdc
+    for params in [{'ee_mode': 'image'}, {'breakpoint_bands': ['nir', 'swir1']}, {'magnitude_band': 'swir1'}]:
+        assert key(run=True, backend='ee', **params) != ee_ccdc
+
+
+def test_extraction_key_of_local_ccdc():
+    # only the extracted bands change, the CCDC itself runs as analysis stage
+    local_ccdc = key(run=True, backend='local')
+    assert local_ccdc not in (key(), key(run=True, backend='ee'))
+    assert key(ts_params={'start_monitor': '2019-01-01'}, run=True, backend='local') == local_ccdc
+    assert key(run=True, backend='local', min_observations=8) == local_ccdc
+    assert key(run=True, backend='local', magnitude_band='swir2') != local_ccdc
+
+
+def test_cache_round_trip(tmp_path):
+    cache = TimeSeriesCache(tmp_path)
+    dates = np.concatenate([16436 + 16 * np.arange(3), 16436 + 16 * np.arange(5)])
+    store = TimeSeriesStore.from_offsets(np.arange(16).reshape(8, 2), dates, [0, 3, 8], ['ndvi', 'nir'])
+    df = pd.DataFrame({'point_id': [4, 7], 'ccdc_magnitude': [np.nan, -0.5]})
+    cache.write_result(3, df, store.take([0, 1]), runtime=1)
+    
+    assert cache.is_done(3)
+    result, result_store = TimeSeriesCache(tmp_path).read_result(3)
+    pd.testing.assert_frame_equal(result, df)
+    assert result_store.bands == ['ndvi', 'nir']
+    np.testing.assert_array_equal(result_store.values, store.values)
+    np.testing.assert_array_equal(result_store.dates, store.dates)
+    assert [path.name for path in cache.cells_dir.iterdir()] == ['cell_3']